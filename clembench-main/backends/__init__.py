@@ -1,15 +1,14 @@
 import abc
+import asyncio
 import importlib
 import inspect
 import json
 import os
-import nltk
 import logging
 import logging.config
 from types import SimpleNamespace
-from dataclasses import dataclass
 
-from typing import Dict, List, Tuple, Any, Type, Union
+from typing import Dict, List, Tuple, Any, Type, Union, Iterator, Callable
 
 import yaml
 
@@ -45,12 +44,40 @@ def load_credentials(backend, file_name="key.json") -> Dict:
     return creds
 
 
-@dataclass(frozen=True)
+def _unify(query: Dict, entry: Dict) -> Union[Dict, None]:
+    """
+    :return: the union of both dicts, if the values of their common keys are equal (or unify for nested dicts),
+    otherwise None
+    """
+    result = dict(entry)
+    for key, value in query.items():
+        if key not in entry:
+            result[key] = value
+        elif isinstance(value, dict) and isinstance(entry[key], dict):
+            nested = _unify(value, entry[key])
+            if nested is None:
+                return None
+            result[key] = nested
+        elif value != entry[key]:
+            return None
+    return result
+
+
+def _freeze(value: Any) -> Any:
+    """ :return: a hashable representation of the (nested) value """
+    if isinstance(value, dict):
+        return frozenset((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
 class ModelSpec(SimpleNamespace):
     """
     Base class for model specifications.
     Holds all necessary information to make a model available for clembench: Responsible backend and any arbitrary data
     required by the backend. Also covers non-LLM 'models' like programmatic, slurk and direct user input.
+    Model specs are immutable and hashable, e.g. to be used as dict keys.
     """
     PROGRAMMATIC_SPECS = ["mock", "dry_run", "programmatic", "custom", "_slurk_response"]
     HUMAN_SPECS = ["human", "terminal"]
@@ -58,9 +85,23 @@ class ModelSpec(SimpleNamespace):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+    def __setattr__(self, name, value):
+        raise AttributeError(f"cannot assign to field '{name}' of an immutable ModelSpec")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"cannot delete field '{name}' of an immutable ModelSpec")
+
+    def __eq__(self, other):
+        if not isinstance(other, ModelSpec):
+            return NotImplemented
+        return self.__dict__ == other.__dict__
+
+    def __hash__(self):
+        return hash(_freeze(self.__dict__))
+
     def unify(self, other: "ModelSpec") -> "ModelSpec":
         """ Return whether the other ModelSpec is fully contained within this ModelSpec """
-        result = nltk.featstruct.unify(self.__dict__, other.__dict__)
+        result = _unify(self.__dict__, other.__dict__)
         if result is None:
             raise ValueError(f"{self} does not unify with {other}")
         return ModelSpec(**result)
@@ -138,6 +179,12 @@ class Model(abc.ABC):
         assert arg_name in self.__gen_args, f"No '{arg_name}' in gen_args given but is expected"
         return self.__gen_args[arg_name]
 
+    def get_gen_args(self) -> Dict:
+        """
+        :return: a copy of all arguments set for the generation process
+        """
+        return dict(self.__gen_args)
+
     def get_temperature(self):
         """
         :return: the sampling temperature used for the generation process
@@ -191,6 +238,99 @@ class Model(abc.ABC):
         """
         pass
 
+    async def generate_response_async(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        """Asynchronous variant of generate_response().
+
+        Backends with an asynchronous client should overwrite this method. By default, the (blocking)
+        generate_response() is run in a worker thread, so that the event loop is not blocked.
+
+        Args:
+            messages (List[Dict]): The dialogue context (see generate_response()).
+
+        Returns:
+            Tuple[Any, Any, str]: The prompt object, the response object and the response text
+            (see generate_response()).
+        """
+        return await asyncio.to_thread(self.generate_response, messages)
+
+    def stream_response(self, messages: List[Dict]) -> Tuple[Any, Iterator[str]]:
+        """Generate the response incrementally. Only implemented by backends which support streaming.
+
+        Args:
+            messages (List[Dict]): The dialogue context (see generate_response()).
+
+        Returns:
+            Tuple[Any, Iterator[str]]: The prompt object and a generator of the response text chunks. Closing the
+            generator stops the generation. The generator might provide the fields of the raw response object
+            (e.g. the token usage) as its 'response' attribute once it is closed.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} does not support streaming")
+
+    def supports_streaming(self) -> bool:
+        return type(self).stream_response is not Model.stream_response
+
+    def clean_streamed_text(self, text: str) -> str:
+        """Post-process the streamed response text as generate_response() does, e.g. cull end of sequence strings."""
+        return text.strip()
+
+    def generate_response_with_stop(self, messages: List[Dict],
+                                    stop_predicate: Callable[[str], bool]) -> Tuple[Any, Any, str]:
+        """Generate a response and stop as soon as the stop predicate holds for the text generated so far, e.g. when
+        the first line or an expected pattern is complete. Falls back to generate_response() if the backend does
+        not support streaming.
+
+        Args:
+            messages (List[Dict]): The dialogue context (see generate_response()).
+            stop_predicate (Callable[[str], bool]): Is given the response text generated so far.
+
+        Returns:
+            Tuple[Any, Any, str]: The prompt object, the response object and the response text
+            (see generate_response()).
+        """
+        if not self.supports_streaming():
+            return self.generate_response(messages)
+        prompt, chunks = self.stream_response(messages)
+        text = ""
+        stopped = False
+        try:
+            for chunk in chunks:
+                text += chunk
+                if stop_predicate(text):
+                    stopped = True
+                    break
+        finally:
+            chunks.close()
+        response = dict(getattr(chunks, "response", None) or dict())
+        response.update(response=text, stopped_early=stopped)
+        return prompt, response, self.clean_streamed_text(text)
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        """Count the prompt tokens of the messages for this model (see backends.token_counter).
+
+        Args:
+            messages (List[Dict]): The dialogue context (see generate_response()).
+
+        Returns:
+            int: The number of prompt tokens; exact for models with a known tokenizer, otherwise an estimate.
+        """
+        from backends import token_counter
+        return token_counter.count_tokens(self.model_spec, messages)
+
+    def check_context_limit(self, messages: List[Dict]) -> Tuple[bool, int, int, int]:
+        """Check whether the messages and the maximal response length fit into the context of this model, e.g. to
+        shorten the history before the call instead of handling a ContextExceededError afterwards.
+
+        Args:
+            messages (List[Dict]): The dialogue context (see generate_response()).
+
+        Returns:
+            Tuple[bool, int, int, int]: If the context limit is not exceeded (or unknown), the number of tokens used,
+            the number of tokens left and the context size (the latter two are None, if the context size is unknown).
+        """
+        from backends import token_counter
+        max_new_tokens = self.get_gen_args().get("max_tokens", 100)
+        return token_counter.check_context_limit(self.model_spec, messages, max_new_tokens)
+
 
 class Backend(abc.ABC):
     """ Marker class for a model provider."""
@@ -234,6 +374,23 @@ def is_backend(obj):
 
 _backend_registry: Dict[str, Backend] = dict()  # we store references to the class constructor
 _model_registry: List[ModelSpec] = list()  # we store model specs so that users might use model_name for lookup
+_model_registry_index: Dict[str, List[int]] = dict()  # model_name -> positions of the entries in the registry
+_unnamed_entries: List[int] = list()  # positions of the entries without model_name (match any name)
+_unified_specs: Dict[ModelSpec, ModelSpec] = dict()  # the lookup results
+_response_cache = None  # optional backends.response_cache.ResponseCache which answers repeated requests
+
+
+def set_response_cache(response_cache):
+    """
+    All models returned by get_model_for() afterwards use the response cache.
+    :param response_cache: a backends.response_cache.ResponseCache or None to disable caching
+    """
+    global _response_cache
+    _response_cache = response_cache
+
+
+def get_response_cache():
+    return _response_cache
 
 
 def load_custom_model_registry(_model_registry_path: str = None, is_optional=True):
@@ -260,7 +417,38 @@ def load_model_registry(_model_registry_path: str = None, is_mandatory=True):
                     f"Missing backend definition in model spec '{_model_spec}'. "
                     f"Check or update the backends/model_registry.json and try again."
                     f"A minimal model spec is {{'model_id':<id>,'backend':<backend>}}.")
-            _model_registry.append(_model_spec)
+            _register_model_spec(_model_spec)
+
+
+def _register_model_spec(model_spec: ModelSpec):
+    position = len(_model_registry)
+    _model_registry.append(model_spec)
+    if "model_name" in model_spec:
+        _model_registry_index.setdefault(model_spec.model_name, []).append(position)
+    else:
+        _unnamed_entries.append(position)
+    _unified_specs.clear()
+
+
+def _lookup_model_spec(model_spec: ModelSpec) -> ModelSpec:
+    """
+    :return: the model spec unified with the first registry entry it unifies with (or as is, if there is none)
+    """
+    if model_spec in _unified_specs:
+        return _unified_specs[model_spec]
+    if "model_name" in model_spec:  # only the entries with the same (or no) model_name can unify
+        positions = sorted(_model_registry_index.get(model_spec.model_name, []) + _unnamed_entries)
+    else:
+        positions = range(len(_model_registry))
+    unified_spec = model_spec
+    for position in positions:
+        try:
+            unified_spec = model_spec.unify(_model_registry[position])
+            break  # use first model spec that does unify (doesn't throw an error)
+        except ValueError:
+            continue
+    _unified_specs[model_spec] = unified_spec
+    return unified_spec
 
 
 def _register_backend(backend_name: str):
@@ -313,12 +501,7 @@ def get_model_for(model_spec: Union[str, Dict, ModelSpec]) -> Model:
     if model_spec.is_programmatic():
         return CustomResponseModel(model_spec)
 
-    for registered_spec in _model_registry:
-        try:
-            model_spec = model_spec.unify(registered_spec)
-            break  # use first model spec that does unify (doesn't throw an error)
-        except ValueError:
-            continue
+    model_spec = _lookup_model_spec(model_spec)
 
     if not model_spec.has_backend():
         raise ValueError(
@@ -326,6 +509,8 @@ def get_model_for(model_spec: Union[str, Dict, ModelSpec]) -> Model:
             f"Check or update the backends/model_registry.json or pass the backend directly and try again. "
             f"A minimal model spec is {{'model_id':<id>,'backend':<backend>}}.")
     model = _load_model_for(model_spec)
+    if _response_cache is not None:
+        model = _response_cache.wrap(model)
     return model
 
 
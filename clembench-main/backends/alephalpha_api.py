@@ -1,11 +1,11 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 
 import aleph_alpha_client
 import anthropic
 import backends
 from backends import ModelSpec, Model
 from backends.utils import ensure_messages_format
+from backends.ratelimit import rate_limited
 
 logger = backends.get_logger(__name__)
 
@@ -28,7 +28,7 @@ class AlephAlphaModel(backends.Model):
         super().__init__(model_spec)
         self.client = client
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
         """
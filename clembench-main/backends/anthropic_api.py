@@ -1,13 +1,15 @@
+import asyncio
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import anthropic
 import backends
 import json
 import base64
-import httpx
+from backends import http_client
+from backends.image_cache import cache_image
 import imghdr
 
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, LoopLocal
+from backends.ratelimit import rate_limited, rate_limited_async, without_rate_limit
 
 logger = backends.get_logger(__name__)
 
@@ -17,20 +19,24 @@ NAME = "anthropic"
 class Anthropic(backends.Backend):
     def __init__(self):
         creds = backends.load_credentials(NAME)
-        self.client = anthropic.Anthropic(api_key=creds[NAME]["api_key"])
+        self.client = anthropic.Anthropic(api_key=creds[NAME]["api_key"], http_client=http_client.get_client())
+        self.async_client = LoopLocal(lambda: anthropic.AsyncAnthropic(api_key=creds[NAME]["api_key"],
+                                                                       http_client=http_client.get_async_client()))
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return AnthropicModel(self.client, model_spec)
+        return AnthropicModel(self.client, model_spec, self.async_client)
 
 
 class AnthropicModel(backends.Model):
-    def __init__(self, client: anthropic.Client, model_spec: backends.ModelSpec):
+    def __init__(self, client: anthropic.Client, model_spec: backends.ModelSpec, async_client: LoopLocal = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
+    @cache_image(NAME)
     def encode_image(self, image_path):
         if image_path.startswith('http'):
-            image_bytes = httpx.get(image_path).content
+            image_bytes = http_client.get_client().get(image_path).content
         else:
             with open(image_path, "rb") as image_file:
                 image_bytes = image_file.read()
@@ -83,7 +89,7 @@ class AnthropicModel(backends.Model):
 
         return encoded_messages, system_message
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -106,6 +112,29 @@ class AnthropicModel(backends.Model):
             max_tokens=self.get_max_tokens()
         )
 
+        return self.__to_response(prompt, completion)
+
+    @rate_limited_async(tries=3, logger=logger)
+    @ensure_messages_format
+    async def generate_response_async(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        """
+        Asynchronous variant of generate_response() using the asynchronous Anthropic client.
+        """
+        if self.async_client is None:
+            return await asyncio.to_thread(without_rate_limit(self.generate_response), messages)
+        prompt, system_message = self.encode_messages(messages)
+
+        completion = await self.async_client.get().messages.create(
+            messages=prompt,
+            system=system_message,
+            model=self.model_spec.model_id,
+            temperature=self.get_temperature(),
+            max_tokens=self.get_max_tokens()
+        )
+        return self.__to_response(prompt, completion)
+
+    @staticmethod
+    def __to_response(prompt, completion) -> Tuple[str, Any, str]:
         json_output = completion.model_dump_json()
         response = json.loads(json_output)
         response_text = completion.content[0].text
@@ -1,8 +1,8 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import cohere
 import backends
 from backends.utils import ensure_messages_format
+from backends.ratelimit import rate_limited
 import json
 
 logger = backends.get_logger(__name__)
@@ -26,7 +26,7 @@ class CohereModel(backends.Model):
         super().__init__(model_spec)
         self.client = client
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -1,10 +1,12 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import google.generativeai as genai
 import backends
 from backends.utils import ensure_messages_format
+from backends.ratelimit import rate_limited
+from backends import http_client
+from backends.image_cache import cache_image
 import os
-import requests
+import httpx
 import uuid
 import tempfile
 import imghdr
@@ -41,7 +43,7 @@ class GoogleModel(backends.Model):
 
         try:
             # Send a GET request to the URL
-            response = requests.get(image_url)
+            response = http_client.get_client().get(image_url)
             response.raise_for_status()
 
             # Generate a unique file name
@@ -53,7 +55,7 @@ class GoogleModel(backends.Model):
                 file.write(response.content)
             return file_path
 
-        except requests.RequestException as e:
+        except (httpx.HTTPError, httpx.InvalidURL) as e:  # an invalid URL is not an HTTPError
             print(f"Failed to download {image_url}: {e}")
             return None
 
@@ -65,17 +67,21 @@ class GoogleModel(backends.Model):
         file_url = genai.upload_file(file_path, mime_type=mime_type)
         return file_url
 
+    @cache_image(NAME)
+    def encode_image(self, image_path):
+        if image_path.startswith('http'):
+            image_path = self.download_image(image_path)
+
+        image_type = imghdr.what(image_path)
+        # upload to Gemini server
+        file_url = self.upload_file(image_path, 'image/'+image_type)
+        return file_url
+
     def encode_images(self, images):
         image_parts = []
 
         for image_path in images:
-            if image_path.startswith('http'):
-                image_path = self.download_image(image_path)
-
-            image_type = imghdr.what(image_path)
-            # upload to Gemini server
-            file_url = self.upload_file(image_path, 'image/'+image_type)
-            image_parts.append(file_url)
+            image_parts.append(self.encode_image(image_path))
         return image_parts
 
     def encode_messages(self, messages):
@@ -110,7 +116,7 @@ class GoogleModel(backends.Model):
             encoded_messages_for_logging.append(m_for_logging)
         return encoded_messages, encoded_messages_for_logging
 
-    @retry(tries=10, delay=120, logger=logger)
+    @rate_limited(tries=10, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -0,0 +1,62 @@
+"""
+    A pooled (keep-alive) HTTP client shared by all backends, e.g. to download images and for the API clients,
+    so that connections (and TLS handshakes) are re-used between the turns of all episodes.
+
+    The pool can be tuned with configure() or the environment variables CLEM_HTTP_MAX_CONNECTIONS,
+    CLEM_HTTP_MAX_KEEPALIVE_CONNECTIONS and CLEM_HTTP2 (HTTP/2 is used by default if the h2 package is installed).
+"""
+import importlib.util
+import os
+import threading
+
+import httpx
+
+from backends.utils import LoopLocal
+
+_settings = dict(
+    max_connections=int(os.environ.get("CLEM_HTTP_MAX_CONNECTIONS", 100)),
+    max_keepalive_connections=int(os.environ.get("CLEM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)),
+    keepalive_expiry=60.,
+    timeout=600.,
+    http2=os.environ.get("CLEM_HTTP2", "1") != "0"
+)
+_client: httpx.Client = None
+_async_client = LoopLocal(lambda: httpx.AsyncClient(**_client_args()))
+_lock = threading.Lock()
+
+
+def configure(**settings):
+    """
+    Change the settings of the shared clients; only affects the clients created afterwards.
+    :param settings: max_connections, max_keepalive_connections, keepalive_expiry, timeout (seconds) or http2
+    """
+    global _client, _async_client
+    unknown = set(settings) - set(_settings)
+    assert not unknown, f"Unknown http client settings: {unknown}"
+    with _lock:
+        _settings.update(settings)
+        _client = None
+        _async_client = LoopLocal(lambda: httpx.AsyncClient(**_client_args()))
+
+
+def _client_args():
+    limits = httpx.Limits(max_connections=_settings["max_connections"],
+                          max_keepalive_connections=_settings["max_keepalive_connections"],
+                          keepalive_expiry=_settings["keepalive_expiry"])
+    http2 = _settings["http2"] and importlib.util.find_spec("h2") is not None
+    return dict(limits=limits, timeout=_settings["timeout"], http2=http2, follow_redirects=True)
+
+
+def get_client() -> httpx.Client:
+    global _client
+    with _lock:
+        if _client is None:
+            _client = httpx.Client(**_client_args())
+        return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    :return: the shared client for the running event loop
+    """
+    return _async_client.get()
@@ -2,23 +2,33 @@
     Backend using HuggingFace transformers models.
     Uses HF tokenizers instruct/chat templates for proper input format per model.
 """
-from typing import List, Dict, Tuple, Any, Union
+from typing import List, Dict, Tuple, Any, Union, Iterator
+import collections
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
 import torch
 import backends
 import re
 
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, DynamicCache
+from transformers import TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
 import copy
 
 from jinja2 import TemplateError
 
-from backends.utils import ensure_alternating_roles
+from backends import token_counter
+from backends.utils import ensure_alternating_roles, keep_resident
 
 logger = backends.get_logger(__name__)
 
 FALLBACK_CONTEXT_SIZE = 256
 
 
+@keep_resident
 def load_config_and_tokenizer(model_spec: backends.ModelSpec) -> Union[AutoTokenizer, AutoConfig, int]:
     """
     Load a HuggingFace model's standard config and tokenizer, and get context token limit from config. If the model
@@ -95,6 +105,7 @@ def load_config_and_tokenizer(model_spec: backends.ModelSpec) -> Union[AutoToken
     return tokenizer, model_config, context_size
 
 
+@keep_resident
 def load_model(model_spec: backends.ModelSpec) -> Any:
     """
     Load Huggingface model weights, into VRAM if available. Weights are distributed over all available GPUs for maximum
@@ -120,6 +131,145 @@ def load_model(model_spec: backends.ModelSpec) -> Any:
     return model
 
 
+class GenerationBatcher:
+    """
+    Collects the prompts of concurrent generate_response() calls (e.g. of episodes played in parallel) for up to
+    max_wait_ms and generates the continuations for them with a single, left-padded batch.
+    """
+
+    def __init__(self, model: Any, max_batch_size: int, max_wait_ms: float = 5.):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.__work, name="hf-generation-batcher", daemon=True)
+        self.worker.start()
+
+    def generate(self, prompt_tokens: torch.Tensor, **gen_kwargs) -> torch.Tensor:
+        """
+        Blocks until the batch with the prompt has been generated.
+        :param prompt_tokens: the token ids of a single prompt with shape (1, prompt length)
+        :param gen_kwargs: passed to model.generate(); only prompts with the same gen_kwargs are batched together
+        :return: the prompt and generated token ids with shape (1, length), as model.generate() for a single prompt
+        """
+        future = Future()
+        self.requests.put((prompt_tokens, gen_kwargs, future))
+        return future.result()
+
+    def __work(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            groups = collections.defaultdict(list)
+            for request in batch:
+                groups[tuple(sorted(request[1].items()))].append(request)
+            for group in groups.values():
+                try:
+                    outputs = self.__generate_batch([prompt_tokens for prompt_tokens, _, _ in group], group[0][1])
+                except Exception as e:
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+                for (_, _, future), output in zip(group, outputs):
+                    future.set_result(output)
+
+    def __generate_batch(self, prompts: List[torch.Tensor], gen_kwargs: Dict) -> List[torch.Tensor]:
+        if len(prompts) == 1:
+            return [self.model.generate(prompts[0], **gen_kwargs)]
+        logger.info(f"Generate batch of {len(prompts)} prompts")
+        # decoder-only models continue at the end of the input, so the prompts are padded on the left
+        max_length = max(prompt.shape[-1] for prompt in prompts)
+        input_ids = torch.full((len(prompts), max_length), self.model.generation_config.pad_token_id,
+                               dtype=prompts[0].dtype, device=prompts[0].device)
+        attention_mask = torch.zeros_like(input_ids)
+        for idx, prompt in enumerate(prompts):
+            input_ids[idx, max_length - prompt.shape[-1]:] = prompt[0]
+            attention_mask[idx, max_length - prompt.shape[-1]:] = 1
+        output_ids = self.model.generate(input_ids, attention_mask=attention_mask, **gen_kwargs)
+        eos_token_ids = self.model.generation_config.eos_token_id
+        if eos_token_ids is not None and not isinstance(eos_token_ids, list):
+            eos_token_ids = [eos_token_ids]
+        outputs = []
+        for idx, prompt in enumerate(prompts):
+            new_tokens = output_ids[idx, max_length:]
+            if eos_token_ids:
+                # cut the padding after the eos token of responses which are shorter than the longest in the batch
+                eos_positions = torch.isin(new_tokens, torch.tensor(eos_token_ids, device=new_tokens.device))
+                eos_positions = eos_positions.nonzero()
+                if len(eos_positions) > 0:
+                    new_tokens = new_tokens[:eos_positions[0].item() + 1]
+            outputs.append(torch.cat([prompt[0], new_tokens]).unsqueeze(0))
+        return outputs
+
+
+@keep_resident
+def load_generation_batcher(model_spec: backends.ModelSpec) -> GenerationBatcher:
+    """
+    A single batcher per model spec, so that all players using the model share the batches.
+    :param model_spec: The ModelSpec for the model with a max_batch_size (and optionally batch_wait_ms).
+    """
+    batch_wait_ms = model_spec["batch_wait_ms"] if "batch_wait_ms" in model_spec else 5.
+    return GenerationBatcher(load_model(model_spec), model_spec["max_batch_size"], batch_wait_ms)
+
+
+class PrefixCache:
+    """
+    Keeps the past_key_values of the latest generations, so that a following prompt which starts with the same tokens
+    (e.g. the chat history of the next turn) only needs to encode its new suffix tokens. A cache is cropped to the
+    common prefix, when the prompt diverges from it (e.g. on reprompts).
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: collections.OrderedDict = collections.OrderedDict()  # least recently used first
+        self.entry_ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def pop(self, prompt_tokens: torch.Tensor) -> DynamicCache:
+        """
+        Take the cache with the longest common prefix out of the cache, so that it is not shared by concurrent calls.
+        :param prompt_tokens: the token ids of a single prompt with shape (1, prompt length)
+        :return: the cache cropped to the common prefix with the prompt or a new empty cache
+        """
+        prompt_ids = prompt_tokens[0]
+        with self.lock:
+            best_entry_id, best_length = None, 0
+            for entry_id, (token_ids, _) in self.entries.items():
+                length = _common_prefix_length(token_ids, prompt_ids)
+                if length > best_length:
+                    best_entry_id, best_length = entry_id, length
+            if best_entry_id is None:
+                return DynamicCache()
+            _, cache = self.entries.pop(best_entry_id)
+        # generate() has to encode at least the last prompt token
+        cache.crop(min(best_length, len(prompt_ids) - 1))
+        logger.debug(f"Re-use {cache.get_seq_length()} cached tokens of {len(prompt_ids)} prompt tokens")
+        return cache
+
+    def put(self, token_ids: torch.Tensor, cache: DynamicCache):
+        """
+        :param token_ids: the token ids which are covered by the cache
+        """
+        with self.lock:
+            self.entries[next(self.entry_ids)] = (token_ids, cache)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def _common_prefix_length(token_ids: torch.Tensor, other_token_ids: torch.Tensor) -> int:
+    length = min(len(token_ids), len(other_token_ids))
+    mismatches = (token_ids[:length] != other_token_ids[:length]).nonzero()
+    return mismatches[0].item() if len(mismatches) > 0 else length
+
+
 class HuggingfaceLocal(backends.Backend):
     """
     Model/backend handler class for locally-run Huggingface models.
@@ -157,6 +307,16 @@ class HuggingfaceLocalModel(backends.Model):
 
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
+        # optional batching of concurrent calls (e.g. when episodes are played in parallel)
+        self.batcher = None
+        if "max_batch_size" in model_spec and model_spec["max_batch_size"] > 1:
+            self.batcher = load_generation_batcher(model_spec)
+
+        # optional re-use of the past key values of the previous turns (not combined with batching)
+        self.prefix_cache = None
+        if "prefix_cache_size" in model_spec and model_spec["prefix_cache_size"] > 0 and self.batcher is None:
+            self.prefix_cache = PrefixCache(model_spec["prefix_cache_size"])
+
     def generate_response(self, messages: List[Dict],
                           return_full_text: bool = False,
                           log_messages: bool = False) -> Tuple[Any, Any, str]:
@@ -172,6 +332,43 @@ class HuggingfaceLocalModel(backends.Model):
         :param log_messages: If True, raw and cleaned messages passed will be logged.
         :return: the continuation
         """
+        prompt_tokens, prompt_text, prompt = self.__prepare_prompt(messages, return_full_text, log_messages)
+        gen_kwargs = self.__gen_kwargs()
+
+        if self.batcher is not None:
+            model_output_ids = self.batcher.generate(prompt_tokens, **gen_kwargs)
+        elif self.prefix_cache is not None:
+            cache = self.prefix_cache.pop(prompt_tokens)
+            model_output_ids = self.model.generate(prompt_tokens, past_key_values=cache, **gen_kwargs)
+            self.prefix_cache.put(model_output_ids[0][:cache.get_seq_length()], cache)
+        else:
+            model_output_ids = self.model.generate(prompt_tokens, **gen_kwargs)
+
+        model_output = self.tokenizer.batch_decode(model_output_ids)[0]
+
+        response = {'response': model_output}
+
+        # cull input context; equivalent to transformers.pipeline method:
+        if not return_full_text:
+            response_text = model_output.replace(prompt_text, '').strip()
+
+            if 'output_split_prefix' in self.model_spec:
+                response_text = model_output.rsplit(self.model_spec['output_split_prefix'], maxsplit=1)[1]
+
+            # remove eos token string:
+            eos_to_cull = self.model_spec['eos_to_cull']
+            response_text = re.sub(eos_to_cull, "", response_text)
+        else:
+            response_text = model_output.strip()
+
+        return prompt, response, response_text
+
+    def __prepare_prompt(self, messages: List[Dict], return_full_text: bool = False,
+                         log_messages: bool = False) -> Tuple[torch.Tensor, str, Dict]:
+        """
+        Apply the chat template and check the context limit.
+        :return: the prompt tokens, the prompt text and the prompt object to be logged
+        """
         # log current given messages list:
         if log_messages:
             logger.info(f"Raw messages passed: {messages}")
@@ -201,44 +398,72 @@ class HuggingfaceLocalModel(backends.Model):
             raise backends.ContextExceededError(f"Context token limit for {self.model_spec.model_name} exceeded",
                                                 tokens_used=context_check[1], tokens_left=context_check[2],
                                                 context_size=context_check[3])
+        return prompt_tokens, prompt_text, prompt
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        # use the loaded tokenizer instead of the token counter's
+        return len(self.tokenizer.apply_chat_template(ensure_alternating_roles(messages), add_generation_prompt=True))
 
+    def check_context_limit(self, messages: List[Dict]) -> Tuple[bool, int, int, int]:
+        return _check_context_limit(self.context_size, range(self.count_tokens(messages)),
+                                    max_new_tokens=self.get_gen_args().get("max_tokens", 100))
+
+    def __gen_kwargs(self) -> Dict:
         # greedy decoding:
         do_sample: bool = False
         if self.get_temperature() > 0.0:
             do_sample = True
 
+        gen_kwargs = dict(max_new_tokens=self.get_max_tokens(), do_sample=do_sample)
         if do_sample:
-            model_output_ids = self.model.generate(
-                prompt_tokens,
-                temperature=self.get_temperature(),
-                max_new_tokens=self.get_max_tokens(),
-                do_sample=do_sample
-            )
-        else:
-            model_output_ids = self.model.generate(
-                prompt_tokens,
-                max_new_tokens=self.get_max_tokens(),
-                do_sample=do_sample
-            )
+            gen_kwargs["temperature"] = self.get_temperature()
+        return gen_kwargs
 
-        model_output = self.tokenizer.batch_decode(model_output_ids)[0]
+    def stream_response(self, messages: List[Dict]) -> Tuple[Any, Iterator[str]]:
+        """
+        Streaming variant of generate_response(); the generation runs in a separate thread and is stopped
+        when the returned generator is closed.
+        """
+        prompt_tokens, _, prompt = self.__prepare_prompt(messages)
+        return prompt, self.__stream(prompt_tokens, self.__gen_kwargs())
+
+    def __stream(self, prompt_tokens: torch.Tensor, gen_kwargs: Dict) -> Iterator[str]:
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True)
+        stop = threading.Event()
+        errors = []
+
+        def generate():
+            try:
+                self.model.generate(prompt_tokens, streamer=streamer,
+                                    stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop)]), **gen_kwargs)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=generate, name="hf-stream", daemon=True)
+        thread.start()
+        try:
+            for text in streamer:
+                yield text
+        finally:
+            stop.set()
+            thread.join()
+        if errors:
+            raise errors[0]
 
-        response = {'response': model_output}
+    def clean_streamed_text(self, text: str) -> str:
+        # remove eos token string:
+        return re.sub(self.model_spec['eos_to_cull'], "", text).strip()
 
-        # cull input context; equivalent to transformers.pipeline method:
-        if not return_full_text:
-            response_text = model_output.replace(prompt_text, '').strip()
 
-            if 'output_split_prefix' in self.model_spec:
-                response_text = model_output.rsplit(self.model_spec['output_split_prefix'], maxsplit=1)[1]
+class _StopOnEvent(StoppingCriteria):
+    """ Stops the generation, when the event is set (e.g. because the streamed response is complete). """
 
-            # remove eos token string:
-            eos_to_cull = self.model_spec['eos_to_cull']
-            response_text = re.sub(eos_to_cull, "", response_text)
-        else:
-            response_text = model_output.strip()
+    def __init__(self, event: threading.Event):
+        self.event = event
 
-        return prompt, response, response_text
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
 
 
 def _check_context_limit(context_size, prompt_tokens, max_new_tokens: int = 100) -> Tuple[bool, int, int, int]:
@@ -370,7 +595,8 @@ def check_context_limit(messages: List[Dict], model_spec: backends.ModelSpec,
             Number of tokens of 'context space left'
             Total context token limit
     """
-    tokenizer, _, context_size = load_config_and_tokenizer(model_spec)
+    # the cached tokenizer of the token counter (does not load the tokenizer and config on every call)
+    tokenizer = token_counter.token_counter.get_tokenizer(model_spec)
 
     # optional messages processing:
     if clean_messages:
@@ -378,10 +604,11 @@ def check_context_limit(messages: List[Dict], model_spec: backends.ModelSpec,
     else:
         current_messages = messages
     # the actual tokens, including chat format:
-    prompt_tokens = tokenizer.apply_chat_template(current_messages, add_generation_prompt=True)
-    context_check_tuple = _check_context_limit(context_size, prompt_tokens, max_new_tokens=max_new_tokens)
+    prompt_tokens = tokenizer.tokenizer.apply_chat_template(current_messages, add_generation_prompt=True)
+    context_check_tuple = _check_context_limit(tokenizer.context_size, prompt_tokens, max_new_tokens=max_new_tokens)
     tokens_used = context_check_tuple[1]
     tokens_left = context_check_tuple[2]
+    context_size = context_check_tuple[3]
     if verbose:
         print(f"{tokens_used} input tokens, {tokens_left} tokens of {context_size} left.")
     fits = context_check_tuple[0]
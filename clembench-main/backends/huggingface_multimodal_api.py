@@ -2,13 +2,19 @@
 Backend using HuggingFace transformers for open-weight multimodal models.
 """
 from typing import List, Dict, Tuple, Any
+import hashlib
+import json
 import torch
 import backends
 from PIL import Image
-import requests
-from transformers import AutoProcessor, AutoModelForVision2Seq, IdeficsForVisionText2Text, AutoConfig
+import io
+from transformers import AutoProcessor, AutoModelForVision2Seq, IdeficsForVisionText2Text, AutoConfig, BatchFeature
 from jinja2 import Template
 
+from backends import http_client
+from backends.image_cache import ImageCache
+from backends.utils import keep_resident
+
 # Define a map to load model from transformers Auto Classes
 # IdeficsForVisionText2Text is not yet supported by any Auto Class
 MODEL_TYPE_MAP = {
@@ -18,6 +24,12 @@ MODEL_TYPE_MAP = {
 
 FALLBACK_CONTEXT_SIZE = 256
 
+# Processors which only combine the outputs of their tokenizer and image processor, so that the processed images
+# can be cached and only the text has to be tokenized for each turn
+SPLITTABLE_PROCESSORS = ["LlavaProcessor", "LlavaNextProcessor"]
+
+PREPROCESSED_IMAGES_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
 logger = backends.get_logger(__name__)
 
 def get_context_limit(model_spec: backends.ModelSpec) -> int:
@@ -62,6 +74,7 @@ def check_context_limit(context_size: int, prompt_tokens: list, max_new_tokens:
     return fits, tokens_used, tokens_left, context_size
 
 
+@keep_resident
 def load_processor(model_spec: backends.ModelSpec) -> AutoProcessor:
     """
     Load processor from AutoProcessor a specific model (Example - LlavaProcessor)
@@ -81,6 +94,7 @@ def load_processor(model_spec: backends.ModelSpec) -> AutoProcessor:
     return processor
 
 
+@keep_resident
 def load_model(model_spec: backends.ModelSpec):
     """
     Load a specific model
@@ -106,16 +120,26 @@ def load_model(model_spec: backends.ModelSpec):
     return model
 
 
+# a separate cache, because the decoded images and the processed pixel values are much larger than the encoded images
+preprocessed_images = ImageCache(PREPROCESSED_IMAGES_MAX_BYTES)
+
+
 def load_image(image: str):
     """
-    Load an image based on a given local path or URL
+    Load an image based on a given local path or URL. The decoded images are cached.
 
     :param image: Image path/url
     :return loaded_image: PIL Image
     """
+    return preprocessed_images.get_or_load("decoded", image, lambda: _load_image(image),
+                                           size_of=lambda loaded: loaded.width * loaded.height * len(loaded.getbands()))
+
 
+def _load_image(image: str):
     if image.startswith('http') or image.startswith('https'):
-        image = Image.open(requests.get(image, stream=True).raw).convert('RGB')
+        response = http_client.get_client().get(image)
+        response.raise_for_status()
+        image = Image.open(io.BytesIO(response.content)).convert('RGB')
     else:
         image = Image.open(image).convert('RGB')
 
@@ -130,14 +154,7 @@ def get_images(messages: list[Dict]) -> list:
     :return images: A list of PIL Image objects.
     """
     # Collect image links/file locations mentioned in messages
-    images = []
-    for message in messages:
-        if 'image' in message:
-            if type(message['image']) == list:
-                for img in message['image']:
-                    images.append(img)
-            else:
-                images.append(message['image'])
+    images = get_image_paths(messages)
 
     # Return None if no image is passed
     # Use AutoTokenizer to generate output and not AutoProcessor, as only text is passed.
@@ -153,6 +170,37 @@ def get_images(messages: list[Dict]) -> list:
     return loaded_images
 
 
+def get_image_paths(messages: list[Dict]) -> list:
+    """
+    Return the image links/file locations mentioned in messages (in the same order as get_images)
+    """
+    images = []
+    for message in messages:
+        if 'image' in message:
+            if type(message['image']) == list:
+                images.extend(message['image'])
+            else:
+                images.append(message['image'])
+    return images
+
+
+def process_images(processor: AutoProcessor, processor_key: str, messages: list[Dict]) -> BatchFeature:
+    """
+    Return the (cached) image processor outputs (e.g. pixel_values) for the images in messages
+
+    :param processor_key: identifies the image processor configuration
+    """
+    image_paths = tuple(get_image_paths(messages))
+    return preprocessed_images.get_or_load(f"processed:{processor_key}", image_paths,
+                                           lambda: processor.image_processor(get_images(messages), return_tensors="pt"),
+                                           size_of=_size_of_features)
+
+
+def _size_of_features(features: BatchFeature) -> int:
+    return sum(value.element_size() * value.nelement() for value in features.values()
+               if isinstance(value, torch.Tensor))
+
+
 # Separate Input and Output generation for Idefics
 # Input is required for context check
 def generate_idefics_input(messages: list[Dict]):
@@ -264,6 +312,13 @@ class HuggingfaceMultimodalModel(backends.Model):
         self.padding = model_spec_dict.get('padding', False)
         self.idefics = 'idefics' in model_spec['model_name']
 
+        # Processed images are cached per image processor configuration
+        self.split_processing = type(self.processor).__name__ in SPLITTABLE_PROCESSORS
+        self.processor_key = None
+        if self.split_processing:
+            processor_config = json.dumps(self.processor.image_processor.to_dict(), sort_keys=True, default=str)
+            self.processor_key = hashlib.sha256(processor_config.encode("utf-8")).hexdigest()
+
     def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
         """
         :param messages: for example
@@ -318,6 +373,10 @@ class HuggingfaceMultimodalModel(backends.Model):
         else:
             if not images:  # If no images are present in the history + current utterance, use tokenizer to get inputs
                 inputs = self.processor.tokenizer(prompt_text, return_tensors="pt").to(self.device)
+            elif self.split_processing:  # only tokenize the text, the images are processed once
+                text_inputs = self.processor.tokenizer(prompt_text, return_tensors="pt")
+                image_inputs = process_images(self.processor, self.processor_key, messages)
+                inputs = BatchFeature({**text_inputs, **image_inputs}).to(self.device)
             else:
                 inputs = self.processor(prompt_text, images=images, return_tensors="pt").to(self.device)
             model_output = self.multimodal_model.generate(**inputs, max_new_tokens=self.get_max_tokens())
@@ -0,0 +1,97 @@
+"""
+    A process-wide cache of encoded images (e.g. base64 payloads with their MIME type or uploaded file handles), so
+    that the images which are given again in each turn (or episode) are only read, encoded or uploaded once.
+"""
+import collections
+import os
+import sys
+import threading
+from functools import wraps
+from typing import Any, Callable, Tuple, Union
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class ImageCache:
+    """
+    A least recently used cache keyed by the kind of encoding and the image path and modification time (or URL),
+    bounded by the size of the cached values in bytes.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key_for(kind: str, image: Union[str, Tuple[str, ...]]) -> Tuple:
+        """
+        :param image: the image path or URL or several of these, e.g. for the processed images of a prompt
+        """
+        if isinstance(image, tuple):
+            return kind, tuple(ImageCache.key_for(kind, single_image)[1:] for single_image in image)
+        if image.startswith("http") or not os.path.isfile(image):
+            return kind, image, None
+        return kind, os.path.abspath(image), os.path.getmtime(image)
+
+    def get_or_load(self, kind: str, image: Union[str, Tuple[str, ...]], load: Callable[[], Any],
+                    size_of: Callable[[Any], int] = None) -> Any:
+        """
+        :param kind: of the encoding, e.g. the backend name
+        :param image: the image path or URL (or several of these)
+        :param load: creates the encoding if the image is not cached
+        :param size_of: the size of the encoding in bytes, e.g. of decoded images or tensors. Default: for strings,
+                        bytes and tuples of these
+        """
+        key = self.key_for(kind, image)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+        value = load()
+        size = size_of(value) if size_of is not None else _size_of(value)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (value, size)
+                self.total_bytes += size
+                while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                    _, (_, evicted_size) = self.entries.popitem(last=False)
+                    self.total_bytes -= evicted_size
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+def _size_of(value: Any) -> int:
+    if isinstance(value, (tuple, list)):
+        return sum(_size_of(item) for item in value)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+image_cache = ImageCache()
+
+
+def cache_image(kind: str):
+    """
+    Decorator for methods which encode a single image given as path or URL, e.g. encode_image(self, image_path).
+    :param kind: of the encoding, e.g. the backend name
+    """
+
+    def decorator(encode_image: Callable):
+        @wraps(encode_image)
+        def wrapped(self, image: str, *args, **kwargs):
+            return image_cache.get_or_load(kind, image, lambda: encode_image(self, image, *args, **kwargs))
+
+        return wrapped
+
+    return decorator
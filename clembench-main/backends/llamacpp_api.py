@@ -2,10 +2,10 @@
     Backend using llama.cpp for GGUF/GGML models.
 """
 
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Iterator
 
 import backends
-from backends.utils import check_context_limit_generic, ensure_alternating_roles
+from backends.utils import check_context_limit_generic, ensure_alternating_roles, keep_resident
 
 import llama_cpp
 from llama_cpp import Llama
@@ -13,6 +13,7 @@ from llama_cpp import Llama
 logger = backends.get_logger(__name__)
 
 
+@keep_resident
 def load_model(model_spec: backends.ModelSpec) -> Any:
     """
     Load GGUF/GGML model weights from HuggingFace, into VRAM if available. Weights are distributed over all available
@@ -154,6 +155,15 @@ class LlamaCPPLocalModel(backends.Model):
         # get context size from model instance:
         self.context_size = self.model._n_ctx
 
+        # optional cache of the model states after each prompt, so that the longest cached prefix of the next prompt
+        # (e.g. the chat history of a player's previous turn) is not evaluated again:
+        if self.model.cache is None:
+            if 'prompt_cache_dir' in model_spec:
+                cache_bytes = model_spec['prompt_cache_bytes'] if 'prompt_cache_bytes' in model_spec else 2 << 30
+                self.model.set_cache(llama_cpp.LlamaDiskCache(model_spec['prompt_cache_dir'], cache_bytes))
+            elif 'prompt_cache_bytes' in model_spec:
+                self.model.set_cache(llama_cpp.LlamaRAMCache(model_spec['prompt_cache_bytes']))
+
     def generate_response(self, messages: List[Dict], return_full_text: bool = False) -> Tuple[Any, Any, str]:
         """
         :param messages: for example
@@ -166,19 +176,7 @@ class LlamaCPPLocalModel(backends.Model):
         :param return_full_text: If True, whole input context is returned.
         :return: the continuation
         """
-        current_messages = ensure_alternating_roles(messages)
-
-        # use llama.cpp jinja to apply chat template for prompt:
-        prompt_text = self.chat_formatter(messages=current_messages).prompt
-
-        prompt = {"inputs": prompt_text, "max_new_tokens": self.get_max_tokens(),
-                  "temperature": self.get_temperature(), "return_full_text": return_full_text}
-
-        prompt_tokens = self.model.tokenize(prompt_text.encode(), add_bos=False)  # BOS expected in template
-
-        # check context limit:
-        check_context_limit_generic(self.context_size, prompt_tokens, self.model_spec.model_name,
-                                    max_new_tokens=self.get_max_tokens())
+        prompt_text, prompt = self.__prepare_prompt(messages, return_full_text)
 
         # NOTE: HF transformers models come with their own generation configs, but llama.cpp doesn't seem to have a
         # feature like that. There are default sampling parameters, and clembench only handles two of them so far, which
@@ -211,3 +209,61 @@ class LlamaCPPLocalModel(backends.Model):
             response_text = prompt_text + model_output['choices'][0]['text'].strip()
 
         return prompt, response, response_text
+
+    def __prepare_prompt(self, messages: List[Dict], return_full_text: bool = False) -> Tuple[str, Dict]:
+        """
+        Apply the chat template and check the context limit.
+        :return: the prompt text and the prompt object to be logged
+        """
+        current_messages = ensure_alternating_roles(messages)
+
+        # use llama.cpp jinja to apply chat template for prompt:
+        prompt_text = self.chat_formatter(messages=current_messages).prompt
+
+        prompt = {"inputs": prompt_text, "max_new_tokens": self.get_max_tokens(),
+                  "temperature": self.get_temperature(), "return_full_text": return_full_text}
+
+        prompt_tokens = self.model.tokenize(prompt_text.encode(), add_bos=False)  # BOS expected in template
+
+        # check context limit:
+        check_context_limit_generic(self.context_size, prompt_tokens, self.model_spec.model_name,
+                                    max_new_tokens=self.get_max_tokens())
+        return prompt_text, prompt
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        # use the loaded model's tokenizer and chat template
+        prompt_text = self.chat_formatter(messages=ensure_alternating_roles(messages)).prompt
+        return len(self.model.tokenize(prompt_text.encode(), add_bos=False))
+
+    def check_context_limit(self, messages: List[Dict]) -> Tuple[bool, int, int, int]:
+        max_new_tokens = self.get_gen_args().get("max_tokens", 100)
+        tokens_used = self.count_tokens(messages) + max_new_tokens
+        tokens_left = self.context_size - tokens_used
+        return tokens_used <= self.context_size, tokens_used, tokens_left, self.context_size
+
+    def stream_response(self, messages: List[Dict]) -> Tuple[Any, Iterator[str]]:
+        """
+        Streaming variant of generate_response(); the generation stops when the returned generator is closed.
+        """
+        prompt_text, prompt = self.__prepare_prompt(messages)
+        stream = self.model(
+            prompt_text,
+            temperature=self.get_temperature(),
+            max_tokens=self.get_max_tokens(),
+            stream=True
+        )
+        return prompt, _stream_text(stream)
+
+    def clean_streamed_text(self, text: str) -> str:
+        response_text = text.strip()
+        if response_text.endswith(self.model_spec['eos_to_cull']):
+            response_text = response_text[:-len(self.model_spec['eos_to_cull'])]
+        return response_text
+
+
+def _stream_text(stream) -> Iterator[str]:
+    try:
+        for chunk in stream:
+            yield chunk['choices'][0]['text']
+    finally:
+        stream.close()
@@ -0,0 +1,155 @@
+"""
+    A local HTTP server which holds a single loaded model (e.g. of the huggingface_local or llama_cpp backend),
+    so that several benchmark processes can share it via the model_server backend (see model_server_api.py).
+
+    The requests of all clients are put into a single queue. The worker takes all pending requests at once and hands
+    those with the same generation arguments to the model together: concurrently (up to the max_batch_size of the model
+    spec), so that the huggingface_local backend generates them as a single batch, or otherwise one after another.
+"""
+import collections
+import json
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 8765
+
+
+class ModelServer:
+    """
+    Serves the generate_response() method of a loaded model at POST /generate and the model spec at GET /info.
+    """
+
+    def __init__(self, model: backends.Model, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 max_batch_size: int = None):
+        """
+        :param max_batch_size: the maximal number of requests handed to the model at the same time. Default: the
+                               max_batch_size of the model spec or 1 (one after another)
+        """
+        self.model = model
+        if max_batch_size is None:
+            max_batch_size = model.model_spec["max_batch_size"] if "max_batch_size" in model.model_spec else 1
+        self.max_batch_size = max(max_batch_size, 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_batch_size, thread_name_prefix="model-server-batch") \
+            if self.max_batch_size > 1 else None
+        self.requests = queue.Queue()
+        self.http_server = ThreadingHTTPServer((host, port), _RequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.model_server = self
+        self.worker = threading.Thread(target=self.__work, name="model-server-worker", daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self.http_server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, messages: List[Dict], gen_args: Dict) -> Future:
+        """
+        Queue a generation request.
+        :return: a future for the (prompt, response, response_text) of the model
+        """
+        future = Future()
+        self.requests.put((future, messages, gen_args))
+        return future
+
+    def __work(self):
+        while True:
+            pending = [self.requests.get()]
+            while True:  # take all pending requests, so that those with the same gen args can be batched
+                try:
+                    pending.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            groups = collections.defaultdict(list)
+            for future, messages, gen_args in pending:
+                if future is not None and future.set_running_or_notify_cancel():
+                    groups[json.dumps(gen_args, sort_keys=True)].append((future, messages, gen_args))
+            for group in groups.values():
+                # the gen args are given by each client, because they may differ between the benchmark runs
+                self.model.set_gen_args(**group[0][2])
+                for start in range(0, len(group), self.max_batch_size):
+                    self.__generate_batch(group[start:start + self.max_batch_size])
+            if any(future is None for future, _, _ in pending):  # shutdown
+                break
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __generate_batch(self, batch: List):
+        if self.executor is None or len(batch) == 1:
+            for future, messages, _ in batch:
+                self.__generate(future, messages)
+            return
+        logger.info(f"Hand {len(batch)} requests to {self.model.get_name()} at once")
+        wait([self.executor.submit(self.__generate, future, messages) for future, messages, _ in batch])
+
+    def __generate(self, future: Future, messages: List[Dict]):
+        try:
+            future.set_result(self.model.generate_response(messages))
+        except Exception as e:
+            future.set_exception(e)
+
+    def serve_forever(self):
+        self.worker.start()
+        logger.info(f"Serving {self.model.get_name()} at {self.address}")
+        try:
+            self.http_server.serve_forever()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self.requests.put((None, None, None))
+        self.http_server.server_close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        model_server = self.server.model_server
+        if self.path != "/info":
+            self.__respond(404, dict(error="NotFound", info=self.path))
+            return
+        self.__respond(200, dict(model_spec=model_server.model.model_spec.__dict__,
+                                 queued=model_server.requests.qsize(), max_batch_size=model_server.max_batch_size))
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self.__respond(404, dict(error="NotFound", info=self.path))
+            return
+        content_length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(content_length))
+        future = self.server.model_server.submit(request["messages"], request.get("gen_args", dict()))
+        try:
+            prompt, response, response_text = future.result()
+            self.__respond(200, dict(prompt=prompt, response=response, response_text=response_text))
+        except backends.ContextExceededError as e:
+            self.__respond(400, dict(error="ContextExceededError", info=str(e), tokens_used=e.tokens_used,
+                                     tokens_left=e.tokens_left, context_size=e.context_size))
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            self.__respond(500, dict(error=e.__class__.__name__, info=str(e)))
+
+    def __respond(self, status: int, body: Dict):
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any):
+        logger.debug(format, *args)
+
+
+def serve(model_spec: backends.ModelSpec, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    """
+    Load the model for the model spec once and serve it until interrupted.
+    """
+    model = backends.get_model_for(model_spec)
+    ModelServer(model, host, port).serve_forever()
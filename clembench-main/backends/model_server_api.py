@@ -0,0 +1,60 @@
+"""
+    Backend for a model which is served by another process (see model_server.py and 'cli.py serve'), so that
+    several benchmark runs can share a single loaded model.
+"""
+from typing import List, Dict, Tuple, Any
+from retry import retry
+
+import backends
+import httpx
+
+from backends.model_server import DEFAULT_HOST, DEFAULT_PORT
+from backends.utils import ensure_messages_format
+
+logger = backends.get_logger(__name__)
+
+NAME = "model_server"
+
+
+class RemoteModelServer(backends.Backend):
+
+    def __init__(self):
+        self.clients: Dict[str, httpx.Client] = dict()
+
+    def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
+        base_url = model_spec["base_url"] if "base_url" in model_spec else f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+        if base_url not in self.clients:
+            # no timeout: the requests wait in the server queue until the model is free
+            self.clients[base_url] = httpx.Client(base_url=base_url, timeout=None)
+        return ModelServerModel(self.clients[base_url], model_spec)
+
+
+class ModelServerModel(backends.Model):
+
+    def __init__(self, client: httpx.Client, model_spec: backends.ModelSpec):
+        super().__init__(model_spec)
+        self.client = client
+
+    @retry(exceptions=httpx.TransportError, tries=3, delay=1, logger=logger)
+    @ensure_messages_format
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        """
+        :param messages: for example
+                [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": "Who won the world series in 2020?"},
+                    {"role": "assistant", "content": "The Los Angeles Dodgers won the World Series in 2020."},
+                    {"role": "user", "content": "Where was it played?"}
+                ]
+        :return: the continuation
+        """
+        server_response = self.client.post("/generate", json=dict(messages=messages, gen_args=self.get_gen_args()))
+        result = server_response.json()
+        if server_response.status_code != 200:
+            if result["error"] == "ContextExceededError":
+                raise backends.ContextExceededError(tokens_used=result["tokens_used"],
+                                                    tokens_left=result["tokens_left"],
+                                                    context_size=result["context_size"])
+            raise RuntimeError(f"Model server at {self.client.base_url} failed with "
+                               f"{result['error']}: {result['info']}")
+        return result["prompt"], result["response"], result["response_text"]
@@ -1,13 +1,15 @@
-from typing import List, Dict, Tuple, Any
-from retry import retry
+import asyncio
+from typing import List, Dict, Tuple, Any, Iterator
 
 import json
 import openai
 import backends
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, stream_chat_completion, LoopLocal
+from backends.ratelimit import rate_limited, rate_limited_async, rate_limited_stream, without_rate_limit
 import base64
 import imghdr
-import httpx
+from backends import http_client
+from backends.image_cache import cache_image
 
 logger = backends.get_logger(__name__)
 
@@ -20,7 +22,10 @@ class OpenAI(backends.Backend):
         creds = backends.load_credentials(NAME)
         api_key = creds[NAME]["api_key"]
         organization = creds[NAME]["organisation"] if "organisation" in creds[NAME] else None
-        self.client = openai.OpenAI(api_key=api_key, organization=organization)
+        self.client = openai.OpenAI(api_key=api_key, organization=organization,
+                                    http_client=http_client.get_client())
+        self.async_client = LoopLocal(lambda: openai.AsyncOpenAI(api_key=api_key, organization=organization,
+                                                                 http_client=http_client.get_async_client()))
 
     def list_models(self):
         models = self.client.models.list()
@@ -30,18 +35,20 @@ class OpenAI(backends.Backend):
         # [print(n) for n in names]   # 2024-01-10: what was this? a side effect-only method?
 
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
-        return OpenAIModel(self.client, model_spec)
+        return OpenAIModel(self.client, model_spec, self.async_client)
 
 
 class OpenAIModel(backends.Model):
 
-    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec):
+    def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec, async_client: LoopLocal = None):
         super().__init__(model_spec)
         self.client = client
+        self.async_client = async_client
 
+    @cache_image(NAME)
     def encode_image(self, image_path):
         if image_path.startswith('http'):
-            image_bytes = httpx.get(image_path).content
+            image_bytes = http_client.get_client().get(image_path).content
             image_type = imghdr.what(None, image_bytes)
             return True, image_path, image_type
         with open(image_path, "rb") as image_file:
@@ -81,7 +88,7 @@ class OpenAIModel(backends.Model):
             encoded_messages.append(this)
         return encoded_messages
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -100,6 +107,41 @@ class OpenAIModel(backends.Model):
                                                            messages=prompt,
                                                            temperature=self.get_temperature(),
                                                            max_tokens=self.get_max_tokens())
+        return self.__to_response(prompt, api_response)
+
+    @rate_limited_stream(tries=3, logger=logger)
+    @ensure_messages_format
+    def stream_response(self, messages: List[Dict]) -> Tuple[Any, Iterator[str]]:
+        """
+        Streaming variant of generate_response() (see backends.Model.stream_response()).
+        """
+        prompt = self.encode_messages(messages)
+
+        stream = self.client.chat.completions.create(model=self.model_spec.model_id,
+                                                     messages=prompt,
+                                                     temperature=self.get_temperature(),
+                                                     max_tokens=self.get_max_tokens(),
+                                                     stream=True)
+        return prompt, stream_chat_completion(stream)
+
+    @rate_limited_async(tries=3, logger=logger)
+    @ensure_messages_format
+    async def generate_response_async(self, messages: List[Dict]) -> Tuple[str, Any, str]:
+        """
+        Asynchronous variant of generate_response() using the asynchronous OpenAI client.
+        """
+        if self.async_client is None:
+            return await asyncio.to_thread(without_rate_limit(self.generate_response), messages)
+        prompt = self.encode_messages(messages)
+
+        api_response = await self.async_client.get().chat.completions.create(model=self.model_spec.model_id,
+                                                                             messages=prompt,
+                                                                             temperature=self.get_temperature(),
+                                                                             max_tokens=self.get_max_tokens())
+        return self.__to_response(prompt, api_response)
+
+    @staticmethod
+    def __to_response(prompt, api_response) -> Tuple[str, Any, str]:
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
@@ -1,12 +1,12 @@
-from typing import List, Dict, Tuple, Any
-from retry import retry
+from typing import List, Dict, Tuple, Any, Iterator
 
 import json
 import openai
 import backends
 import httpx
 
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, stream_chat_completion
+from backends.ratelimit import rate_limited, rate_limited_stream
 
 logger = backends.get_logger(__name__)
 
@@ -42,7 +42,7 @@ class GenericOpenAIModel(backends.Model):
         super().__init__(model_spec)
         self.client = client
 
-    @retry(tries=3, delay=0, logger=logger)
+    @rate_limited(tries=3, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
         """
@@ -66,3 +66,15 @@ class GenericOpenAIModel(backends.Model):
         response = json.loads(api_response.json())
 
         return prompt, response, response_text
+
+    @rate_limited_stream(tries=3, logger=logger)
+    @ensure_messages_format
+    def stream_response(self, messages: List[Dict]) -> Tuple[Any, Iterator[str]]:
+        """
+        Streaming variant of generate_response() (see backends.Model.stream_response()).
+        """
+        prompt = messages
+        stream = self.client.chat.completions.create(model=self.model_spec.model_id, messages=prompt,
+                                                     temperature=self.get_temperature(),
+                                                     max_tokens=self.get_max_tokens(), stream=True)
+        return prompt, stream_chat_completion(stream)
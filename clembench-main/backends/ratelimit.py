@@ -0,0 +1,296 @@
+"""
+    Rate limiting for the remote API backends, shared by all models of the same backend and model id.
+
+    The limits are given by an optional 'rate_limit' entry in the model registry, for example:
+    "rate_limit": {"rpm": 500, "tpm": 30000, "max_concurrency": 16}
+
+    Failed calls are retried with exponential backoff (and jitter) or after the time the provider asks for
+    (retry-after headers). The number of concurrent calls is halved on each rate limit error and slowly increased
+    again on success (AIMD), so that the calls stay close to the provider limit.
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from functools import wraps, partial
+from typing import Dict, Tuple, Callable, Optional
+
+import backends
+from backends.token_counter import ensure_context_limit
+
+logger = backends.get_logger(__name__)
+
+BACKOFF_BASE = 1.  # seconds
+BACKOFF_MAX = 120.  # seconds
+CONCURRENCY_POLL = .05  # seconds
+
+
+class TokenBucket:
+    """
+    Allows a number of units (requests or tokens) per minute. Reservations can exceed the bucket, so that the caller
+    waits until the units have been refilled.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.
+        self.capacity = per_minute
+        self.level = per_minute
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, units: float) -> float:
+        """
+        :return: the seconds to wait before using the units
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.level -= min(units, self.capacity)
+            return 0. if self.level >= 0 else -self.level / self.rate
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of concurrent calls: the limit is increased by one per limit successful calls and halved
+    on rate limit errors (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self, rate_limited: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(1., self.limit / 2)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RateLimiter:
+
+    def __init__(self, name: str, rpm: float = None, tpm: float = None, max_concurrency: int = None):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency) if max_concurrency else None
+
+    def delay_for(self, estimated_tokens: int) -> float:
+        delay = 0.
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(estimated_tokens))
+        return delay
+
+
+_rate_limiters: Dict[Tuple[str, str], RateLimiter] = dict()
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_spec: backends.ModelSpec) -> RateLimiter:
+    """
+    :return: the rate limiter shared by all models with the same backend and model id
+    """
+    model_id = model_spec["model_id"] if "model_id" in model_spec else model_spec.model_name
+    key = (model_spec.backend, model_id)
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            rate_limit = model_spec["rate_limit"] if "rate_limit" in model_spec else dict()
+            _rate_limiters[key] = RateLimiter(f"{model_spec.backend}/{model_id}", **rate_limit)
+        return _rate_limiters[key]
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    response = getattr(error, "response", None)
+    if status_code is None and response is not None:
+        status_code = getattr(response, "status_code", None)
+    if status_code == 429:
+        return True
+    return any(name in error.__class__.__name__ for name in ["RateLimit", "ResourceExhausted", "TooManyRequests"])
+
+
+def retry_after_of(error: Exception) -> Optional[float]:
+    """
+    :return: the seconds to wait as given by the retry-after(-ms) header of the error response or None
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:  # an http date
+            return max(0., email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error: Exception) -> float:
+    retry_after = retry_after_of(error)
+    if retry_after is not None:
+        return retry_after
+    # exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def estimate_tokens(model: backends.Model, messages) -> int:
+    """
+    The tokens used by a call: the prompt tokens (see backends.token_counter) plus the maximal response length.
+    The tokens are only counted for models with a rate_limit or context_size entry; otherwise 0.
+    :raise ContextExceededError: if the context size of the model is known and exceeded, so that the call is not sent
+    """
+    if "rate_limit" not in model.model_spec and "context_size" not in model.model_spec:
+        return 0
+    try:
+        max_tokens = model.get_max_tokens()
+    except AssertionError:
+        max_tokens = 0
+    return ensure_context_limit(model.model_spec, messages, max_tokens)
+
+
+def rate_limited(tries: int = 3, logger=logger):
+    """
+    Replaces the retry decorator for the generate_response() methods of the remote API backends.
+    :param tries: the maximum number of attempts
+    :param logger: to log the failed attempts to (warning)
+    """
+
+    def decorator(generate_response: Callable):
+        @wraps(generate_response)
+        def wrapped(model: backends.Model, messages, *args, **kwargs):
+            rate_limiter = get_rate_limiter(model.model_spec)
+            estimated_tokens = estimate_tokens(model, messages)
+            for attempt in range(tries):
+                time.sleep(rate_limiter.delay_for(estimated_tokens))
+                if rate_limiter.concurrency is not None:
+                    rate_limiter.concurrency.acquire()
+                rate_limited_error = False
+                try:
+                    return generate_response(model, messages, *args, **kwargs)
+                except backends.ContextExceededError:
+                    raise
+                except Exception as e:
+                    rate_limited_error = is_rate_limit_error(e)
+                    if attempt == tries - 1:
+                        raise
+                    delay = backoff_delay(attempt, e)
+                    logger.warning('%s (%s), retrying in %.1f seconds...', e, rate_limiter.name, delay)
+                finally:
+                    if rate_limiter.concurrency is not None:
+                        rate_limiter.concurrency.release(rate_limited_error)
+                time.sleep(delay)
+
+        wrapped.__rate_limited__ = generate_response
+        return wrapped
+
+    return decorator
+
+
+def rate_limited_stream(tries: int = 3, logger=logger):
+    """
+    The counterpart of rate_limited() for the stream_response() methods: the concurrency slot is held until the
+    returned stream (see backends.utils.ChatCompletionStream) is exhausted or closed, so that max_concurrency also
+    bounds the streamed generations. Only the creation of the stream is retried.
+    """
+
+    def decorator(stream_response: Callable):
+        @wraps(stream_response)
+        def wrapped(model: backends.Model, messages, *args, **kwargs):
+            rate_limiter = get_rate_limiter(model.model_spec)
+            estimated_tokens = estimate_tokens(model, messages)
+            for attempt in range(tries):
+                time.sleep(rate_limiter.delay_for(estimated_tokens))
+                if rate_limiter.concurrency is not None:
+                    rate_limiter.concurrency.acquire()
+                try:
+                    prompt, chunks = stream_response(model, messages, *args, **kwargs)
+                except Exception as e:
+                    if rate_limiter.concurrency is not None:
+                        rate_limiter.concurrency.release(is_rate_limit_error(e))
+                    if isinstance(e, backends.ContextExceededError) or attempt == tries - 1:
+                        raise
+                    delay = backoff_delay(attempt, e)
+                    logger.warning('%s (%s), retrying in %.1f seconds...', e, rate_limiter.name, delay)
+                    time.sleep(delay)
+                    continue
+                if rate_limiter.concurrency is not None:
+                    chunks.call_on_close(rate_limiter.concurrency.release)
+                return prompt, chunks
+
+        return wrapped
+
+    return decorator
+
+
+def without_rate_limit(method: Callable) -> Callable:
+    """
+    :param method: a bound method, e.g. model.generate_response
+    :return: the method without its rate_limited() decorator, e.g. to call the blocking generate_response() from
+             within generate_response_async() which already holds the rate limit
+    """
+    generate_response = getattr(method, "__rate_limited__", None)
+    if generate_response is None:
+        return method
+    return partial(generate_response, method.__self__)
+
+
+def rate_limited_async(tries: int = 3, logger=logger):
+    """
+    The asynchronous counterpart of rate_limited() for the generate_response_async() methods.
+    """
+
+    def decorator(generate_response_async: Callable):
+        @wraps(generate_response_async)
+        async def wrapped(model: backends.Model, messages, *args, **kwargs):
+            rate_limiter = get_rate_limiter(model.model_spec)
+            estimated_tokens = estimate_tokens(model, messages)
+            for attempt in range(tries):
+                await asyncio.sleep(rate_limiter.delay_for(estimated_tokens))
+                if rate_limiter.concurrency is not None:
+                    while not rate_limiter.concurrency.try_acquire():
+                        await asyncio.sleep(CONCURRENCY_POLL)
+                rate_limited_error = False
+                try:
+                    return await generate_response_async(model, messages, *args, **kwargs)
+                except backends.ContextExceededError:
+                    raise
+                except Exception as e:
+                    rate_limited_error = is_rate_limit_error(e)
+                    if attempt == tries - 1:
+                        raise
+                    delay = backoff_delay(attempt, e)
+                    logger.warning('%s (%s), retrying in %.1f seconds...', e, rate_limiter.name, delay)
+                finally:
+                    if rate_limiter.concurrency is not None:
+                        rate_limiter.concurrency.release(rate_limited_error)
+                await asyncio.sleep(delay)
+
+        return wrapped
+
+    return decorator
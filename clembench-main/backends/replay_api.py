@@ -0,0 +1,148 @@
+"""
+    Backend which answers the requests from the requests.json files of a previous run (results directory), e.g. to
+    re-execute the game masters after a code change without querying the models again.
+
+    The model spec names the recorded model and the results directory of the recorded run, for example:
+    {"model_name": "gpt-4-0613", "backend": "replay", "results_dir": "results/v1.5"}
+    The replayed run should be stored in another results directory, because the results paths are the same.
+"""
+import collections
+import os
+import threading
+from typing import List, Dict, Tuple, Any, Callable, Iterable
+
+import backends
+from backends.utils import ensure_alternating_roles
+
+logger = backends.get_logger(__name__)
+
+NAME = "replay"
+
+_requests_loader: Callable[[str], Iterable[List[Dict]]] = None
+
+
+def set_requests_loader(load_requests: Callable[[str], Iterable[List[Dict]]]):
+    """
+    :param load_requests: returns the (decoded) calls of each episode's requests below a results directory; given by
+                          the framework which stores the results files (e.g. compressed or as records)
+    """
+    global _requests_loader
+    _requests_loader = load_requests
+
+
+class Replay(backends.Backend):
+
+    def __init__(self):
+        self.indexes: Dict[str, "RequestsIndex"] = dict()
+        self.lock = threading.Lock()
+
+    def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
+        results_dir = os.path.abspath(model_spec["results_dir"] if "results_dir" in model_spec else "results")
+        if _requests_loader is None:
+            raise RuntimeError("The replay backend cannot read the recorded requests: no requests loader is set")
+        with self.lock:
+            if results_dir not in self.indexes:
+                self.indexes[results_dir] = RequestsIndex(results_dir, _requests_loader)
+        return ReplayModel(self.indexes[results_dir], model_spec)
+
+
+class ReplayMissError(LookupError):
+    """
+    Raised, when there is no recorded response (left) for a request.
+    """
+    pass
+
+
+class RequestsIndex:
+    """
+    The recorded calls of all requests.json files below a results directory, indexed by their normalized prompt
+    messages. When a prompt was recorded several times, then the responses are returned in the order in which they
+    were recorded; each recorded response is returned only once. The calls of backends which record a formatted
+    prompt text instead of the messages (e.g. huggingface_local) cannot be looked up and are not indexed.
+    """
+
+    def __init__(self, results_dir: str, load_requests: Callable[[str], Iterable[List[Dict]]]):
+        """
+        :param load_requests: returns the (decoded) calls of each episode's requests below the results directory
+        """
+        self.results_dir = results_dir
+        self.by_messages: Dict[Tuple, collections.deque] = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+        self.__index(load_requests)
+
+    def __index(self, load_requests: Callable[[str], Iterable[List[Dict]]]):
+        num_calls = 0
+        num_text_prompts = 0
+        for calls in load_requests(self.results_dir):
+            for call in calls:
+                response = call["raw_response_obj"]
+                if not isinstance(response, dict) or "clem_player" not in response:
+                    continue  # not recorded by a Player
+                prompt = call["manipulated_prompt_obj"]
+                if not _is_messages(prompt):
+                    num_text_prompts += 1
+                    continue
+                model_name = response["clem_player"]["model_name"]
+                self.by_messages[(model_name, _normalize(prompt))].append((prompt, response))
+                num_calls += 1
+        logger.info(f"Indexed {num_calls} recorded calls in {self.results_dir}")
+        if num_text_prompts > 0:
+            logger.warning(f"Skipped {num_text_prompts} recorded calls with formatted prompt texts "
+                           f"in {self.results_dir}, which cannot be replayed")
+
+    def lookup(self, model_name: str, messages: List[Dict]) -> Tuple[Any, Dict]:
+        """
+        :return: the next recorded prompt and response object for the messages
+        :raise ReplayMissError: if the messages have not been recorded or have been replayed as often as recorded
+        """
+        key = (model_name, _normalize(ensure_alternating_roles(messages)) if messages else tuple())
+        with self.lock:
+            entries = self.by_messages.get(key)
+            if entries:
+                return entries.popleft()
+        if entries is not None:
+            raise ReplayMissError(f"The messages have been replayed more often than recorded for {model_name} "
+                                  f"in {self.results_dir}: {messages}")
+        raise ReplayMissError(f"No recorded response of {model_name} in {self.results_dir} "
+                              f"for the messages: {messages}")
+
+
+def _is_messages(prompt: Any) -> bool:
+    return isinstance(prompt, list) and all(isinstance(m, dict) and "role" in m and "content" in m for m in prompt)
+
+
+def _normalize(messages: List[Dict]) -> Tuple:
+    """
+    :return: the roles and texts of the messages without the system message, which some backends record separately
+    """
+    return tuple((message["role"], _text_of(message["content"])) for message in messages
+                 if message["role"] != "system")
+
+
+def _text_of(content: Any) -> str:
+    if isinstance(content, list):  # e.g. [{"type": "text", "text": "..."}, {"type": "image_url", ...}]
+        content = " ".join(item["text"] for item in content if isinstance(item, dict) and "text" in item)
+    # the backends might replace the image placeholders and merge consecutive messages
+    return " ".join(str(content).replace("<image>", " ").split())
+
+
+class ReplayModel(backends.Model):
+
+    def __init__(self, index: RequestsIndex, model_spec: backends.ModelSpec):
+        super().__init__(model_spec)
+        self.index = index
+
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        """
+        :param messages: for example
+                [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": "Who won the world series in 2020?"},
+                    {"role": "assistant", "content": "The Los Angeles Dodgers won the World Series in 2020."},
+                    {"role": "user", "content": "Where was it played?"}
+                ]
+        :return: the recorded continuation
+        """
+        prompt, recorded_response = self.index.lookup(self.get_name(), messages)
+        response = {key: value for key, value in recorded_response.items() if key != "clem_player"}
+        return prompt, response, recorded_response["clem_player"]["response"]
@@ -0,0 +1,163 @@
+"""
+    A compact encoding of the recorded requests (the requests.json files). The prompt of each request is the whole
+    chat history, which grows with each turn, so that each prompt is stored as a delta against a recent prompt
+    instead: the number of leading messages kept from that prompt and the messages appended to them. Large base64 data
+    (e.g. the images of multimodal prompts) is stored only once by its content hash. The encoded requests look like:
+
+    {
+        "format": "delta",
+        "blobs": {"<sha256>": "data:image/png;base64,..."},
+        "requests": [
+            {"timestamp": "...", "manipulated_prompt_obj": [...], "raw_response_obj": {...}},
+            {"timestamp": "...", "prompt_delta": {"base": 0, "keep": 2, "append": [...]}, "raw_response_obj": {...}}
+        ]
+    }
+
+    Blobs are referenced as {"$blob": "<sha256>"} within the prompts and responses.
+"""
+import collections
+import hashlib
+import json
+import re
+from typing import List, Dict, Any, Deque, Tuple
+
+FORMAT = "delta"
+# strings of at least this length which are data URLs or base64 encoded are stored as blobs
+BLOB_MIN_LENGTH = 1024
+BASE64_PATTERN = re.compile(r"[A-Za-z0-9+/]+={0,2}")
+
+
+class PromptEncoder:
+    """
+    Encodes the prompts of the requests one after another as deltas against the most similar of the recent prompts.
+    """
+
+    def __init__(self, window: int = 4):
+        """
+        :param window: the number of recent prompts to look for the longest common prefix, e.g. the previous prompts
+                       of both players of a game
+        """
+        self.recent: Deque[Tuple[int, List[str]]] = collections.deque(maxlen=window)
+        self.num_prompts = 0
+        self.blobs: Dict[str, str] = dict()
+        self.new_blobs: Dict[str, str] = dict()  # the blobs added since the last pop_new_blobs()
+
+    def encode(self, prompt: Any) -> Dict:
+        """
+        :return: the prompt as manipulated_prompt_obj or as prompt_delta against a previously encoded prompt
+        """
+        prompt = self.extract_blobs(prompt)
+        index = self.num_prompts
+        self.num_prompts += 1
+        if not isinstance(prompt, list):
+            return {"manipulated_prompt_obj": prompt}
+        items = [json.dumps(item, ensure_ascii=False, sort_keys=True) for item in prompt]
+        base, keep = None, 0
+        for recent_index, recent_items in self.recent:
+            prefix_length = _common_prefix_length(items, recent_items)
+            if prefix_length > keep:
+                base, keep = recent_index, prefix_length
+        self.recent.append((index, items))
+        if base is None:
+            return {"manipulated_prompt_obj": prompt}
+        return {"prompt_delta": {"base": base, "keep": keep, "append": prompt[keep:]}}
+
+    def extract_blobs(self, obj: Any) -> Any:
+        """
+        :return: a copy of the object with the large base64 strings replaced by blob references
+        """
+        if isinstance(obj, dict):
+            return {key: self.extract_blobs(value) for key, value in obj.items()}
+        if isinstance(obj, list):
+            return [self.extract_blobs(value) for value in obj]
+        if isinstance(obj, str) and _is_blob(obj):
+            blob_hash = hashlib.sha256(obj.encode()).hexdigest()
+            if blob_hash not in self.blobs:
+                self.blobs[blob_hash] = obj
+                self.new_blobs[blob_hash] = obj
+            return {"$blob": blob_hash}
+        return obj
+
+    def pop_new_blobs(self) -> Dict[str, str]:
+        new_blobs, self.new_blobs = self.new_blobs, dict()
+        return new_blobs
+
+
+class PromptDecoder:
+    """
+    Decodes the prompts encoded by a PromptEncoder in the same order.
+    """
+
+    def __init__(self, blobs: Dict[str, str] = None):
+        self.prompts: List[Any] = []  # with blob references
+        self.blobs: Dict[str, str] = blobs if blobs is not None else dict()
+
+    def decode(self, encoded: Dict) -> Any:
+        """
+        :param encoded: with either a manipulated_prompt_obj or a prompt_delta
+        :return: the prompt
+        """
+        if "prompt_delta" in encoded:
+            delta = encoded["prompt_delta"]
+            prompt = self.prompts[delta["base"]][:delta["keep"]] + delta["append"]
+        else:
+            prompt = encoded["manipulated_prompt_obj"]
+        self.prompts.append(prompt)
+        return self.insert_blobs(prompt)
+
+    def insert_blobs(self, obj: Any) -> Any:
+        if isinstance(obj, dict):
+            if len(obj) == 1 and "$blob" in obj:
+                return self.blobs[obj["$blob"]]
+            return {key: self.insert_blobs(value) for key, value in obj.items()}
+        if isinstance(obj, list):
+            return [self.insert_blobs(value) for value in obj]
+        return obj
+
+
+def encode_requests(requests: List[Dict]) -> Dict:
+    """
+    :param requests: as recorded by the game recorder
+    :return: the encoded requests
+    """
+    encoder = PromptEncoder()
+    encoded_requests = []
+    for request in requests:
+        encoded_request = {"timestamp": request["timestamp"]}
+        encoded_request.update(encoder.encode(request["manipulated_prompt_obj"]))
+        encoded_request["raw_response_obj"] = encoder.extract_blobs(request["raw_response_obj"])
+        encoded_requests.append(encoded_request)
+    return {"format": FORMAT, "blobs": encoder.blobs, "requests": encoded_requests}
+
+
+def is_encoded(data: Any) -> bool:
+    return isinstance(data, dict) and data.get("format") == FORMAT and "requests" in data
+
+
+def decode_requests(data: Any) -> List[Dict]:
+    """
+    :param data: the contents of a requests.json file, either encoded or not
+    :return: the requests as recorded by the game recorder
+    """
+    if not is_encoded(data):
+        return data
+    decoder = PromptDecoder(data["blobs"])
+    return [{"timestamp": request["timestamp"],
+             "manipulated_prompt_obj": decoder.decode(request),
+             "raw_response_obj": decoder.insert_blobs(request["raw_response_obj"])}
+            for request in data["requests"]]
+
+
+def _is_blob(text: str) -> bool:
+    if len(text) < BLOB_MIN_LENGTH:
+        return False
+    return text.startswith("data:") or BASE64_PATTERN.fullmatch(text) is not None
+
+
+def _common_prefix_length(items: List[str], other_items: List[str]) -> int:
+    length = 0
+    for item, other_item in zip(items, other_items):
+        if item != other_item:
+            break
+        length += 1
+    return length
@@ -0,0 +1,185 @@
+"""
+    A cache of the model responses on disk (SQLite), so that identical requests (same model spec, generation arguments
+    and messages) are not sent to the models again, e.g. when debugging a game master or re-running experiments.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Tuple, Any, Callable, Iterator
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+READ_THROUGH = "read_through"  # use cached responses and store the responses of cache misses
+RECORD = "record"  # always query the models and store their responses
+REPLAY = "replay"  # only use cached responses and fail on cache misses
+MODES = [READ_THROUGH, RECORD, REPLAY]
+
+
+class ResponseCacheMissError(LookupError):
+    """
+    Raised in replay mode, when there is no cached response for a request.
+    """
+    pass
+
+
+class ResponseCache:
+
+    def __init__(self, path: str, mode: str = READ_THROUGH, max_bytes: int = None):
+        """
+        :param path: of the SQLite database file; created if it does not exist
+        :param mode: one of read_through, record or replay
+        :param max_bytes: when exceeded, the least recently used responses are removed. Default: None (no limit)
+        """
+        assert mode in MODES, f"Response cache mode must be one of {MODES}, but is '{mode}'"
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # the shard processes of a run share the cache: readers do not block the writer (WAL) and the writers wait
+        # for each other instead of failing with 'database is locked'
+        self.connection = sqlite3.connect(path, timeout=60., check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS responses "
+                                    "(key TEXT PRIMARY KEY, model_name TEXT, value TEXT, size INTEGER, used REAL)")
+
+    @staticmethod
+    def key_for(model: backends.Model, messages: List[Dict], stop_predicate: Callable[[str], bool] = None) -> str:
+        """
+        :param stop_predicate: of a generation that stops early (see Model.generate_response_with_stop()), which
+                               might give another response than the whole generation
+        :return: the hash of the model spec, generation arguments and messages (including image references)
+        """
+        request = dict(model_spec=model.model_spec.__dict__, gen_args=model.get_gen_args(), messages=messages)
+        if stop_predicate is not None:
+            request["stop_predicate"] = f"{stop_predicate.__module__}.{stop_predicate.__qualname__}" \
+                if hasattr(stop_predicate, "__qualname__") else repr(stop_predicate)
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Tuple[Any, Any, str]:
+        """
+        :return: the cached (prompt, response, response_text) or None
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.connection:
+                self.connection.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+        prompt, response, response_text = json.loads(row[0])
+        return prompt, response, response_text
+
+    def count_miss(self):
+        """ Count a request that is not looked up, e.g. in record mode. """
+        with self.lock:
+            self.misses += 1
+
+    def put(self, key: str, model_name: str, prompt: Any, response: Any, response_text: str):
+        value = json.dumps([prompt, response, response_text], default=str)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                    (key, model_name, value, len(value), time.time()))
+            if self.max_bytes is not None:
+                self.__evict()
+
+    def __evict(self):
+        total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_bytes -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} responses from the response cache {self.path}")
+
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls > 0 else 0.
+
+    def wrap(self, model: backends.Model) -> "CachedModel":
+        return CachedModel(model, self)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class CachedModel(backends.Model):
+    """
+    Answers the requests for a model from the response cache (depending on the cache mode).
+    """
+
+    def __init__(self, model: backends.Model, cache: ResponseCache):
+        super().__init__(model.model_spec)
+        self.model = model
+        self.cache = cache
+
+    def set_gen_args(self, **gen_args):
+        super().set_gen_args(**gen_args)
+        self.model.set_gen_args(**gen_args)
+
+    def set_gen_arg(self, arg_name, arg_value):
+        super().set_gen_arg(arg_name, arg_value)
+        self.model.set_gen_arg(arg_name, arg_value)
+
+    def supports_streaming(self) -> bool:
+        return self.model.supports_streaming()
+
+    def stream_response(self, messages: List[Dict]) -> Tuple[Any, Iterator[str]]:
+        return self.model.stream_response(messages)
+
+    def clean_streamed_text(self, text: str) -> str:
+        return self.model.clean_streamed_text(text)
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        return self.model.count_tokens(messages)
+
+    def check_context_limit(self, messages: List[Dict]) -> Tuple[bool, int, int, int]:
+        return self.model.check_context_limit(messages)
+
+    def __lookup(self, messages: List[Dict], stop_predicate: Callable[[str], bool] = None) \
+            -> Tuple[str, Tuple[Any, Any, str]]:
+        key = ResponseCache.key_for(self, messages, stop_predicate)
+        if self.cache.mode == RECORD:
+            self.cache.count_miss()
+            return key, None
+        cached = self.cache.get(key)
+        if cached is None and self.cache.mode == REPLAY:
+            raise ResponseCacheMissError(f"No cached response for {self.get_name()} (key={key})")
+        return key, cached
+
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        key, cached = self.__lookup(messages)
+        if cached is not None:
+            return cached
+        prompt, response, response_text = self.model.generate_response(messages)
+        self.cache.put(key, self.get_name(), prompt, response, response_text)
+        return prompt, response, response_text
+
+    def generate_response_with_stop(self, messages: List[Dict],
+                                    stop_predicate: Callable[[str], bool]) -> Tuple[Any, Any, str]:
+        key, cached = self.__lookup(messages, stop_predicate if self.supports_streaming() else None)
+        if cached is not None:
+            return cached
+        prompt, response, response_text = self.model.generate_response_with_stop(messages, stop_predicate)
+        self.cache.put(key, self.get_name(), prompt, response, response_text)
+        return prompt, response, response_text
+
+    async def generate_response_async(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        key, cached = self.__lookup(messages)
+        if cached is not None:
+            return cached
+        prompt, response, response_text = await self.model.generate_response_async(messages)
+        self.cache.put(key, self.get_name(), prompt, response, response_text)
+        return prompt, response, response_text
@@ -0,0 +1,187 @@
+"""
+    Counts the prompt tokens of messages for a model without loading its weights, so that game masters (and the
+    backends) can check the context limit before a call, e.g. to shorten the history instead of running into a
+    ContextExceededError.
+
+    One tokenizer is kept per model spec; the least recently used tokenizers are evicted. Models of the huggingface_local
+    backend are counted with their own tokenizer and chat template. All other models are counted with tiktoken, if
+    it is installed, or approximated with about 4 characters per token.
+
+    The context size is given by an optional 'context_size' entry in the model registry (or the model config for the
+    huggingface models). Without a known context size, the context limit is not checked.
+"""
+import collections
+import importlib.util
+import json
+import threading
+from typing import List, Dict, Tuple, Optional
+
+import backends
+from backends.utils import model_spec_key, ensure_alternating_roles
+
+logger = backends.get_logger(__name__)
+
+DEFAULT_MAX_TOKENIZERS = 8
+CHARS_PER_TOKEN = 4
+HUGGINGFACE_BACKENDS = ["huggingface_local"]
+
+
+class Tokenizer:
+    """
+    Counts the tokens of messages for a model; approximated by the number of characters.
+    """
+
+    def __init__(self, context_size: Optional[int] = None):
+        self.context_size = context_size
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        return len(json.dumps(messages, default=str)) // CHARS_PER_TOKEN
+
+
+class TiktokenTokenizer(Tokenizer):
+    """
+    Counts the tokens of messages as in the OpenAI cookbook: the content tokens and a few tokens per message.
+    """
+
+    def __init__(self, model_id: str, context_size: Optional[int] = None):
+        super().__init__(context_size)
+        import tiktoken
+        try:
+            self.encoding = tiktoken.encoding_for_model(model_id)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        num_tokens = 0
+        for message in messages:
+            num_tokens += 4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
+            for key, value in message.items():
+                if isinstance(value, str) and key != "image":
+                    num_tokens += len(self.encoding.encode(value, disallowed_special=()))
+        return num_tokens + 2  # every reply is primed with <im_start>assistant
+
+
+class ChatTemplateTokenizer(Tokenizer):
+    """
+    Counts the tokens of the prompt as given to a huggingface model, i.e. with its chat template applied.
+    """
+
+    def __init__(self, tokenizer, context_size: Optional[int] = None):
+        super().__init__(context_size)
+        self.tokenizer = tokenizer
+
+    def count_tokens(self, messages: List[Dict]) -> int:
+        return len(self.tokenizer.apply_chat_template(ensure_alternating_roles(messages), add_generation_prompt=True))
+
+
+def load_tokenizer(model_spec: backends.ModelSpec) -> Tokenizer:
+    """
+    :return: a tokenizer for the model spec; only loads the tokenizer (and config) files, but not the model weights
+    """
+    context_size = model_spec["context_size"] if "context_size" in model_spec else None
+    if "backend" in model_spec and model_spec.backend in HUGGINGFACE_BACKENDS:
+        from backends import huggingface_local_api
+        # the unwrapped loader, so that the tokenizer is not kept resident, but evicted by the token counter
+        tokenizer, _, config_context_size = huggingface_local_api.load_config_and_tokenizer.__wrapped__(model_spec)
+        return ChatTemplateTokenizer(tokenizer, context_size or config_context_size)
+    if importlib.util.find_spec("tiktoken") is not None:
+        model_id = model_spec["model_id"] if "model_id" in model_spec else model_spec.model_name
+        try:
+            return TiktokenTokenizer(model_id, context_size)
+        except Exception as e:  # tiktoken downloads its encodings on first use, e.g. not possible offline
+            logger.warning(f"Cannot load the tiktoken encoding for {model_spec.model_name}, "
+                           f"approximating the tokens instead: {e}")
+    return Tokenizer(context_size)
+
+
+class TokenCounter:
+
+    def __init__(self, max_tokenizers: int = DEFAULT_MAX_TOKENIZERS):
+        """
+        :param max_tokenizers: when exceeded, the least recently used tokenizer is evicted
+        """
+        self.max_tokenizers = max_tokenizers
+        self.tokenizers: collections.OrderedDict = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_tokenizer(self, model_spec: backends.ModelSpec) -> Tokenizer:
+        key = model_spec_key(model_spec)
+        with self.lock:
+            if key in self.tokenizers:
+                self.tokenizers.move_to_end(key)
+                return self.tokenizers[key]
+        tokenizer = load_tokenizer(model_spec)
+        with self.lock:
+            self.tokenizers[key] = tokenizer
+            while len(self.tokenizers) > self.max_tokenizers:
+                self.tokenizers.popitem(last=False)
+        logger.info(f"Loaded {tokenizer.__class__.__name__} for {model_spec.model_name}")
+        return tokenizer
+
+    def count_tokens(self, model_spec: backends.ModelSpec, messages: List[Dict]) -> int:
+        """
+        :param model_spec: of the model to count the tokens for
+        :param messages: for example
+                [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": "Who won the world series in 2020?"}
+                ]
+        :return: the number of prompt tokens
+        """
+        return self.get_tokenizer(model_spec).count_tokens(messages)
+
+    def get_context_size(self, model_spec: backends.ModelSpec) -> Optional[int]:
+        """
+        :return: the context token limit of the model or None, if unknown
+        """
+        return self.get_tokenizer(model_spec).context_size
+
+    def check_context_limit(self, model_spec: backends.ModelSpec, messages: List[Dict],
+                            max_new_tokens: int = 100) -> Tuple[bool, int, int, int]:
+        """
+        :param model_spec: of the model to check the messages for
+        :param messages: the prompt messages
+        :param max_new_tokens: How many tokens to generate ('at most', but no stop sequence is defined).
+        :return: Tuple with
+                Bool: True if context limit is not exceeded (or unknown), False if too many tokens
+                Number of tokens for the given messages and maximum new tokens
+                Number of tokens of 'context space left' (None, if the context limit is unknown)
+                Total context token limit (None, if unknown)
+        """
+        tokenizer = self.get_tokenizer(model_spec)
+        tokens_used = tokenizer.count_tokens(messages) + max_new_tokens
+        if tokenizer.context_size is None:
+            return True, tokens_used, None, None
+        tokens_left = tokenizer.context_size - tokens_used
+        return tokens_used <= tokenizer.context_size, tokens_used, tokens_left, tokenizer.context_size
+
+    def clear(self):
+        with self.lock:
+            self.tokenizers.clear()
+
+
+token_counter = TokenCounter()
+
+
+def count_tokens(model_spec: backends.ModelSpec, messages: List[Dict]) -> int:
+    return token_counter.count_tokens(model_spec, messages)
+
+
+def check_context_limit(model_spec: backends.ModelSpec, messages: List[Dict],
+                        max_new_tokens: int = 100) -> Tuple[bool, int, int, int]:
+    return token_counter.check_context_limit(model_spec, messages, max_new_tokens)
+
+
+def ensure_context_limit(model_spec: backends.ModelSpec, messages: List[Dict], max_new_tokens: int = 100) -> int:
+    """
+    Check the context limit before a call to the model.
+    :return: the number of tokens for the given messages and maximum new tokens
+    :raise ContextExceededError: if the messages and the maximal response length exceed the context size
+    """
+    fits, tokens_used, tokens_left, context_size = check_context_limit(model_spec, messages, max_new_tokens)
+    if not fits:
+        logger.info(f"Context token limit for {model_spec.model_name} exceeded: {tokens_used}/{context_size}")
+        raise backends.ContextExceededError(f"Context token limit for {model_spec.model_name} exceeded",
+                                            tokens_used=tokens_used, tokens_left=tokens_left,
+                                            context_size=context_size)
+    return tokens_used
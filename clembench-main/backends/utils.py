@@ -1,6 +1,11 @@
+import asyncio
 import copy
+import inspect
+import json
+import threading
+import weakref
 from functools import wraps
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Callable, Any, Iterator
 
 from backends import get_logger, ContextExceededError
 
@@ -54,6 +59,14 @@ def ensure_alternating_roles(messages: List[Dict], cull_system_message: bool = T
 
 
 def ensure_messages_format(generate_response_fn):
+    if inspect.iscoroutinefunction(generate_response_fn):
+        @wraps(generate_response_fn)
+        async def wrapped_async_fn(self, messages):
+            _messages = ensure_alternating_roles(messages)
+            return await generate_response_fn(self, _messages)
+
+        return wrapped_async_fn
+
     @wraps(generate_response_fn)
     def wrapped_fn(self, messages):
         _messages = ensure_alternating_roles(messages)
@@ -62,6 +75,97 @@ def ensure_messages_format(generate_response_fn):
     return wrapped_fn
 
 
+class ChatCompletionStream:
+    """
+    Iterates over the text chunks of a streamed (OpenAI-compatible) chat completion and collects the fields of the
+    chunks (id, model, usage, finish reason, ...) into a chat completion as the response object to be logged. The
+    stream is closed, when it is exhausted or when it is closed early, so that the generation is cancelled.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.response: Dict = dict()
+        self.__close_callbacks: List[Callable[[], Any]] = []
+        self.__content = ""
+        self.__finish_reason = None
+        self.__finished = False
+        self.__chunks = self.__iterate()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return next(self.__chunks)
+
+    def call_on_close(self, callback: Callable[[], Any]):
+        """
+        :param callback: called once, when the stream is exhausted or closed, e.g. to release a rate limit
+        """
+        self.__close_callbacks.append(callback)
+
+    def close(self):
+        self.__chunks.close()
+        self.__finish()  # the generator does not finish itself, if it has not been started
+
+    def __iterate(self) -> Iterator[str]:
+        try:
+            for chunk in self.stream:
+                fields = chunk.model_dump() if hasattr(chunk, "model_dump") else dict(chunk)
+                choices = fields.pop("choices", None) or []
+                self.response.update({key: value for key, value in fields.items() if value is not None})
+                if choices:
+                    self.__finish_reason = choices[0].get("finish_reason") or self.__finish_reason
+                    text = (choices[0].get("delta") or {}).get("content")
+                    if text:
+                        self.__content += text
+                        yield text
+        finally:
+            self.__finish()
+
+    def __finish(self):
+        if self.__finished:
+            return
+        self.__finished = True
+        self.response["object"] = "chat.completion"
+        self.response["choices"] = [{"index": 0, "message": {"role": "assistant", "content": self.__content},
+                                     "finish_reason": self.__finish_reason}]
+        try:
+            self.stream.close()
+        finally:
+            for callback in self.__close_callbacks:
+                callback()
+
+
+def stream_chat_completion(stream) -> ChatCompletionStream:
+    """
+    :return: the text chunks of a streamed (OpenAI-compatible) chat completion (see ChatCompletionStream)
+    """
+    return ChatCompletionStream(stream)
+
+
+class LoopLocal:
+    """
+    Holds a separate instance per event loop, similar to a thread local. Asynchronous clients keep connections that
+    are bound to the event loop they have been created in, so that these must not be shared between event loops.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        """
+        :param factory: creates the instance for the running event loop
+        """
+        self.factory = factory
+        self.__instances = weakref.WeakKeyDictionary()
+
+    def get(self):
+        """
+        :return: the instance for the running event loop (must be called from within a coroutine)
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self.__instances:
+            self.__instances[loop] = self.factory()
+        return self.__instances[loop]
+
+
 def check_context_limit_generic(context_size: int, prompt_tokens: List, model_name: str, max_new_tokens: int = 100) \
         -> Tuple[bool, int, int, int]:
     """
@@ -88,3 +192,49 @@ def check_context_limit_generic(context_size: int, prompt_tokens: List, model_na
                                    tokens_used=tokens_used, tokens_left=tokens_left, context_size=context_size)
 
     return fits, tokens_used, tokens_left, context_size
+
+
+_resident_objects: Dict[Tuple[str, str], Any] = dict()
+_resident_locks: Dict[Tuple[str, str], threading.Lock] = dict()  # held while the object for the key is loaded
+_resident_lock = threading.Lock()  # guards the dicts above, never held while loading
+
+
+def model_spec_key(model_spec) -> str:
+    """
+    :return: a canonical string for the (unified) model spec, independent of the order of its attributes
+    """
+    return json.dumps(model_spec.__dict__, sort_keys=True, default=str)
+
+
+def keep_resident(load_func: Callable) -> Callable:
+    """
+    Decorator for functions which load the weights (or tokenizer, processor) for a model spec, e.g. load_model().
+    The loaded objects are kept in memory for the lifetime of the process, so that later runs with the same
+    model spec (e.g. of other games) re-use them instead of loading the weights again. Only the loads of the same
+    function and model spec wait for each other, so that the decorated functions can also call each other.
+    """
+
+    @wraps(load_func)
+    def wrapped(model_spec, *args, **kwargs):
+        key = (f"{load_func.__module__}.{load_func.__qualname__}", model_spec_key(model_spec))
+        with _resident_lock:
+            key_lock = _resident_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with _resident_lock:
+                if key in _resident_objects:
+                    logger.info(f"Re-use resident {load_func.__qualname__}() result for {model_spec.model_name}")
+                    return _resident_objects[key]
+            loaded = load_func(model_spec, *args, **kwargs)
+            with _resident_lock:
+                _resident_objects[key] = loaded
+            return loaded
+
+    return wrapped
+
+
+def release_resident_models():
+    """
+    Drop all references to the objects kept by keep_resident(), so that their memory can be freed.
+    """
+    with _resident_lock:
+        _resident_objects.clear()
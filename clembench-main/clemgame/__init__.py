@@ -32,6 +32,22 @@ def get_logger(name):
     return logging.getLogger(name)
 
 
+def set_log_file(file_name: str):
+    """
+    Redirect the file logging (by default to clembench.log) to another file, e.g. for worker processes.
+    :param file_name: relative to the project root or an absolute path
+    """
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        if isinstance(handler, logging.FileHandler):
+            file_handler = logging.FileHandler(os.path.join(project_root, file_name), encoding="utf8")
+            file_handler.setFormatter(handler.formatter)
+            file_handler.setLevel(handler.level)
+            root_logger.removeHandler(handler)
+            handler.close()
+            root_logger.addHandler(file_handler)
+
+
 # Load games dynamically from "games" sibling directory
 # Note: The games might use get_logger (circular import)
 games_root = os.path.join(project_root, "games")
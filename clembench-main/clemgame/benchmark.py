@@ -1,12 +1,21 @@
 """ Main entry point """
-from typing import List, Dict
+import collections
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Tuple, Union
+
+from tqdm import tqdm
 
 import backends
 import clemgame
+from backends import replay_api
 
 from datetime import datetime
 
-from clemgame.clemgame import load_benchmarks, load_benchmark
+from clemgame import file_utils
+from clemgame.clemgame import load_benchmarks, load_benchmark, ExperimentRun
+from clemgame.record_stream import RECORDS_FILE_NAME, set_record_stream_args
 
 logger = clemgame.get_logger(__name__)
 stdout_logger = clemgame.get_logger("benchmark.run")
@@ -14,6 +23,13 @@ stdout_logger = clemgame.get_logger("benchmark.run")
 # look for custom user-defined models before loading the base registry
 backends.load_custom_model_registry()
 backends.load_model_registry()
+# the replay backend reads the recorded requests as they have been stored (e.g. compressed or as records)
+replay_api.set_requests_loader(file_utils.load_results_requests)
+
+
+def serve(model_spec: backends.ModelSpec, host: str = "localhost", port: int = 8765):
+    from backends import model_server
+    model_server.serve(model_spec, host=host, port=port)
 
 
 def list_games():
@@ -26,8 +42,42 @@ def list_games():
         stdout_logger.info(" Game: %s -> %s", game.name, game.get_description())
 
 
-def run(game_name: str, model_specs: List[backends.ModelSpec], gen_args: Dict,
-        experiment_name: str = None, instances_name: str = None, results_dir: str = None):
+def run(game_name: Union[str, List[str]], model_specs: List[backends.ModelSpec], gen_args: Dict,
+        experiment_name: str = None, instances_name: str = None, results_dir: str = None, parallel: int = 1,
+        use_async: bool = False, resume: bool = False, shards: int = 1, response_cache: Dict = None,
+        results_store: bool = False, record_stream: Dict = None, compact_requests: bool = False,
+        compression: str = None, write_behind: int = 0):
+    """
+    :param game_name: a game name or a list of game names; the games are played one after another with the same
+                      models, so that local model weights are only loaded once
+    :param response_cache: the arguments (path, mode, max_bytes) of a backends.response_cache.ResponseCache
+                           to be used by all models. Default: None (no caching)
+    :param results_store: store the results in a single results.sqlite file in the results directory instead of
+                          the results files (see export_results()). Default: False
+    :param record_stream: the arguments (buffer_size, fsync) of a clemgame.record_stream.RecordStream to append
+                          the records of each episode to a records.jsonl file as they happen (see
+                          assemble_records()). Default: None (the records are stored at the end of each episode)
+    :param compact_requests: store the requests.json files delta-encoded (see backends.requests_codec).
+                             Default: False
+    :param compression: compress the json results files with gzip or zstd (see clemgame.results_io).
+                        Default: None
+    :param write_behind: the maximal number of results files waiting to be written by a background thread, so that
+                         the next episode does not wait for the disk (see clemgame.results_writer).
+                         Default: 0 (write the results files synchronously)
+    """
+    game_names = [game_name] if isinstance(game_name, str) else game_name
+    if results_store:
+        file_utils.create_results_store(results_dir)
+    if shards > 1:
+        run_sharded(game_names, model_specs, gen_args, experiment_name, instances_name, results_dir, parallel,
+                    use_async, resume, shards, response_cache, record_stream, compact_requests, compression,
+                    write_behind)
+        return
+    _enable_response_cache(response_cache)
+    set_record_stream_args(record_stream)
+    file_utils.set_compact_requests(compact_requests)
+    file_utils.set_compression(compression)
+    file_utils.set_results_writer(write_behind)
     if experiment_name:
         logger.info("Only running experiment: %s", experiment_name)
     try:
@@ -36,18 +86,289 @@ def run(game_name: str, model_specs: List[backends.ModelSpec], gen_args: Dict,
             model = backends.get_model_for(model_spec)
             model.set_gen_args(**gen_args)  # todo make this somehow available in generate method?
             player_models.append(model)
-        benchmark = load_benchmark(game_name, instances_name=instances_name)
-        logger.info("Running benchmark for '%s' (models=%s)", game_name,
-                    player_models if player_models is not None else "see experiment configs")
-        if experiment_name:
-            benchmark.filter_experiment.append(experiment_name)
-        time_start = datetime.now()
-        benchmark.run(player_models=player_models, results_dir=results_dir)
-        time_end = datetime.now()
-        logger.info(f"Run {benchmark.name} took {str(time_end - time_start)}")
     except Exception as e:
         stdout_logger.exception(e)
         logger.error(e, exc_info=True)
+        return
+    for game_name in game_names:
+        try:
+            benchmark = load_benchmark(game_name, instances_name=instances_name)
+            logger.info("Running benchmark for '%s' (models=%s)", game_name,
+                        player_models if player_models is not None else "see experiment configs")
+            if experiment_name:
+                benchmark.filter_experiment.append(experiment_name)
+            time_start = datetime.now()
+            experiment_runs = benchmark.run(player_models=player_models, results_dir=results_dir,
+                                            parallel=parallel, use_async=use_async, resume=resume)
+            _report_write_errors(experiment_runs)
+            time_end = datetime.now()
+            logger.info(f"Run {benchmark.name} took {str(time_end - time_start)}")
+        except Exception as e:
+            stdout_logger.exception(e)
+            logger.error(e, exc_info=True)
+    _report_response_cache()
+
+
+def run_sharded(game_name: Union[str, List[str]], model_specs: List[backends.ModelSpec], gen_args: Dict,
+                experiment_name: str = None, instances_name: str = None, results_dir: str = None, parallel: int = 1,
+                use_async: bool = False, resume: bool = False, shards: int = 2,
+                response_cache: Dict = None, record_stream: Dict = None,
+                compact_requests: bool = False, compression: str = None, write_behind: int = 0) -> List[Dict]:
+    """
+    Split the episodes of a run across worker processes. Each worker process loads its own backends (and weights)
+    and plays every n-th episode of each experiment (the episode numbering stays the same as for a single process).
+    The workers log to clembench.shard_<idx>.log and the experiment configs are stored once by this process.
+    :return: the summaries of the merged experiment runs
+    """
+    game_names = [game_name] if isinstance(game_name, str) else game_name
+    if experiment_name:
+        logger.info("Only running experiment: %s", experiment_name)
+    logger.info("Running benchmark for %s with %s shards", game_names, shards)
+    time_start = datetime.now()
+    # spawn fresh processes: CUDA and the backend clients do not survive a fork
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=shards, mp_context=mp_context) as executor:
+        futures = [executor.submit(_run_shard, shard_idx, shards, game_names, model_specs, gen_args,
+                                   experiment_name, instances_name, results_dir, parallel, use_async, resume,
+                                   response_cache, record_stream, compact_requests, compression, write_behind)
+                   for shard_idx in range(shards)]
+        shard_summaries = []
+        for shard_idx, future in enumerate(futures):
+            try:
+                shard_summaries.extend(future.result())
+            except Exception as e:
+                stdout_logger.error(f"Shard {shard_idx} failed: See clembench.shard_{shard_idx}.log for details.")
+                logger.error(e, exc_info=True)
+    experiment_summaries = _merge_shard_summaries(shard_summaries)
+    for summary in experiment_summaries:
+        game_name = summary["game_name"]
+        benchmark = load_benchmark(game_name, do_setup=False)
+        benchmark.store_results_file(summary["experiment_config"], f"experiment_{summary['experiment_name']}.json",
+                                     summary["dialogue_pair_desc"], sub_dir=summary["experiment_record_dir"],
+                                     root_dir=summary["results_root"])
+        if summary["error_count"] > 0:
+            stdout_logger.error(f"{game_name}: '{summary['error_count']}' exceptions occurred in "
+                                f"{summary['experiment_name']}: See clembench.shard_*.log for details.")
+    time_end = datetime.now()
+    logger.info(f"Run {game_names} with {shards} shards took {str(time_end - time_start)}")
+    return experiment_summaries
+
+
+def _run_shard(shard_idx: int, num_shards: int, game_names: List[str], model_specs: List[backends.ModelSpec],
+               gen_args: Dict, experiment_name: str, instances_name: str, results_dir: str, parallel: int,
+               use_async: bool, resume: bool, response_cache: Dict, record_stream: Dict,
+               compact_requests: bool, compression: str, write_behind: int) -> List[Dict]:
+    """ Entry point of a worker process for run_sharded(); returns picklable summaries of the experiment runs. """
+    clemgame.set_log_file(f"clembench.shard_{shard_idx}.log")
+    _enable_response_cache(response_cache)
+    set_record_stream_args(record_stream)
+    file_utils.set_compact_requests(compact_requests)
+    file_utils.set_compression(compression)
+    file_utils.set_results_writer(write_behind)
+    player_models = []
+    for model_spec in model_specs:
+        model = backends.get_model_for(model_spec)
+        model.set_gen_args(**gen_args)
+        player_models.append(model)
+    summaries = []
+    for game_name in game_names:
+        benchmark = load_benchmark(game_name, instances_name=instances_name)
+        logger.info("Running shard %s of %s for '%s' (models=%s)", shard_idx, num_shards, game_name, player_models)
+        if experiment_name:
+            benchmark.filter_experiment.append(experiment_name)
+        experiment_runs = benchmark.run(player_models=player_models, results_dir=results_dir, parallel=parallel,
+                                        use_async=use_async, resume=resume, shard=(shard_idx, num_shards))
+        _report_write_errors(experiment_runs)
+        summaries.extend(dict(game_name=game_name,
+                              experiment_name=experiment_run.experiment_name,
+                              experiment_config=experiment_run.experiment_config,
+                              experiment_record_dir=experiment_run.experiment_record_dir,
+                              dialogue_pair_desc=experiment_run.dialogue_pair_desc,
+                              results_root=experiment_run.results_root,
+                              time_start=experiment_run.time_start,
+                              time_end=experiment_run.time_end,
+                              previous_duration=experiment_run.previous_duration,
+                              error_count=experiment_run.error_count)
+                         for experiment_run in experiment_runs)
+    _report_response_cache()
+    return summaries
+
+
+def _merge_shard_summaries(shard_summaries: List[Dict]) -> List[Dict]:
+    """
+    Merge the experiment runs of all shards: the duration spans the earliest start to the latest end (plus the
+    duration of a resumed run).
+    """
+    merged = dict()
+    for summary in shard_summaries:
+        key = (summary["game_name"], summary["results_root"], summary["dialogue_pair_desc"],
+               summary["experiment_record_dir"])
+        if key not in merged:
+            merged[key] = dict(summary)
+            continue
+        experiment = merged[key]
+        experiment["time_start"] = min(experiment["time_start"], summary["time_start"])
+        experiment["time_end"] = max(experiment["time_end"], summary["time_end"])
+        experiment["error_count"] += summary["error_count"]
+    for experiment in merged.values():
+        duration = experiment["time_end"] - experiment["time_start"]
+        if experiment["previous_duration"] is None:
+            experiment["experiment_config"]["timestamp"] = experiment["time_start"].isoformat()
+        else:  # a resumed run keeps the timestamp of the first run (see ExperimentRun.skip_recorded_episodes())
+            experiment["experiment_config"]["resumed"] = experiment["time_start"].isoformat()
+            duration += experiment["previous_duration"]
+        experiment["experiment_config"]["duration"] = str(duration)
+    return list(merged.values())
+
+
+def sweep(game_runs: List[Tuple[str, List[backends.ModelSpec]]], gen_args: Dict,
+          instances_name: str = None, results_dir: str = None, parallel: int = 1,
+          backend_limits: Dict[str, int] = None, resume: bool = False, response_cache: Dict = None,
+          results_store: bool = False, record_stream: Dict = None, compact_requests: bool = False,
+          compression: str = None, write_behind: int = 0):
+    """
+    Run several games with several model pairings within a single process. The episodes of all runs are put into
+    a single work queue and are played by a shared pool of workers.
+
+    :param game_runs: the game names with the model specs to play the game with
+    :param gen_args: the generation arguments for all models
+    :param instances_name: the instances file name of the games
+    :param results_dir: the results root directory
+    :param parallel: the number of episodes to be played at the same time overall
+    :param backend_limits: the maximal number of episodes played at the same time per backend name
+    :param resume: only play the episodes that have not been recorded yet (or failed)
+    :param response_cache: the arguments (path, mode, max_bytes) of a backends.response_cache.ResponseCache
+    :param results_store: store the results in a single results.sqlite file in the results directory
+    :param record_stream: the arguments (buffer_size, fsync) of a clemgame.record_stream.RecordStream
+    :param compact_requests: store the requests.json files delta-encoded
+    :param compression: compress the json results files with gzip or zstd
+    :param write_behind: the maximal number of results files waiting to be written by a background thread
+    :raise ValueError: if parallel or a backend limit is less than 1, so that no episode could be played
+    """
+    backend_limits = backend_limits or dict()
+    if parallel < 1:
+        raise ValueError(f"The number of parallel episodes must be at least 1, but is {parallel}")
+    for backend_name, backend_limit in backend_limits.items():
+        if backend_limit < 1:
+            raise ValueError(f"The limit of the backend {backend_name} must be at least 1, but is {backend_limit}")
+    _enable_response_cache(response_cache)
+    set_record_stream_args(record_stream)
+    file_utils.set_compact_requests(compact_requests)
+    file_utils.set_compression(compression)
+    file_utils.set_results_writer(write_behind)
+    if results_store:
+        file_utils.create_results_store(results_dir)
+    results_root = "results" if results_dir is None else results_dir
+    models = dict()  # the same model spec should result in the same model (and only be loaded once)
+    benchmarks = dict()
+    episodes = collections.deque()
+    for game_name, model_specs in game_runs:
+        try:
+            player_models = []
+            for model_spec in model_specs:
+                if str(model_spec) not in models:
+                    model = backends.get_model_for(model_spec)
+                    model.set_gen_args(**gen_args)
+                    models[str(model_spec)] = model
+                player_models.append(models[str(model_spec)])
+            if game_name not in benchmarks:
+                benchmarks[game_name] = load_benchmark(game_name, instances_name=instances_name)
+            for experiment_run in benchmarks[game_name].experiment_runs(player_models, results_root):
+                if resume and not experiment_run.skip_recorded_episodes():
+                    continue
+                if not experiment_run.episode_ids:
+                    experiment_run.start()
+                    experiment_run.finish([])
+                backend_names = sorted(set(_backend_name_of(model) for model in experiment_run.dialogue_pair))
+                for episode_id, game_instance in zip(experiment_run.episode_ids, experiment_run.game_instances):
+                    episodes.append((experiment_run, backend_names, episode_id, game_instance))
+        except Exception as e:
+            stdout_logger.exception(e)
+            logger.error(e, exc_info=True)
+    stdout_logger.info(f"Sweep over {len(game_runs)} game runs with {len(episodes)} episodes")
+
+    time_start = datetime.now()
+    episodes_played: Dict[ExperimentRun, Dict[int, bool]] = collections.defaultdict(dict)
+    episodes_running = collections.Counter()  # per backend name
+    progress = tqdm(total=len(episodes), desc="Sweep")
+
+    def can_start(backend_names: List[str]) -> bool:
+        return all(episodes_running[name] < backend_limits[name]
+                   for name in backend_names if name in backend_limits)
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = dict()
+        while episodes or futures:
+            # dispatch episodes in queue order, but skip those whose backends are saturated for now
+            for episode in list(episodes):
+                if len(futures) >= parallel:
+                    break
+                experiment_run, backend_names, episode_id, game_instance = episode
+                if not can_start(backend_names):
+                    continue
+                episodes.remove(episode)
+                if experiment_run.time_start is None:
+                    experiment_run.start()
+                episodes_running.update(backend_names)
+                future = executor.submit(experiment_run.play_episode, episode_id, game_instance)
+                futures[future] = episode
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                experiment_run, backend_names, episode_id, _ = futures.pop(future)
+                episodes_running.subtract(backend_names)
+                try:
+                    episodes_played[experiment_run][episode_id] = future.result()
+                except Exception as e:  # e.g. the game instance could not be stored; the other episodes go on
+                    stdout_logger.error(f"{experiment_run.benchmark.name}: episode {episode_id} failed: {e}")
+                    logger.error(e, exc_info=True)
+                    episodes_played[experiment_run][episode_id] = False
+                if len(episodes_played[experiment_run]) == len(experiment_run.episode_ids):
+                    experiment_run.finish([episodes_played[experiment_run][episode_id]
+                                           for episode_id in experiment_run.episode_ids])
+                progress.update()
+    progress.close()
+    _report_write_errors(list(episodes_played))
+    time_end = datetime.now()
+    logger.info(f"Sweep took {str(time_end - time_start)}")
+    _report_response_cache()
+
+
+def _report_write_errors(experiment_runs: List[ExperimentRun]):
+    """ Wait for the results files to be written and count the files which could not be written as errors. """
+    write_errors = file_utils.flush_results_writer()
+    for location, error in write_errors:
+        stdout_logger.error(f"Cannot write results file {location}: {error}")
+        for experiment_run in experiment_runs:
+            if f"{experiment_run.dialogue_pair_desc}/{experiment_run.benchmark.name}/" \
+                    f"{experiment_run.experiment_record_dir}/" in location.replace(os.sep, "/"):
+                experiment_run.error_count += 1
+                break
+    if write_errors:
+        stdout_logger.error(f"'{len(write_errors)}' results files could not be written: "
+                            f"See clembench.log for details.")
+
+
+def _enable_response_cache(response_cache: Dict):
+    if response_cache is None:
+        return
+    from backends.response_cache import ResponseCache
+    backends.set_response_cache(ResponseCache(**response_cache))
+    logger.info("Using response cache: %s", response_cache)
+
+
+def _report_response_cache():
+    response_cache = backends.get_response_cache()
+    if response_cache is None:
+        return
+    calls = response_cache.hits + response_cache.misses
+    stdout_logger.info(f"Response cache ({response_cache.mode}): {response_cache.hits} hits of {calls} calls "
+                       f"({response_cache.hit_rate():.1%})")
+
+
+def _backend_name_of(model: backends.Model) -> str:
+    if model.model_spec.has_backend():
+        return model.model_spec.backend
+    return model.get_name()  # programmatic and human players
 
 
 def score(game_name: str, experiment_name: str = None, results_dir: str = None):
@@ -94,3 +415,48 @@ def transcripts(game_name: str, experiment_name: str = None, results_dir: str =
         except Exception as e:
             stdout_logger.exception(e)
             logger.error(e, exc_info=True)
+
+
+def export_results(results_dir: str = None, target_dir: str = None):
+    """
+    Write the results directory tree (instance.json, interactions.json, requests.json, scores.json, transcripts)
+    from the results store of a results directory.
+    :param results_dir: the results directory with the results.sqlite file
+    :param target_dir: the directory to write the results files to. Default: the results directory
+    """
+    store = file_utils.results_store_for(results_dir)
+    if store is None:
+        stdout_logger.error(f"No results store found in {file_utils.results_root(results_dir)}")
+        return
+    target_root = file_utils.results_root(target_dir if target_dir else results_dir)
+    time_start = datetime.now()
+    num_files = store.export(target_root)
+    stdout_logger.info(f"Exported {num_files} results files to {target_root} in {datetime.now() - time_start}")
+
+
+def assemble_records(results_dir: str = None):
+    """
+    Write the interactions.json and requests.json files of the episodes whose records have been streamed (see run()),
+    e.g. for the evaluation scripts or the replay backend, which read these files.
+    :param results_dir: the results root directory
+    """
+    results_root = file_utils.results_root(results_dir)
+    time_start = datetime.now()
+    num_episodes = 0
+    for dialogue_pair in file_utils.list_results_dirs(results_root):
+        for game_name in file_utils.list_results_dirs(results_root, dialogue_pair):
+            for experiment_dir in file_utils.list_results_dirs(results_root, dialogue_pair, game_name):
+                for episode_dir in file_utils.list_results_dirs(results_root, dialogue_pair, game_name,
+                                                                experiment_dir):
+                    rel_episode_path = f"{experiment_dir}/{episode_dir}"
+                    if not file_utils.results_file_exists(f"{rel_episode_path}/{RECORDS_FILE_NAME}", results_root,
+                                                          dialogue_pair, game_name):
+                        continue
+                    for file_name in ["interactions", "requests"]:
+                        data = file_utils.load_results_json(f"{rel_episode_path}/{file_name}", results_root,
+                                                            dialogue_pair, game_name)
+                        file_utils.store_game_results_file(data, f"{file_name}.json", dialogue_pair, game_name,
+                                                           sub_dir=rel_episode_path, root_dir=results_root)
+                    num_episodes += 1
+    stdout_logger.info(f"Assembled the records of {num_episodes} episodes in {results_root} "
+                       f"in {datetime.now() - time_start}")
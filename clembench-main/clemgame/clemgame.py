@@ -1,16 +1,21 @@
 import abc
+import asyncio
 import collections
 import copy
-import os.path
-from datetime import datetime
-from typing import List, Dict, Tuple, Any
+import inspect
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Tuple, Any, Callable
 
 from tqdm import tqdm
 
 import backends
-from backends import Model, CustomResponseModel, HumanModel
+from backends import Model, CustomResponseModel, HumanModel, ContextExceededError
 import clemgame
 from clemgame import file_utils, transcript_utils
+from clemgame.history import HistoryPolicy
+from clemgame.record_stream import RecordStream, RECORDS_FILE_NAME, get_record_stream_args, is_complete
 import clemgame.metrics as ms
 
 logger = clemgame.get_logger(__name__)
@@ -32,6 +37,8 @@ class Player(abc.ABC):
     def __init__(self, model: Model):
         self.model = model
         self.descriptor: str = None
+        # optionally given by a game to stop the generation as soon as the response is complete (e.g. a first line)
+        self.stop_predicate: Callable[[str], bool] = None
         logger.info("Player %s", self.get_description())
 
     def get_description(self) -> str:
@@ -45,8 +52,34 @@ class Player(abc.ABC):
             response_text = self._custom_response(messages, turn_idx)
         elif isinstance(self.model, HumanModel):
             response_text = self._terminal_response(messages, turn_idx)
+        elif self.stop_predicate is not None:
+            prompt, response, response_text = self.model.generate_response_with_stop(messages, self.stop_predicate)
         else:
             prompt, response, response_text = self.model.generate_response(messages)
+        return self.__log_call(call_start, prompt, response, response_text)
+
+    async def call_async(self, messages: List[Dict], turn_idx) -> Tuple[Any, Any, str]:
+        """
+        Asynchronous variant of calling the player. The backend players are called via the generate_response_async()
+        method of the backend, so that the event loop can proceed with other episodes while waiting for the response.
+        """
+        if type(self).__call__ is not Player.__call__:  # respect players that overwrite the call
+            return await asyncio.to_thread(self, messages, turn_idx)
+        call_start = datetime.now()
+        prompt = messages
+        response = dict()
+        if isinstance(self.model, CustomResponseModel):
+            response_text = self._custom_response(messages, turn_idx)
+        elif isinstance(self.model, HumanModel):
+            response_text = await asyncio.to_thread(self._terminal_response, messages, turn_idx)
+        elif self.stop_predicate is not None:
+            prompt, response, response_text = await asyncio.to_thread(self.model.generate_response_with_stop,
+                                                                      messages, self.stop_predicate)
+        else:
+            prompt, response, response_text = await self.model.generate_response_async(messages)
+        return self.__log_call(call_start, prompt, response, response_text)
+
+    def __log_call(self, call_start: datetime, prompt: Any, response: Dict, response_text: str):
         call_duration = datetime.now() - call_start
         response["clem_player"] = {
             "call_start": str(call_start),
@@ -188,19 +221,40 @@ class GameRecorder(GameResourceLocator):
         }
         """ Stores calls to the API """
         self.requests = []
+        """ Optionally appends the interactions and calls to the records file of the episode as they happen """
+        self.record_stream: RecordStream = None
+
+    def stream_records(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str,
+                       buffer_size: int = 64, fsync: str = "flush"):
+        """
+        Append the interactions and calls to the records file of the episode as they are logged. The calls are
+        then not kept in memory and store_records() only completes the records file.
+
+        :param buffer_size: the number of records to be buffered before they are written to the file
+        :param fsync: the fsync policy: never, flush (when the buffer is written) or always (for each record)
+        """
+        game_results_dir = file_utils.game_results_dir_for(results_root, dialogue_pair_desc, self.name)
+        self.record_stream = RecordStream(f"{game_results_dir}/{game_record_dir}/{RECORDS_FILE_NAME}",
+                                          buffer_size=buffer_size, fsync=fsync)
 
     def log_next_turn(self):
         """ Call this method to group interactions per turn """
         self.log_current_turn += 1
         self.interactions["turns"].append([])
+        if self.record_stream is not None:
+            self.record_stream.append({"type": "turn"})
 
     def log_key(self, key: str, value: Any):
         """Add a key and value to the internal log."""
         self.interactions[key] = value
+        if self.record_stream is not None:
+            self.record_stream.append({"type": "key", "key": key, "value": value})
         self.logger.info(f"{self.name}: Logged a game-specific interaction key: {key}.")
 
     def log_players(self, players_dic: Dict):
         self.interactions["players"] = players_dic
+        if self.record_stream is not None:
+            self.record_stream.append({"type": "players", "players": players_dic})
         self.logger.info(f"{self.name}: Logged players metadata.")
 
     def log_event(self, from_: str, to: str, action: Dict, call: Tuple[Any, Any] = None):
@@ -224,7 +278,12 @@ class GameRecorder(GameResourceLocator):
         self.interactions["turns"][self.log_current_turn].append(action_obj.copy())
         self.logger.info(
             f"{self.name}: Logged {action['type']} action ({from_}->{to}).")
-        if call:
+        if self.record_stream is not None:
+            self.record_stream.append({"type": "event", "event": action_obj})
+            if call:
+                self.record_stream.append_call(timestamp, call[0], call[1])
+                self.logger.info(f"{self.name}: Logged a call with timestamp {timestamp}")
+        elif call:
             call_obj = {
                 "timestamp": timestamp,
                 "manipulated_prompt_obj": self._needs_copy(call[0]),
@@ -254,6 +313,9 @@ class GameRecorder(GameResourceLocator):
                     self.logger.warning(f"Invalid player identifiers, html builder won't work.")
         if not self.interactions["turns"]:
             self.logger.warning(f"Interaction logs are missing!")
+        if self.record_stream is not None:
+            self.__complete_record_stream(results_root, dialogue_pair_desc, game_record_dir)
+            return
         if not self.requests:
             self.logger.warning(f"No calls logged!")
         self.store_results_file(self.interactions, "interactions.json",
@@ -265,6 +327,22 @@ class GameRecorder(GameResourceLocator):
                                 sub_dir=game_record_dir,
                                 root_dir=results_root)
 
+    def __complete_record_stream(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str):
+        if self.record_stream.num_calls == 0:
+            self.logger.warning(f"No calls logged!")
+        self.record_stream.close()
+        if file_utils.results_store_for(results_root) is not None:
+            # the results store is not appendable, so that the completed records are moved there
+            with open(self.record_stream.file_path, encoding="utf-8") as f:
+                records = f.read()
+            self.store_results_file(records, RECORDS_FILE_NAME, dialogue_pair_desc,
+                                    sub_dir=game_record_dir, root_dir=results_root)
+            os.remove(self.record_stream.file_path)
+            try:  # and the directories of the records file, if these are empty then
+                os.removedirs(os.path.dirname(self.record_stream.file_path))
+            except OSError:
+                pass
+
 
 class GameMaster(GameRecorder):
     """
@@ -300,6 +378,13 @@ class GameMaster(GameRecorder):
         """
         raise NotImplementedError()
 
+    async def play_async(self) -> None:
+        """
+        Play the game within an event loop. Game masters that do not implement an asynchronous
+        game play are played in a worker thread, so that the event loop is not blocked.
+        """
+        await asyncio.to_thread(self.play)
+
 
 class GameScorer(GameResourceLocator):
     """
@@ -387,6 +472,8 @@ class DialogueGameMaster(GameMaster):
         self.players_by_names: Dict[str, Player] = collections.OrderedDict()
         self.messages_by_names: Dict[str, List] = dict()
         self.current_turn: int = 0
+        # opt-in: compacts the players' histories when they approach the context limit (see clemgame.history)
+        self.history_policy: HistoryPolicy = None
 
     def get_players(self) -> List[Player]:
         return list(self.players_by_names.values())
@@ -442,7 +529,83 @@ class DialogueGameMaster(GameMaster):
             self.current_turn += 1
         self._on_after_game()
 
+    async def play_async(self) -> None:
+        """
+        Asynchronous variant of play(). The players are awaited, so that a single event loop can
+        interleave many episodes. The hooks might be overwritten with coroutines (async def) for this mode.
+        """
+        if type(self).play is not DialogueGameMaster.play:  # respect game masters that overwrite the game play
+            await asyncio.to_thread(self.play)
+            return
+        await self.__call_hook(self._on_before_game)
+        inner_break = False
+        while not inner_break and self._does_game_proceed():
+            self.log_next_turn()
+            await self.__call_hook(self._on_before_turn, self.current_turn)
+            self.logger.info(f"{self.name}: %s turn: %d", self.name, self.current_turn)
+            for player in self.__player_sequence():
+                if not self._does_game_proceed():
+                    inner_break = True
+                    break
+                await self.prompt_async(player)
+                while self._should_reprompt(player):
+                    await self.__call_hook(self._on_before_reprompt, player)
+                    await self.prompt_async(player, is_reprompt=True)
+            await self.__call_hook(self._on_after_turn, self.current_turn)
+            self.current_turn += 1
+        await self.__call_hook(self._on_after_game)
+
+    @staticmethod
+    async def __call_hook(hook, *args):
+        result = hook(*args)
+        if inspect.isawaitable(result):
+            await result
+
     def prompt(self, player: Player, is_reprompt=False):
+        self.__compact_history(player)
+        history = self.__send_prompt(player, is_reprompt)
+        try:
+            _prompt, _response, response_message = player(history, self.current_turn)
+        except ContextExceededError:
+            if not self.__compact_history(player, force=True):
+                raise
+            _prompt, _response, response_message = player(history, self.current_turn)
+        self.__receive_response(player, _prompt, _response, response_message)
+
+    async def prompt_async(self, player: Player, is_reprompt=False):
+        if self.history_policy is not None:
+            await asyncio.to_thread(self.__compact_history, player)  # might call a model to summarize
+        history = self.__send_prompt(player, is_reprompt)
+        try:
+            _prompt, _response, response_message = await player.call_async(history, self.current_turn)
+        except ContextExceededError:
+            if not await asyncio.to_thread(self.__compact_history, player, True):
+                raise
+            _prompt, _response, response_message = await player.call_async(history, self.current_turn)
+        self.__receive_response(player, _prompt, _response, response_message)
+
+    def __compact_history(self, player: Player, force: bool = False) -> bool:
+        """
+        Apply the history policy (if any) to the player's history in place and log the compaction (GM -> GM).
+        :param force: compact even if the policy does not consider it necessary (e.g. after a ContextExceededError)
+        :return: True, if the history has been compacted
+        """
+        if self.history_policy is None:
+            return False
+        history = self.messages_by_names[player.descriptor]
+        if not force and not self.history_policy.needs_compaction(history, player.model):
+            return False
+        compacted = self.history_policy.compact(history, player.model)
+        if compacted == history:
+            return False
+        num_messages = len(history)
+        history[:] = compacted
+        self.log_to_self("history compaction",
+                         f"{self.history_policy} compacted the history of {player.descriptor} "
+                         f"from {num_messages} to {len(compacted)} messages")
+        return True
+
+    def __send_prompt(self, player: Player, is_reprompt: bool) -> List[Dict]:
         # GM -> Player
         history = self.messages_by_names[player.descriptor]
         assert history, f"messages history must not be empty for {player.descriptor}"
@@ -455,9 +618,9 @@ class DialogueGameMaster(GameMaster):
         action_type = 'send message' if not is_reprompt else 'send message (reprompt)'
         action = {'type': action_type, 'content': message}
         self.log_event(from_='GM', to=player.descriptor, action=action)
+        return history
 
-        _prompt, _response, response_message = player(history, self.current_turn)
-
+    def __receive_response(self, player: Player, _prompt: Any, _response: Any, response_message: str):
         # Player -> GM
         action = {'type': 'get message', 'content': response_message}
         # log 'get message' event including backend/API call:
@@ -624,20 +787,17 @@ class GameBenchmark(GameResourceLocator):
 
     def build_transcripts(self, results_dir: str = None):
         results_root = file_utils.results_root(results_dir)
-        dialogue_partners = [file for file in os.listdir(results_root)
-                             if os.path.isdir(os.path.join(results_root, file))]
+        dialogue_partners = file_utils.list_results_dirs(results_root)
         for dialogue_pair in dialogue_partners:
-            game_result_path = self.results_path_for(results_root, dialogue_pair)
-            if not os.path.exists(game_result_path) or not os.path.isdir(game_result_path):
+            if self.name not in file_utils.list_results_dirs(results_root, dialogue_pair):
+                game_result_path = self.results_path_for(results_root, dialogue_pair)
                 stdout_logger.info("No results directory found at: " + game_result_path)
                 continue
 
-            experiment_dirs = [file for file in os.listdir(game_result_path)
-                               if os.path.isdir(os.path.join(game_result_path, file))]
+            experiment_dirs = file_utils.list_results_dirs(results_root, dialogue_pair, self.name)
             if not experiment_dirs:
                 stdout_logger.warning(f"{self.name}: No experiments for {dialogue_pair}")
             for experiment_dir in experiment_dirs:
-                experiment_path = os.path.join(game_result_path, experiment_dir)
                 experiment_name = "_".join(experiment_dir.split("_")[1:])  # remove leading index number
                 if self.filter_experiment and experiment_name not in self.filter_experiment:
                     stdout_logger.info(f"Skip experiment {experiment_name}")
@@ -645,8 +805,7 @@ class GameBenchmark(GameResourceLocator):
                 stdout_logger.info(f"Transcribe: {experiment_name}")
                 experiment_config = self.load_results_json(f"{experiment_dir}/experiment_{experiment_name}",
                                                            results_root, dialogue_pair)
-                episode_dirs = [file for file in os.listdir(experiment_path)
-                                if os.path.isdir(os.path.join(experiment_path, file))]
+                episode_dirs = file_utils.list_results_dirs(results_root, dialogue_pair, self.name, experiment_dir)
                 error_count = 0
                 for episode_dir in tqdm(episode_dirs, desc="Building transcripts"):
                     try:
@@ -676,20 +835,17 @@ class GameBenchmark(GameResourceLocator):
 
     def compute_scores(self, results_dir: str = None):
         results_root = file_utils.results_root(results_dir)
-        dialogue_partners = [file for file in os.listdir(results_root)
-                             if os.path.isdir(os.path.join(results_root, file))]
+        dialogue_partners = file_utils.list_results_dirs(results_root)
         for dialogue_pair in dialogue_partners:
-            game_result_path = self.results_path_for(results_root, dialogue_pair)
-            if not os.path.exists(game_result_path) or not os.path.isdir(game_result_path):
+            if self.name not in file_utils.list_results_dirs(results_root, dialogue_pair):
+                game_result_path = self.results_path_for(results_root, dialogue_pair)
                 stdout_logger.info("No results directory found at: " + game_result_path)
                 continue
 
-            experiment_dirs = [file for file in os.listdir(game_result_path)
-                               if os.path.isdir(os.path.join(game_result_path, file))]
+            experiment_dirs = file_utils.list_results_dirs(results_root, dialogue_pair, self.name)
             if not experiment_dirs:
                 stdout_logger.warning(f"{self.name}: No experiments for {dialogue_pair}")
             for experiment_dir in experiment_dirs:
-                experiment_path = os.path.join(game_result_path, experiment_dir)
                 experiment_name = "_".join(experiment_dir.split("_")[1:])  # remove leading index number
                 if self.filter_experiment and experiment_name not in self.filter_experiment:
                     stdout_logger.info(f"Skip experiment {experiment_name}")
@@ -697,8 +853,7 @@ class GameBenchmark(GameResourceLocator):
                 stdout_logger.info(f"Scoring: {experiment_name}")
                 experiment_config = self.load_results_json(f"{experiment_dir}/experiment_{experiment_name}",
                                                            results_root, dialogue_pair)
-                episode_dirs = [file for file in os.listdir(experiment_path)
-                                if os.path.isdir(os.path.join(experiment_path, file))]
+                episode_dirs = file_utils.list_results_dirs(results_root, dialogue_pair, self.name, experiment_dir)
                 error_count = 0
                 for episode_dir in tqdm(episode_dirs, desc="Scoring episodes"):
                     try:
@@ -718,7 +873,8 @@ class GameBenchmark(GameResourceLocator):
                     stdout_logger.error(
                         f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
 
-    def run(self, player_models: List[Model], results_dir: str = None):
+    def run(self, player_models: List[Model], results_dir: str = None, parallel: int = 1, use_async: bool = False,
+            resume: bool = False, shard: Tuple[int, int] = None) -> List["ExperimentRun"]:
         """
         Runs game-play on all game instances for a game.
         There must be an instances.json with the following structure:
@@ -743,8 +899,54 @@ class GameBenchmark(GameResourceLocator):
                             - episode_id
                                 - instance.json
                                 - interaction.json
+
+        :param parallel: the number of episodes to be played at the same time by a pool of worker threads.
+                         The episode numbering is determined by the order of the game instances nevertheless.
+                         Default: 1 (the episodes are played one after another)
+        :param use_async: play the episodes within a single event loop (using the asynchronous game play) instead
+                          of worker threads; then parallel is the number of interleaved episodes. Default: False
+        :param resume: only play the episodes that have not been recorded yet (or failed) in the results directory.
+                       Default: False (all episodes are played and existing records are overwritten)
+        :param shard: the shard index and the number of shards, when only every n-th episode should be played
+                      (e.g. by a worker process); then the experiment configs are not stored. Default: None
+        :return: the experiment runs that have been played
         """
         results_root = "results" if results_dir is None else results_dir
+        experiment_runs_played = []
+        for experiment_run in self.experiment_runs(player_models, results_root):
+            if shard is not None:
+                experiment_run.select_shard(*shard)
+            if resume and not experiment_run.skip_recorded_episodes():
+                continue
+            experiment_run.start()
+            episode_ids = experiment_run.episode_ids
+            game_instances = experiment_run.game_instances
+            if use_async:
+                episodes_played = asyncio.run(_play_episodes_async(experiment_run.play_episode_async,
+                                                                   episode_ids, game_instances, parallel))
+            elif parallel > 1:
+                with ThreadPoolExecutor(max_workers=parallel) as executor:
+                    episodes_played = list(tqdm(executor.map(experiment_run.play_episode, episode_ids, game_instances),
+                                                total=len(game_instances), desc="Playing games", disable=False))
+            else:
+                episodes_played = [experiment_run.play_episode(episode_id, game_instance)
+                                   for episode_id, game_instance in tqdm(zip(episode_ids, game_instances),
+                                                                         total=len(game_instances),
+                                                                         desc="Playing games", disable=False)]
+            experiment_run.finish(episodes_played)
+            experiment_runs_played.append(experiment_run)
+        return experiment_runs_played
+
+    def experiment_runs(self, player_models: List[Model], results_root: str) -> List["ExperimentRun"]:
+        """
+        Determine the experiments to be run with their dialogue partners (see run()).
+
+        :param player_models: the models given as run arg; if not given, then the dialogue partners are
+                              taken from the experiment config
+        :param results_root: the results directory
+        :return: the experiment runs (one for each experiment and dialogue pair)
+        """
+        experiment_runs = []
         experiments: List = self.instances["experiments"]
         if not experiments:
             self.logger.warning(f"{self.name}: No experiments for %s", self.name)
@@ -754,7 +956,6 @@ class GameBenchmark(GameResourceLocator):
             if self.filter_experiment and experiment_name not in self.filter_experiment:
                 stdout_logger.info(f"Skip experiment {experiment_idx + 1} of {total_experiments}: {experiment_name}")
                 continue
-            stdout_logger.info(f"Run experiment {experiment_idx + 1} of {total_experiments}: {experiment_name}")
             # Determine dialogue partners: How often to run the experiment with different partners
             dialogue_partners: List[List[Model]] = []
 
@@ -762,11 +963,11 @@ class GameBenchmark(GameResourceLocator):
                 dialogue_partners = [player_models]
             elif "dialogue_partners" in experiment:  # edge-case when names are given in experiment config
                 for dialogue_pair_names in experiment["dialogue_partners"]:
-                    player_models = []
+                    pair_models = []
                     for model_name in dialogue_pair_names:
                         player_model = backends.get_model_for(model_name)
-                        player_models.append(player_model)
-                    dialogue_partners.append(player_models)
+                        pair_models.append(player_model)
+                    dialogue_partners.append(pair_models)
                 self.logger.info(f"{self.name}: Detected 'dialogue_partners' in experiment config. "
                                  f"Will run with: {dialogue_partners}")
 
@@ -798,57 +999,67 @@ class GameBenchmark(GameResourceLocator):
                     model_1 = dialogue_pair[1]
                     model_1 = f"{model_1.get_name()}-t{model_1.get_temperature()}"
                     dialogue_pair_desc = f"{model_0}--{model_1}"
-                episode_counter = 0
-
-                self.logger.info("Activity: %s Experiment: %s Partners: %s Episode: %d",
-                                 self.name, experiment_name, dialogue_pair_desc, episode_counter)
-
-                experiment_record_dir = f"{experiment_idx}_{experiment_name}"
-                experiment_config = {k: experiment[k] for k in experiment if k != 'game_instances'}
-
-                # Add some important infos to track
-                experiment_config["timestamp"] = datetime.now().isoformat()
-                experiment_config["dialogue_partners"] = dialogue_pair_desc
+                experiment_runs.append(ExperimentRun(self, experiment_idx, total_experiments, experiment,
+                                                     dialogue_pair, dialogue_pair_desc, results_root))
+        return experiment_runs
+
+    def _play_episode(self, experiment_config: Dict, dialogue_pair: List[Model], dialogue_pair_desc: str,
+                      experiment_record_dir: str, results_root: str, episode_id: int, game_instance: Dict) -> bool:
+        """
+        Plays and records a single episode. Each episode gets its own game master,
+        so that episodes can be played at the same time.
+
+        :return: True, if the episode has been played and recorded; False, if an exception occurred
+        """
+        episode_dir = self.__store_instance(experiment_config, dialogue_pair_desc, experiment_record_dir,
+                                            results_root, episode_id, game_instance)
+        game_master = None
+        try:
+            game_master = self.create_game_master(experiment_config, dialogue_pair)
+            if get_record_stream_args() is not None:
+                game_master.stream_records(results_root, dialogue_pair_desc, episode_dir, **get_record_stream_args())
+            game_master.setup(**game_instance)
+            game_master.play()
+            game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
+        except Exception:  # continue with other episodes if something goes wrong
+            self.logger.exception(f"{self.name}: Exception for episode {game_instance['game_id']} (but continue)")
+            _keep_interrupted_records(game_master)
+            return False
+        return True
 
-                self.store_results_file(experiment_config,
-                                        f"experiment_{experiment_name}.json",
-                                        dialogue_pair_desc,
-                                        sub_dir=experiment_record_dir,
-                                        root_dir=results_root)
+    async def _play_episode_async(self, experiment_config: Dict, dialogue_pair: List[Model], dialogue_pair_desc: str,
+                                  experiment_record_dir: str, results_root: str, episode_id: int,
+                                  game_instance: Dict) -> bool:
+        """
+        Asynchronous variant of _play_episode() using the asynchronous game play of the game master.
+        """
+        episode_dir = self.__store_instance(experiment_config, dialogue_pair_desc, experiment_record_dir,
+                                            results_root, episode_id, game_instance)
+        game_master = None
+        try:
+            game_master = self.create_game_master(experiment_config, dialogue_pair)
+            if get_record_stream_args() is not None:
+                game_master.stream_records(results_root, dialogue_pair_desc, episode_dir, **get_record_stream_args())
+            game_master.setup(**game_instance)
+            await game_master.play_async()
+            game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
+        except Exception:  # continue with other episodes if something goes wrong
+            self.logger.exception(f"{self.name}: Exception for episode {game_instance['game_id']} (but continue)")
+            _keep_interrupted_records(game_master)
+            return False
+        return True
 
-                error_count = 0
-                time_experiment_start = datetime.now()
-                game_instances: List = experiment["game_instances"]
-                for game_instance in tqdm(game_instances, desc="Playing games", disable=False):
-                    game_id = game_instance["game_id"]
-                    self.logger.info("Activity: %s Experiment: %s Episode: %d Game: %s",
-                                     self.name, experiment_name, episode_counter, game_id)
-                    episode_dir = experiment_record_dir + f"/episode_{episode_counter}"
-                    self.store_results_file(game_instance,
-                                            f"instance.json",
-                                            dialogue_pair_desc,
-                                            sub_dir=episode_dir,
-                                            root_dir=results_root)
-                    try:
-                        game_master = self.create_game_master(experiment_config, dialogue_pair)
-                        game_master.setup(**game_instance)
-                        game_master.play()
-                        game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
-                    except Exception:  # continue with other episodes if something goes wrong
-                        self.logger.exception(f"{self.name}: Exception for episode {game_id} (but continue)")
-                        error_count += 1
-                    episode_counter += 1
-                if error_count > 0:
-                    stdout_logger.error(
-                        f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
-                # Add experiment duration and overwrite file
-                time_experiment_end = datetime.now() - time_experiment_start
-                experiment_config["duration"] = str(time_experiment_end)
-                self.store_results_file(experiment_config,
-                                        f"experiment_{experiment_name}.json",
-                                        dialogue_pair_desc,
-                                        sub_dir=experiment_record_dir,
-                                        root_dir=results_root)
+    def __store_instance(self, experiment_config: Dict, dialogue_pair_desc: str, experiment_record_dir: str,
+                         results_root: str, episode_id: int, game_instance: Dict) -> str:
+        self.logger.info("Activity: %s Experiment: %s Episode: %d Game: %s",
+                         self.name, experiment_config["name"], episode_id, game_instance["game_id"])
+        episode_dir = experiment_record_dir + f"/episode_{episode_id}"
+        self.store_results_file(game_instance,
+                                f"instance.json",
+                                dialogue_pair_desc,
+                                sub_dir=episode_dir,
+                                root_dir=results_root)
+        return episode_dir
 
     def is_single_player(self) -> bool:
         """
@@ -865,6 +1076,179 @@ class GameBenchmark(GameResourceLocator):
         raise NotImplementedError()
 
 
+class ExperimentRun:
+    """
+    The episodes of an experiment to be played by a particular dialogue pair. Keeps track of the experiment
+    config which is stored when the run starts and is updated with the duration when the run finishes.
+    """
+
+    def __init__(self, benchmark: GameBenchmark, experiment_idx: int, total_experiments: int, experiment: Dict,
+                 dialogue_pair: List[Model], dialogue_pair_desc: str, results_root: str):
+        self.benchmark = benchmark
+        self.experiment_idx = experiment_idx
+        self.total_experiments = total_experiments
+        self.experiment_name = experiment["name"]
+        self.experiment_config = {k: experiment[k] for k in experiment if k != 'game_instances'}
+        self.experiment_record_dir = f"{experiment_idx}_{self.experiment_name}"
+        self.dialogue_pair = dialogue_pair
+        self.dialogue_pair_desc = dialogue_pair_desc
+        self.results_root = results_root
+        self.game_instances: List[Dict] = experiment["game_instances"]
+        # the episode ids are fixed upfront, so that they do not depend on the order of completion
+        self.episode_ids: List[int] = list(range(len(self.game_instances)))
+        self.shard: Tuple[int, int] = None
+        self.time_start: datetime = None
+        self.time_end: datetime = None
+        self.error_count: int = 0
+        self.previous_duration: timedelta = None  # of the stored run, when it is resumed
+
+    def select_shard(self, shard_idx: int, num_shards: int):
+        """
+        Only keep every num_shards-th episode (starting with shard_idx) in this run. The experiment config is not
+        stored by a shard, but should be stored once for all shards (see store_experiment_config()).
+        """
+        self.shard = (shard_idx, num_shards)
+        self.game_instances = [game_instance for episode_id, game_instance
+                               in zip(self.episode_ids, self.game_instances) if episode_id % num_shards == shard_idx]
+        self.episode_ids = [episode_id for episode_id in self.episode_ids if episode_id % num_shards == shard_idx]
+
+    def skip_recorded_episodes(self) -> bool:
+        """
+        Remove the episodes from this run that have already been recorded completely (interactions and requests).
+
+        :return: True, if there are episodes left to be played
+        """
+        episodes_left = [(episode_id, game_instance)
+                         for episode_id, game_instance in zip(self.episode_ids, self.game_instances)
+                         if not is_episode_recorded(self.results_root, self.dialogue_pair_desc, self.benchmark.name,
+                                                    f"{self.experiment_record_dir}/episode_{episode_id}")]
+        skipped = len(self.episode_ids) - len(episodes_left)
+        if skipped > 0:
+            stdout_logger.info(f"Resume experiment {self.experiment_idx + 1} of {self.total_experiments}: "
+                               f"{self.experiment_name} ({self.dialogue_pair_desc}) "
+                               f"skips {skipped} of {len(self.episode_ids)} recorded episodes")
+        self.episode_ids = [episode_id for episode_id, _ in episodes_left]
+        self.game_instances = [game_instance for _, game_instance in episodes_left]
+        self.__keep_previous_run_times()
+        return len(episodes_left) > 0
+
+    def __keep_previous_run_times(self):
+        # the stored experiment config keeps the timestamp of the first run and the duration of all runs
+        try:
+            previous_config = file_utils.load_results_json(
+                f"{self.experiment_record_dir}/experiment_{self.experiment_name}", self.results_root,
+                self.dialogue_pair_desc, self.benchmark.name)
+        except FileNotFoundError:
+            return
+        if "timestamp" in previous_config:
+            self.experiment_config["timestamp"] = previous_config["timestamp"]
+        self.previous_duration = parse_duration(previous_config["duration"]) if "duration" in previous_config \
+            else timedelta()
+
+    def start(self):
+        stdout_logger.info(f"Run experiment {self.experiment_idx + 1} of {self.total_experiments}: "
+                           f"{self.experiment_name}")
+        self.benchmark.logger.info("Activity: %s Experiment: %s Partners: %s",
+                                   self.benchmark.name, self.experiment_name, self.dialogue_pair_desc)
+        # Add some important infos to track
+        if self.previous_duration is None or "timestamp" not in self.experiment_config:
+            self.experiment_config["timestamp"] = datetime.now().isoformat()
+        else:
+            self.experiment_config["resumed"] = datetime.now().isoformat()
+        self.experiment_config["dialogue_partners"] = self.dialogue_pair_desc
+        if self.shard is None:
+            self.store_experiment_config()
+        self.time_start = datetime.now()
+
+    def play_episode(self, episode_id: int, game_instance: Dict) -> bool:
+        return self.benchmark._play_episode(self.experiment_config, self.dialogue_pair, self.dialogue_pair_desc,
+                                            self.experiment_record_dir, self.results_root, episode_id, game_instance)
+
+    async def play_episode_async(self, episode_id: int, game_instance: Dict) -> bool:
+        return await self.benchmark._play_episode_async(self.experiment_config, self.dialogue_pair,
+                                                        self.dialogue_pair_desc, self.experiment_record_dir,
+                                                        self.results_root, episode_id, game_instance)
+
+    def finish(self, episodes_played: List[bool]):
+        """
+        :param episodes_played: for each episode if it has been played successfully
+        """
+        self.error_count = episodes_played.count(False)
+        if self.error_count > 0:
+            log_file = "clembench.log" if self.shard is None else f"clembench.shard_{self.shard[0]}.log"
+            stdout_logger.error(
+                f"{self.benchmark.name}: '{self.error_count}' exceptions occurred: See {log_file} for details.")
+        # Add experiment duration and overwrite file
+        self.time_end = datetime.now()
+        duration = self.time_end - self.time_start + (self.previous_duration or timedelta())
+        self.experiment_config["duration"] = str(duration)
+        if self.shard is None:
+            self.store_experiment_config()
+
+    def store_experiment_config(self):
+        self.benchmark.store_results_file(self.experiment_config,
+                                          f"experiment_{self.experiment_name}.json",
+                                          self.dialogue_pair_desc,
+                                          sub_dir=self.experiment_record_dir,
+                                          root_dir=self.results_root)
+
+
+def parse_duration(duration: str) -> timedelta:
+    """
+    :param duration: as stored in the experiment config, e.g. '0:01:02.500000' or '1 day, 0:01:02'
+    """
+    days = 0
+    if "day" in duration:
+        days, duration = duration.split(", ")
+        days = int(days.split()[0])
+    hours, minutes, seconds = duration.split(":")
+    return timedelta(days=days, hours=int(hours), minutes=int(minutes), seconds=float(seconds))
+
+
+def is_episode_recorded(results_root: str, dialogue_pair_desc: str, game_name: str, episode_dir: str) -> bool:
+    """
+    :param episode_dir: the episode directory relative to the game results directory, e.g. 0_experiment/episode_0
+    :return: True, if both the interactions and the requests of the episode have been stored (as files or in the
+             results store) or the records of the episode are complete
+    """
+    if all(file_utils.results_file_exists(f"{episode_dir}/{file_name}", results_root, dialogue_pair_desc, game_name)
+           for file_name in ["interactions.json", "requests.json"]):
+        return True
+    try:  # or the records have been streamed completely
+        return is_complete(file_utils.load_results_text(f"{episode_dir}/{RECORDS_FILE_NAME}", results_root,
+                                                        dialogue_pair_desc, game_name))
+    except FileNotFoundError:
+        return False
+
+
+def _keep_interrupted_records(game_master: GameMaster):
+    """ Write the buffered records of an interrupted episode (without marking them as complete). """
+    if game_master is not None and game_master.record_stream is not None and not game_master.record_stream.file.closed:
+        game_master.record_stream.close(complete=False)
+
+
+async def _play_episodes_async(play_episode, episode_ids: List[int], game_instances: List[Dict],
+                               max_interleaved: int) -> List[bool]:
+    """
+    Play the episodes as tasks of the running event loop, but at most max_interleaved at the same time.
+    :return: for each episode (in the given order) if it has been played successfully
+    """
+    semaphore = asyncio.Semaphore(max(max_interleaved, 1))
+    progress = tqdm(total=len(game_instances), desc="Playing games", disable=False)
+
+    async def play(episode_id, game_instance):
+        async with semaphore:
+            episode_played = await play_episode(episode_id, game_instance)
+        progress.update()
+        return episode_played
+
+    try:
+        return await asyncio.gather(*[play(episode_id, game_instance)
+                                      for episode_id, game_instance in zip(episode_ids, game_instances)])
+    finally:
+        progress.close()
+
+
 class GameInstanceGenerator(GameResourceLocator):
     """
     Create all game instances for a game benchmark.
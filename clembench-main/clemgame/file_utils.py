@@ -1,7 +1,78 @@
-from typing import Dict
+from typing import Dict, List, Tuple, Iterator
+import atexit
 import os
 import json
 import csv
+import threading
+
+from backends.requests_codec import encode_requests, decode_requests, is_encoded
+from clemgame import results_io
+from clemgame.record_stream import RECORDS_FILE_NAME, assemble_records
+from clemgame.results_store import ResultsStore, STORE_FILE_NAME
+from clemgame.results_writer import ResultsWriter
+
+_results_stores: Dict[str, ResultsStore] = dict()  # results root -> store (or None, if the root has no store)
+_results_stores_lock = threading.Lock()
+_compact_requests = False
+_compression: str = None
+_results_writer: ResultsWriter = None
+
+
+def set_compact_requests(compact_requests: bool):
+    """
+    :param compact_requests: store the requests.json files delta-encoded (see backends.requests_codec)
+    """
+    global _compact_requests
+    _compact_requests = compact_requests
+
+
+def set_compression(compression: str):
+    """
+    :param compression: compress the json results files with gzip or zstd; None to store them as plain files
+    """
+    global _compression
+    results_io.check_compression(compression)
+    _compression = compression
+
+
+def set_results_writer(max_pending: int):
+    """
+    :param max_pending: the maximal number of results files waiting to be written by a background thread
+                        (see results_writer.ResultsWriter); 0 to write the results files synchronously
+    """
+    global _results_writer
+    if _results_writer is not None:
+        _results_writer.close()
+        atexit.unregister(_results_writer.close)
+        _results_writer = None
+    if max_pending > 0:
+        _results_writer = ResultsWriter(max_pending)
+        atexit.register(_results_writer.close)  # write the pending files on shutdown
+
+
+def flush_results_writer() -> List[Tuple[str, Exception]]:
+    """
+    Wait until the pending results files have been written.
+    :return: the locations and errors of the results files which could not be written since the last flush
+    """
+    if _results_writer is None:
+        return []
+    _results_writer.flush()
+    return _results_writer.pop_errors()
+
+
+def __wait_for_results_writer(location_prefix: str):
+    # the results files are read as they have been stored; only the requested files are waited for
+    if _results_writer is not None:
+        _results_writer.wait_for(location_prefix)
+
+
+def __results_location(results_dir: str, rel_path: str) -> str:
+    # the location of a results file (or directory) as submitted by store_game_results_file()
+    store = results_store_for(results_dir)
+    if store is not None:
+        return f"{store.path}:{rel_path}"
+    return os.path.join(results_root(results_dir), *rel_path.split("/"))
 
 
 def project_root():
@@ -60,57 +131,178 @@ def load_file(file_name: str, game_name: str = None, file_ending: str = None) ->
     return data
 
 
+def create_results_store(results_dir: str = None) -> ResultsStore:
+    """
+    Create the consolidated results store in the results directory, so that the results files are stored there
+    (instead of as files) and loaded from there.
+    """
+    root = results_root(results_dir)
+    os.makedirs(root, exist_ok=True)
+    with _results_stores_lock:
+        if _results_stores.get(root) is None:
+            _results_stores[root] = ResultsStore(os.path.join(root, STORE_FILE_NAME))
+        return _results_stores[root]
+
+
+def results_store_for(results_dir: str = None) -> ResultsStore:
+    """
+    :return: the results store of the results directory or None, if it uses the results files
+    """
+    root = results_root(results_dir)
+    with _results_stores_lock:
+        if root not in _results_stores:
+            store_path = os.path.join(root, STORE_FILE_NAME)
+            _results_stores[root] = ResultsStore(store_path) if os.path.isfile(store_path) else None
+        return _results_stores[root]
+
+
+def list_results_dirs(results_dir: str, *sub_dirs: str) -> List[str]:
+    """
+    :param results_dir: the results root
+    :param sub_dirs: the directories of the upper levels (dialogue pair, game, experiment)
+    :return: the directories below, e.g. the experiment directories of a dialogue pair and game
+    """
+    __wait_for_results_writer(__results_location(results_dir, "/".join(sub_dirs + ("",))))
+    store = results_store_for(results_dir)
+    if store is not None:
+        return store.list_dirs(*sub_dirs)
+    dir_path = os.path.join(results_root(results_dir), *sub_dirs)
+    if not os.path.isdir(dir_path):
+        return []
+    return [file for file in os.listdir(dir_path) if os.path.isdir(os.path.join(dir_path, file))]
+
+
+def results_file_exists(file_name: str, results_dir: str, dialogue_pair: str, game_name: str) -> bool:
+    __wait_for_results_writer(__results_location(results_dir, f"{dialogue_pair}/{game_name}/{file_name}"))
+    store = results_store_for(results_dir)
+    if store is not None:
+        return store.exists(f"{dialogue_pair}/{game_name}/{file_name}")
+    file_path = os.path.join(game_results_dir_for(results_dir, dialogue_pair, game_name), file_name)
+    return results_io.find_file(file_path) is not None
+
+
 def load_results_json(file_name: str, results_dir: str, dialogue_pair: str, game_name: str) -> Dict:
-    data = __load_results_file(file_name, results_dir, dialogue_pair, game_name, file_ending=".json")
-    data = json.loads(data)
-    return data
+    """
+    The interactions and requests of an episode, whose records have been streamed, are reassembled from the records.
+    Delta-encoded requests are decoded and compressed results files are decompressed.
+    """
+    json_file_name = file_name if file_name.endswith(".json") else file_name + ".json"
+    __wait_for_results_writer(__results_location(results_dir, f"{dialogue_pair}/{game_name}/{json_file_name}"))
+    try:
+        store = results_store_for(results_dir)
+        if store is not None:
+            if not file_name.endswith(".json"):
+                file_name = file_name + ".json"
+            return decode_requests(store.get(f"{dialogue_pair}/{game_name}/{file_name}"))
+        data = __load_results_file(file_name, results_dir, dialogue_pair, game_name, file_ending=".json")
+    except FileNotFoundError:
+        episode_dir, _, name = file_name.rpartition("/")
+        name = name[:-len(".json")] if name.endswith(".json") else name
+        if name not in ["interactions", "requests"]:
+            raise
+        records = load_results_text(f"{episode_dir}/{RECORDS_FILE_NAME}" if episode_dir else RECORDS_FILE_NAME,
+                                    results_dir, dialogue_pair, game_name)
+        interactions, requests = assemble_records(records.splitlines())
+        return interactions if name == "interactions" else requests
+    data = results_io.loads(data)
+    return decode_requests(data)
+
+
+def load_results_requests(results_dir: str) -> Iterator[List[Dict]]:
+    """
+    :return: the (decoded) calls of each episode's requests below the results directory, e.g. to replay them
+    """
+    for dialogue_pair in sorted(list_results_dirs(results_dir)):
+        for game_name in sorted(list_results_dirs(results_dir, dialogue_pair)):
+            for experiment in sorted(list_results_dirs(results_dir, dialogue_pair, game_name)):
+                for episode in sorted(list_results_dirs(results_dir, dialogue_pair, game_name, experiment)):
+                    try:
+                        yield load_results_json(f"{experiment}/{episode}/requests", results_dir,
+                                                dialogue_pair, game_name)
+                    except FileNotFoundError:
+                        continue  # e.g. an episode which has not been played (yet)
+
+
+def load_results_text(file_name: str, results_dir: str, dialogue_pair: str, game_name: str) -> str:
+    __wait_for_results_writer(__results_location(results_dir, f"{dialogue_pair}/{game_name}/{file_name}"))
+    store = results_store_for(results_dir)
+    if store is not None:
+        return store.get(f"{dialogue_pair}/{game_name}/{file_name}")
+    return __load_results_file(file_name, results_dir, dialogue_pair, game_name).decode("utf-8")
 
 
 def __load_results_file(file_name: str, results_dir: str, dialogue_pair: str, game_name: str,
-                        file_ending: str = None) -> str:
+                        file_ending: str = None) -> bytes:
     if file_ending and not file_name.endswith(file_ending):
         file_name = file_name + file_ending
     game_results_dir = game_results_dir_for(results_dir, dialogue_pair, game_name)
     fp = os.path.join(game_results_dir, file_name)
-    with open(fp, encoding='utf8') as f:
-        data = f.read()
-    return data
+    return results_io.read_file(fp)
 
 
 def store_game_results_file(data, file_name: str, dialogue_pair: str, game_name: str,
                             sub_dir: str = None, root_dir: str = None,
                             do_overwrite: bool = True) -> str:
+    if _compact_requests and file_name == "requests.json" and not is_encoded(data):
+        data = encode_requests(data)
     game_results_dir = game_results_dir_for(root_dir, dialogue_pair, game_name)
-    return store_file(data, file_name, game_results_dir, sub_dir, do_overwrite)
+    store = results_store_for(root_dir)
+    if store is not None:
+        rel_path = f"{dialogue_pair}/{game_name}/{sub_dir}/{file_name}" if sub_dir \
+            else f"{dialogue_pair}/{game_name}/{file_name}"
+        if not do_overwrite and store.exists(rel_path):
+            raise FileExistsError(rel_path)
+        if _results_writer is None:
+            store.put(rel_path, data)
+        else:  # serialize now, the data might be changed later on
+            text = json.dumps(data, ensure_ascii=False) if file_name.endswith(".json") else data
+            _results_writer.submit(f"{store.path}:{rel_path}", lambda: store.put_text(rel_path, text))
+        return f"{store.path}:{rel_path}"
+    compression = _compression if file_name.endswith(".json") else None  # transcripts stay readable
+    return store_file(data, file_name, game_results_dir, sub_dir, do_overwrite, compression=compression,
+                      writer=_results_writer)
 
 
 def store_game_file(data, file_name: str, game_name: str, sub_dir: str = None, do_overwrite: bool = True) -> str:
     return store_file(data, file_name, game_dir(game_name), sub_dir, do_overwrite)
 
 
-def store_file(data, file_name: str, dir_path: str, sub_dir: str = None, do_overwrite: bool = True) -> str:
+def store_file(data, file_name: str, dir_path: str, sub_dir: str = None, do_overwrite: bool = True,
+               compression: str = None, writer: ResultsWriter = None) -> str:
     """
     :param data: to store
     :param file_name: of the file to store
     :param dir_path: to the directory to store to
     :param sub_dir: optional subdirectories
     :param do_overwrite: default: True
+    :param compression: gzip or zstd to add the suffix of the compression to the file name. Default: None
+    :param writer: to write the (serialized) file in the background. Default: None (write it now)
     :return: the file path
     """
     if sub_dir:
         dir_path = os.path.join(dir_path, sub_dir)
 
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
-
     fp = os.path.join(dir_path, file_name)
     if not do_overwrite:
-        if os.path.exists(fp):
+        if results_io.find_file(fp) is not None:
             raise FileExistsError(fp)
 
-    with open(fp, "w", encoding='utf-8') as f:
-        if file_name.endswith(".json"):
-            json.dump(data, f, ensure_ascii=False)
-        else:
-            f.write(data)
-    return fp
+    data = results_io.dumps(data, fast=compression is not None) if file_name.endswith(".json") \
+        else data.encode("utf-8")
+    if writer is not None:
+        written_fp = fp + results_io.COMPRESSIONS[compression] if compression else fp
+        writer.submit(written_fp, lambda: __write_file(fp, data, compression))
+        return written_fp
+    return __write_file(fp, data, compression)
+
+
+def __write_file(fp: str, data: bytes, compression: str) -> str:
+    # episodes might be stored at the same time, so that the directory might be created concurrently
+    os.makedirs(os.path.dirname(fp), exist_ok=True)
+    written_fp = results_io.write_file(fp, data, compression)
+    # a file of a previous run in another form would be read instead
+    stale_fp = results_io.find_file(fp)
+    while stale_fp is not None and stale_fp != written_fp:
+        os.remove(stale_fp)
+        stale_fp = results_io.find_file(fp)
+    return written_fp
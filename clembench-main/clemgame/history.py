@@ -0,0 +1,126 @@
+"""
+    History compaction for the players of a DialogueGameMaster: the messages history of a player is compacted before
+    the player is prompted, when the prompt (and the maximal response) would exceed a part of the model's context.
+"""
+from typing import List, Dict, Tuple
+
+
+class HistoryPolicy:
+    """
+    Compacts the messages history of a player, when the prompt (and the maximal response) would use more than a part
+    of the model's context, so that long games keep running instead of failing with a ContextExceededError.
+    The messages are expected to start with optional system messages and the initial instruction (user message).
+    """
+
+    def __init__(self, context_ratio: float = 1.):
+        """
+        :param context_ratio: compact the history, when more than this part of the context would be used. If None,
+        then the history is compacted before each call (bounded prompt size, also for unknown context sizes).
+        """
+        self.context_ratio = context_ratio
+
+    def needs_compaction(self, messages: List[Dict], model) -> bool:
+        """
+        :param messages: the history of the player
+        :param model: the player's model
+        """
+        if self.context_ratio is None:
+            return True
+        fits, tokens_used, _, context_size = model.check_context_limit(messages)
+        if context_size is None:
+            return not fits
+        return tokens_used > self.context_ratio * context_size
+
+    def compact(self, messages: List[Dict], model) -> List[Dict]:
+        """
+        :param messages: the history of the player; not changed
+        :param model: the player's model
+        :return: the compacted history (or the same messages, if they cannot be compacted any further)
+        """
+        raise NotImplementedError()
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+def _split_system_messages(messages: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    idx = 0
+    while idx < len(messages) and messages[idx]["role"] == "system":
+        idx += 1
+    return messages[:idx], messages[idx:]
+
+
+def _drop_leading_assistant_messages(messages: List[Dict]) -> List[Dict]:
+    idx = 0
+    while idx < len(messages) - 1 and messages[idx]["role"] == "assistant":
+        idx += 1
+    return messages[idx:]
+
+
+class SlidingWindow(HistoryPolicy):
+    """
+    Keeps the system messages and the latest messages.
+    """
+
+    def __init__(self, max_messages: int, context_ratio: float = 1.):
+        """
+        :param max_messages: the number of latest messages to keep (besides the system messages)
+        """
+        super().__init__(context_ratio)
+        self.max_messages = max_messages
+
+    def compact(self, messages: List[Dict], model) -> List[Dict]:
+        system_messages, dialogue = _split_system_messages(messages)
+        return system_messages + _drop_leading_assistant_messages(dialogue[-self.max_messages:])
+
+
+class KeepInstructionAndLastTurns(HistoryPolicy):
+    """
+    Keeps the system messages, the initial instruction and the last turns (each an assistant and a user message).
+    """
+
+    def __init__(self, last_turns: int, context_ratio: float = 1.):
+        """
+        :param last_turns: the number of latest turns to keep
+        """
+        super().__init__(context_ratio)
+        self.last_turns = last_turns
+
+    def compact(self, messages: List[Dict], model) -> List[Dict]:
+        system_messages, dialogue = _split_system_messages(messages)
+        if len(dialogue) <= 1 + 2 * self.last_turns:
+            return messages
+        return system_messages + dialogue[:1] + dialogue[-2 * self.last_turns:]
+
+
+class SummarizeOlderTurns(KeepInstructionAndLastTurns):
+    """
+    Keeps the system messages, the initial instruction and the last turns, and replaces the older turns with a summary
+    that is appended to the instruction. The summary is generated by the player's model (or a given one).
+    """
+
+    SUMMARY_PROMPT = ("Summarize the following conversation briefly. Keep all facts that are needed to continue it. "
+                      "Answer only with the summary.\n\n")
+    SUMMARY_HEADER = "\n\nSummary of the earlier conversation:\n"
+
+    def __init__(self, last_turns: int, context_ratio: float = 1., summarizer=None):
+        """
+        :param last_turns: the number of latest turns to keep
+        :param summarizer: the model generating the summaries. Default: the player's model
+        """
+        super().__init__(last_turns, context_ratio)
+        self.summarizer = summarizer
+
+    def compact(self, messages: List[Dict], model) -> List[Dict]:
+        system_messages, dialogue = _split_system_messages(messages)
+        if len(dialogue) <= 1 + 2 * self.last_turns:
+            return messages
+        instruction, _, summary = dialogue[0]["content"].partition(self.SUMMARY_HEADER)
+        older_turns = dialogue[1:-2 * self.last_turns]
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in older_turns)
+        if summary:
+            transcript = f"{summary}\n{transcript}"
+        summarizer = self.summarizer or model
+        _, _, summary = summarizer.generate_response([{"role": "user", "content": self.SUMMARY_PROMPT + transcript}])
+        instruction_message = dict(dialogue[0], content=instruction + self.SUMMARY_HEADER + summary.strip())
+        return system_messages + [instruction_message] + dialogue[-2 * self.last_turns:]
@@ -0,0 +1,136 @@
+"""
+    Append-only recording of an episode: the game recorder appends each logged turn, event and call as a JSON line
+    to the records.jsonl file of the episode as it happens (instead of keeping all calls in memory and writing the
+    interactions.json and requests.json files at the end of the episode). So the records of an interrupted episode
+    are kept up to the last flush.
+
+    The prompts of the calls are stored as deltas against a recent prompt: a chat history prompt only adds the
+    messages of the last turn. Large base64 data (images) is stored once as a blob record (see
+    backends.requests_codec). The classic interactions and requests are reassembled from the records on demand
+    (see assemble_records()).
+"""
+import json
+import os
+from typing import Dict, List, Any, Iterable, Tuple
+
+import clemgame
+from backends.requests_codec import PromptEncoder, PromptDecoder
+
+logger = clemgame.get_logger(__name__)
+
+RECORDS_FILE_NAME = "records.jsonl"
+# never: leave it to the OS; flush: fsync whenever the buffer is written; always: write and fsync each record
+FSYNC_POLICIES = ["never", "flush", "always"]
+
+_record_stream_args: Dict = None
+
+
+def set_record_stream_args(record_stream_args: Dict):
+    """
+    :param record_stream_args: the arguments (buffer_size, fsync) of the RecordStream of each episode
+                               or None to record the episodes as a whole (default)
+    """
+    global _record_stream_args
+    _record_stream_args = record_stream_args
+
+
+def get_record_stream_args() -> Dict:
+    return _record_stream_args
+
+
+class RecordStream:
+
+    def __init__(self, file_path: str, buffer_size: int = 64, fsync: str = "flush"):
+        """
+        :param file_path: of the records file; an existing file (of an interrupted episode) is replaced
+        :param buffer_size: the number of records to be buffered before they are written to the file
+        :param fsync: the fsync policy, one of FSYNC_POLICIES
+        """
+        assert fsync in FSYNC_POLICIES, f"fsync must be one of {FSYNC_POLICIES}, but is {fsync}"
+        self.file_path = file_path
+        self.buffer_size = 1 if fsync == "always" else max(buffer_size, 1)
+        self.fsync = fsync
+        self.buffer: List[str] = []
+        self.num_calls = 0
+        self.prompt_encoder = PromptEncoder()
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file = open(file_path, "w", encoding="utf-8")
+
+    def append(self, record: Dict):
+        self.buffer.append(json.dumps(record, ensure_ascii=False))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def append_call(self, timestamp: str, prompt: Any, response: Any):
+        """
+        Append a call; a list prompt (of messages) is stored as the delta against a recent prompt.
+        """
+        record = {"type": "call", "timestamp": timestamp}
+        record.update(self.prompt_encoder.encode(prompt))
+        record["raw_response_obj"] = self.prompt_encoder.extract_blobs(response)
+        for blob_hash, blob in self.prompt_encoder.pop_new_blobs().items():
+            self.append({"type": "blob", "hash": blob_hash, "data": blob})
+        self.append(record)
+        self.num_calls += 1
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.file.write("\n".join(self.buffer) + "\n")
+        self.buffer.clear()
+        self.file.flush()
+        if self.fsync != "never":
+            os.fsync(self.file.fileno())
+
+    def close(self, complete: bool = True):
+        """
+        Close the file.
+        :param complete: mark the records as complete; False, if the episode has been interrupted
+        """
+        if complete:
+            self.append({"type": "end"})
+        self.flush()
+        self.file.close()
+
+
+def is_complete(records: str) -> bool:
+    """
+    :param records: the contents of a records file
+    :return: True, if the episode has been recorded completely
+    """
+    lines = records.rstrip("\n").rsplit("\n", 1)
+    return lines[-1] == json.dumps({"type": "end"})
+
+
+def assemble_records(lines: Iterable[str]) -> Tuple[Dict, List[Dict]]:
+    """
+    :param lines: of a records file
+    :return: the interactions and the requests as they are stored in the interactions.json and requests.json files
+    """
+    interactions = {"players": {}, "turns": []}
+    requests = []
+    prompt_decoder = PromptDecoder()
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:  # the last line of an interrupted episode might be incomplete
+            logger.warning("Skip the incomplete record: %s", line[:100])
+            break
+        record_type = record.pop("type")
+        if record_type == "players":
+            interactions["players"] = record["players"]
+        elif record_type == "key":
+            interactions[record["key"]] = record["value"]
+        elif record_type == "turn":
+            interactions["turns"].append([])
+        elif record_type == "event":
+            interactions["turns"][-1].append(record["event"])
+        elif record_type == "blob":
+            prompt_decoder.blobs[record["hash"]] = record["data"]
+        elif record_type == "call":
+            requests.append({"timestamp": record["timestamp"],
+                             "manipulated_prompt_obj": prompt_decoder.decode(record),
+                             "raw_response_obj": prompt_decoder.insert_blobs(record["raw_response_obj"])})
+    return interactions, requests
@@ -0,0 +1,132 @@
+"""
+    Reading and writing of the (optionally compressed) results files. A compressed file has the suffix of its
+    compression, e.g. interactions.json.gz or interactions.json.zst (zstd requires the zstandard package). The reading
+    functions accept either form, so that a results file can be read by its plain name.
+
+    The compressed files are serialized with orjson, if it is installed. The plain files are serialized with json as
+    before, so that their content does not change.
+"""
+import gzip
+import json
+import math
+import os
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def check_compression(compression: Optional[str]):
+    """
+    :raise ValueError: if the compression is not supported (or its package is not installed)
+    """
+    if compression is None:
+        return
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}', choose one of {list(COMPRESSIONS)}")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("The zstd compression requires the zstandard package: pip install zstandard")
+
+
+def dumps(data: Any, fast: bool = False) -> bytes:
+    """
+    :param fast: serialize with orjson, if it is installed; falls back to json for data that orjson does not
+                 serialize the same way, e.g. NaN scores (which orjson writes as null)
+    """
+    if fast and orjson is not None and not _has_non_finite_float(data):
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:  # e.g. integers with more than 64 bits
+            pass
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:  # e.g. NaN as written by json
+            pass
+    return json.loads(data)
+
+
+def _has_non_finite_float(data: Any) -> bool:
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_non_finite_float(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_non_finite_float(value) for value in data)
+    return False
+
+
+def strip_compression_suffix(file_name: str) -> str:
+    for suffix in COMPRESSIONS.values():
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+
+def find_file(file_path: str) -> Optional[str]:
+    """
+    :return: the path of the file either as given or in any compressed form; None, if there is no such file
+    """
+    if os.path.isfile(file_path):
+        return file_path
+    plain_path = strip_compression_suffix(file_path)
+    for path in [plain_path] + [plain_path + suffix for suffix in COMPRESSIONS.values()]:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def write_file(file_path: str, data: bytes, compression: str = None) -> str:
+    """
+    :param file_path: the plain path of the file; the suffix of the compression is added
+    :param compression: gzip, zstd or None
+    :return: the path of the written file
+    """
+    if compression is None:
+        with open(file_path, "wb") as f:
+            f.write(data)
+        return file_path
+    file_path = file_path + COMPRESSIONS[compression]
+    if compression == "gzip":
+        data = gzip.compress(data, compresslevel=6)
+    else:
+        data = zstandard.ZstdCompressor().compress(data)
+    with open(file_path, "wb") as f:
+        f.write(data)
+    return file_path
+
+
+def read_file(file_path: str) -> bytes:
+    """
+    :param file_path: of the file either as plain or as compressed file
+    :raise FileNotFoundError: if there is no such file in any form
+    """
+    found_path = find_file(file_path)
+    if found_path is None:
+        raise FileNotFoundError(file_path)
+    with open(found_path, "rb") as f:
+        data = f.read()
+    if found_path.endswith(COMPRESSIONS["gzip"]):
+        return gzip.decompress(data)
+    if found_path.endswith(COMPRESSIONS["zstd"]):
+        if zstandard is None:
+            raise ValueError(f"Reading {found_path} requires the zstandard package: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def load_json(file_path: str) -> Any:
+    return loads(read_file(file_path))
@@ -0,0 +1,135 @@
+"""
+    A consolidated results store (a single SQLite file in the results directory), which holds the results files of
+    all episodes (instance.json, interactions.json, requests.json, scores.json, transcripts), indexed by dialogue pair,
+    game, experiment and episode. This avoids writing and walking thousands of small files, e.g. on network file
+    systems. The legacy results directory tree can be exported from the store.
+
+    A results directory uses the store, if it contains the results.sqlite file (see file_utils.create_results_store).
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Iterator, Tuple, Any
+
+STORE_FILE_NAME = "results.sqlite"
+# the directory levels below the results root: <dialogue_pair>/<game>/<experiment>/<episode>/<file_name>
+LEVELS = ["dialogue_pair", "game", "experiment", "episode"]
+
+
+class ResultsStore:
+
+    def __init__(self, path: str):
+        """
+        :param path: of the SQLite database file; created if it does not exist
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        # several shard processes might write to the same store, then they wait for each other
+        self.connection = sqlite3.connect(path, timeout=60., check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                    "(dialogue_pair TEXT, game TEXT, experiment TEXT, episode TEXT, file_name TEXT, "
+                                    "data TEXT, PRIMARY KEY (dialogue_pair, game, experiment, episode, file_name))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_by_game_and_file ON results "
+                                    "(game, file_name)")
+
+    @staticmethod
+    def key_for(rel_path: str) -> Tuple[str, str, str, str, str]:
+        """
+        :param rel_path: of a results file relative to the results root, e.g. pair/game/0_exp/episode_0/scores.json
+        :return: the dialogue pair, game, experiment, episode and file name; missing directory levels are ''
+        """
+        parts = [part for part in rel_path.replace(os.sep, "/").split("/") if part and part != "."]
+        directories, file_name = parts[:-1], parts[-1]
+        if len(directories) > len(LEVELS):  # deeper sub-directories are part of the file name
+            file_name = "/".join(directories[len(LEVELS):] + [file_name])
+            directories = directories[:len(LEVELS)]
+        directories = directories + [""] * (len(LEVELS) - len(directories))
+        return tuple(directories) + (file_name,)
+
+    def put(self, rel_path: str, data: Any):
+        """
+        :param rel_path: of the results file relative to the results root
+        :param data: to store; json files are serialized as json
+        """
+        self.put_text(rel_path, json.dumps(data, ensure_ascii=False) if rel_path.endswith(".json") else data)
+
+    def put_text(self, rel_path: str, text: str):
+        """
+        :param text: the serialized results file
+        """
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                                    self.key_for(rel_path) + (text,))
+
+    def get(self, rel_path: str) -> Any:
+        """
+        :raise FileNotFoundError: if there is no such results file in the store
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM results WHERE dialogue_pair = ? AND game = ? "
+                                          "AND experiment = ? AND episode = ? AND file_name = ?",
+                                          self.key_for(rel_path)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"{rel_path} in {self.path}")
+        return json.loads(row[0]) if rel_path.endswith(".json") else row[0]
+
+    def exists(self, rel_path: str) -> bool:
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM results WHERE dialogue_pair = ? AND game = ? "
+                                          "AND experiment = ? AND episode = ? AND file_name = ?",
+                                          self.key_for(rel_path)).fetchone()
+        return row is not None
+
+    def list_dirs(self, *sub_dirs: str) -> List[str]:
+        """
+        :param sub_dirs: the directories of the upper levels, e.g. dialogue pair and game
+        :return: the names of the directories on the next level, as os.listdir() would list them
+        """
+        assert len(sub_dirs) < len(LEVELS), f"There are no directories below the {LEVELS[-1]} level"
+        level = LEVELS[len(sub_dirs)]
+        conditions = " AND ".join(f"{column} = ?" for column in LEVELS[:len(sub_dirs)])
+        query = f"SELECT DISTINCT {level} FROM results WHERE {level} != ''"
+        if conditions:
+            query += " AND " + conditions
+        with self.lock:
+            rows = self.connection.execute(query, sub_dirs).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def iter_files(self, file_name: str, game: str = None) -> Iterator[Tuple[str, str, str, str, Any]]:
+        """
+        :param file_name: of the results files, e.g. scores.json
+        :param game: only the results files of this game. Default: all games
+        :return: the dialogue pair, game, experiment, episode and the data of each results file with the name
+        """
+        query = "SELECT dialogue_pair, game, experiment, episode, data FROM results WHERE file_name = ?"
+        args = (file_name,)
+        if game is not None:
+            query += " AND game = ?"
+            args += (game,)
+        with self.lock:
+            rows = self.connection.execute(query, args).fetchall()
+        for dialogue_pair, game_name, experiment, episode, data in rows:
+            yield dialogue_pair, game_name, experiment, episode, json.loads(data) if file_name.endswith(".json") \
+                else data
+
+    def export(self, results_root: str) -> int:
+        """
+        Write the legacy results directory tree.
+        :param results_root: the directory to write the results files to
+        :return: the number of files written
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT dialogue_pair, game, experiment, episode, file_name, data "
+                                           "FROM results").fetchall()
+        for row in rows:
+            file_path = os.path.join(results_root, *[part for part in row[:4] if part], row[4])
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(row[5])
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,91 @@
+"""
+    Write-behind of the results files: the results files (instance, interactions, requests, experiment configs) are
+    serialized by the caller and written by a background thread, so that the next episode can start while the files
+    of the previous one are written. The number of pending files is bounded, so that a slow disk slows down the
+    episodes instead of filling the memory.
+"""
+import collections
+import queue
+import threading
+from typing import Callable, List, Tuple, Any
+
+import clemgame
+
+logger = clemgame.get_logger(__name__)
+
+
+class ResultsWriter:
+
+    def __init__(self, max_pending: int = 64):
+        """
+        :param max_pending: the maximal number of files waiting to be written; submit() blocks when it is reached
+        """
+        self.queue = queue.Queue(maxsize=max(max_pending, 1))
+        self.errors: List[Tuple[str, Exception]] = []
+        self.lock = threading.Lock()
+        self.pending: collections.Counter = collections.Counter()  # location -> number of submitted writes
+        self.written = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run, name="results-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, location: str, write: Callable[[], Any]):
+        """
+        :param location: of the results file, to report errors
+        :param write: writes the (already serialized) results file
+        """
+        if self.closed:
+            raise RuntimeError("The results writer has been closed")
+        with self.written:
+            self.pending[location] += 1
+        self.queue.put((location, write))
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                location, write = item
+                try:
+                    write()
+                except Exception as e:
+                    logger.exception(f"Cannot write results file {location}")
+                    with self.lock:
+                        self.errors.append((location, e))
+                with self.written:
+                    self.pending[location] -= 1
+                    if self.pending[location] == 0:
+                        del self.pending[location]
+                    self.written.notify_all()
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """ Wait until all submitted files have been written. """
+        self.queue.join()
+
+    def wait_for(self, location_prefix: str):
+        """
+        Wait until the submitted files at the location have been written, but not for the other pending files.
+        :param location_prefix: of the locations to wait for, e.g. a file path (also matching its compressed file)
+                                or a directory path ending with a separator
+        """
+        with self.written:
+            self.written.wait_for(lambda: not any(location.startswith(location_prefix) for location in self.pending))
+
+    def pop_errors(self) -> List[Tuple[str, Exception]]:
+        """
+        :return: the locations and errors of the files which could not be written since the last call
+        """
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def close(self):
+        """ Write all submitted files and stop the background thread. """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
@@ -5,13 +5,15 @@ Auxiliary functions for plots and tables.
 import os
 from pathlib import Path
 
-import json
 import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 from tqdm import tqdm
 
 import clemgame.metrics as clemmetrics
+from clemgame import results_io
+from backends.requests_codec import decode_requests
+from clemgame.results_store import ResultsStore, STORE_FILE_NAME
 
 EVAL_DIR = 'results_eval'
 RESULTS_DIR = './results'
@@ -125,16 +127,35 @@ def name_as_tuple(name: str) -> tuple:
 
 
 def load_json(path: str) -> dict:
-    """Load a json file."""
-    with open(path, 'r') as file:
-        data = json.load(file)
-    return data
+    """Load a json file, also compressed (delta-encoded requests are decoded)."""
+    data = results_io.load_json(str(path))
+    return decode_requests(data)
+
+
+def find_results_files(path: str, file_name: str) -> list:
+    """Find the results files with the name (also compressed) below the path."""
+    # https://stackoverflow.com/a/18394205
+    return [file_path for file_path in Path(path).rglob(f"*{file_name}*")
+            if results_io.strip_compression_suffix(file_path.name).endswith(file_name)]
+
+
+def load_results_store(path: str) -> ResultsStore:
+    """Return the results store of the results directory or None."""
+    store_path = Path(path) / STORE_FILE_NAME
+    return ResultsStore(str(store_path)) if store_path.is_file() else None
 
 
 def load_scores(game_name: str = None, path: str = RESULTS_DIR) -> dict:
     """Get all turn and episodes scores and return them in a dictionary."""
-    # https://stackoverflow.com/a/18394205
-    score_files = list(Path(path).rglob("*scores.json"))
+    store = load_results_store(path)
+    if store is not None:
+        scores = {}
+        for model, game, experiment, episode, data in store.iter_files('scores.json', game_name):
+            naming = (game, model, experiment, episode)
+            scores[naming] = {'turns': data['turn scores'], 'episodes': data['episode scores']}
+        print(f'Retrieved {len(scores)} scores from {store.path}.')
+        return scores
+    score_files = find_results_files(path, "scores.json")
     print(f'Loading {len(score_files)} JSON files.')
     scores = {}
     for path in tqdm(score_files, desc="Loading scores"):
@@ -155,8 +176,16 @@ def load_scores(game_name: str = None, path: str = RESULTS_DIR) -> dict:
 
 def load_interactions(game_name: str = None) -> dict:
     """Get all interaction records and return them in a dictionary."""
-    # https://stackoverflow.com/a/18394205
-    interaction_files = list(Path(RESULTS_DIR).rglob("*interactions.json"))
+    store = load_results_store(RESULTS_DIR)
+    if store is not None:
+        instances = {(model, game, experiment, episode): data for model, game, experiment, episode, data
+                     in store.iter_files('instance.json', game_name)}
+        interactions = {}
+        for model, game, experiment, episode, data in store.iter_files('interactions.json', game_name):
+            interactions[(game, model, experiment, episode)] = (data, instances[(model, game, experiment, episode)])
+        print(f'Retrieved {len(interactions)} interactions from {store.path}.')
+        return interactions
+    interaction_files = find_results_files(RESULTS_DIR, "interactions.json")
     print(f'Loading {len(interaction_files)} JSON files.')
     interactions = {}
     for path in tqdm(interaction_files, desc="Loading interactions"):
@@ -166,7 +195,7 @@ def load_interactions(game_name: str = None) -> dict:
         naming = name_as_tuple(parse_directory_name(path))
         if naming not in interactions:
             data = load_json(path)
-            instance = load_json(str(path).replace('interactions.json', 'instance.json'))
+            instance = load_json(str(path.parent / 'instance.json'))
             interactions[naming] = (data, instance)
         else:
             print(f'Repeated file {naming}!')
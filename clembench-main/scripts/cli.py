@@ -1,5 +1,6 @@
 import argparse
 import json
+import shlex
 from typing import List
 
 from backends import ModelSpec
@@ -20,6 +21,16 @@ from clemgame import benchmark
     If the game supports model expansion (using the single specified model for all players):
     $> python3 scripts/cli.py run -g taboo -m mock
     
+    To run several games with the same (once loaded) model:
+    $> python3 scripts/cli.py run -g taboo wordle -m model1
+
+    To run several games with several models (one game run per line as '<game> <model> [<model>]'):
+    $> python3 scripts/cli.py sweep -f game_runs.txt -p 8 --backend_limits openai=4
+
+    To load a local model once and share it with several runs (in other processes):
+    $> python3 scripts/cli.py serve -m model1 --port 8765
+    $> python3 scripts/cli.py run -g taboo -m "{'model_name':'model1','backend':'model_server'}"
+
     To score all games:
     $> python3 scripts/cli.py score
     
@@ -31,6 +42,15 @@ from clemgame import benchmark
     
     To score a specific game:
     $> python3 scripts/cli.py transcribe -g privateshared
+
+    To store the results of a run in a single results.sqlite file and to export the results files from it:
+    $> python3 scripts/cli.py run -g taboo -m mock --results_store
+    $> python3 scripts/cli.py export -r results
+
+    To append the records of each episode to a records.jsonl file as they happen and to write the interactions.json
+    and requests.json files from them later on:
+    $> python3 scripts/cli.py run -g taboo -m mock --stream_records
+    $> python3 scripts/cli.py assemble -r results
 """
 
 
@@ -47,6 +67,76 @@ def read_model_specs(model_strings: List[str]):
     return model_specs
 
 
+def read_game_runs(file_path: str):
+    game_runs = []
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            game_name, *model_strings = shlex.split(line)
+            game_runs.append((game_name, read_model_specs(model_strings)))
+    return game_runs
+
+
+def read_backend_limits(backend_limits: List[str]):
+    limits = dict()
+    for backend_limit in backend_limits or []:
+        backend_name, limit = backend_limit.split("=")
+        limits[backend_name] = int(limit)
+    return limits
+
+
+def read_response_cache(args: argparse.Namespace):
+    if args.response_cache is None:
+        return None
+    max_bytes = None if args.response_cache_max_mb is None else args.response_cache_max_mb * 1024 * 1024
+    return dict(path=args.response_cache, mode=args.response_cache_mode, max_bytes=max_bytes)
+
+
+def add_response_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--response_cache", type=str,
+                        help="A path to a (SQLite) file which caches the model responses, so that identical "
+                             "requests are not sent to the models again. Default: None (no caching).")
+    parser.add_argument("--response_cache_mode", type=str, default="read_through",
+                        choices=["read_through", "record", "replay"],
+                        help="read_through: use cached responses and store new ones; record: always query the "
+                             "models and store their responses; replay: only use cached responses (fail otherwise). "
+                             "Default: read_through.")
+    parser.add_argument("--response_cache_max_mb", type=int,
+                        help="Remove the least recently used responses when the cache exceeds this size.")
+
+
+def read_record_stream(args: argparse.Namespace):
+    if not args.stream_records:
+        return None
+    return dict(buffer_size=args.records_buffer_size, fsync=args.records_fsync)
+
+
+def add_recording_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--stream_records", action="store_true",
+                        help="Append the interactions and calls of each episode to a records.jsonl file as they "
+                             "happen (prompts as deltas to a previous prompt). Scoring and "
+                             "transcribing read from it. Use 'assemble' to write the interactions.json and "
+                             "requests.json files.")
+    parser.add_argument("--records_buffer_size", type=int, default=64,
+                        help="The number of records buffered before they are written to the file. Default: 64.")
+    parser.add_argument("--records_fsync", type=str, default="flush", choices=["never", "flush", "always"],
+                        help="never: leave it to the OS; flush: fsync when the buffer is written; always: write "
+                             "and fsync each record. Default: flush.")
+    parser.add_argument("--compact_requests", action="store_true",
+                        help="Store the requests.json files delta-encoded: each prompt as the messages appended to "
+                             "a previous prompt and images only once. Scoring, the evaluation scripts and the "
+                             "replay backend decode them.")
+    parser.add_argument("--compress", type=str, choices=["gzip", "zstd"],
+                        help="Compress the json results files, e.g. interactions.json.gz (zstd requires the "
+                             "zstandard package). Scoring, transcribing and the evaluation scripts read them. "
+                             "Default: None.")
+    parser.add_argument("--write_behind", type=int, default=0,
+                        help="The maximal number of results files waiting to be written by a background thread, so "
+                             "that the next episode does not wait for the disk. Default: 0 (write synchronously).")
+
+
 def read_gen_args(args: argparse.Namespace):
     return dict(temperature=args.temperature, max_tokens=args.max_tokens)
 
@@ -60,11 +150,42 @@ def main(args: argparse.Namespace):
                       gen_args=read_gen_args(args),
                       experiment_name=args.experiment_name,
                       instances_name=args.instances_name,
-                      results_dir=args.results_dir)
+                      results_dir=args.results_dir,
+                      parallel=args.parallel,
+                      use_async=args.use_async,
+                      resume=args.resume,
+                      shards=args.shards,
+                      response_cache=read_response_cache(args),
+                      results_store=args.results_store,
+                      record_stream=read_record_stream(args),
+                      compact_requests=args.compact_requests,
+                      compression=args.compress,
+                      write_behind=args.write_behind)
+    if args.command_name == "sweep":
+        benchmark.sweep(read_game_runs(args.file),
+                        gen_args=read_gen_args(args),
+                        instances_name=args.instances_name,
+                        results_dir=args.results_dir,
+                        parallel=args.parallel,
+                        backend_limits=read_backend_limits(args.backend_limits),
+                        resume=args.resume,
+                        response_cache=read_response_cache(args),
+                        results_store=args.results_store,
+                        record_stream=read_record_stream(args),
+                        compact_requests=args.compact_requests,
+                        compression=args.compress,
+                        write_behind=args.write_behind)
+    if args.command_name == "serve":
+        model_spec = read_model_specs([args.model])[0]
+        benchmark.serve(model_spec, host=args.host, port=args.port)
     if args.command_name == "score":
         benchmark.score(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir)
     if args.command_name == "transcribe":
         benchmark.transcripts(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir)
+    if args.command_name == "export":
+        benchmark.export_results(args.results_dir, target_dir=args.target_dir)
+    if args.command_name == "assemble":
+        benchmark.assemble_records(args.results_dir)
 
 
 if __name__ == "__main__":
@@ -89,8 +210,10 @@ if __name__ == "__main__":
       Default: None.""")
     run_parser.add_argument("-e", "--experiment_name", type=str,
                             help="Optional argument to only run a specific experiment")
-    run_parser.add_argument("-g", "--game", type=str,
-                            required=True, help="A specific game name (see ls).")
+    run_parser.add_argument("-g", "--game", type=str, nargs="+",
+                            required=True, help="A specific game name (see ls). Several games can be given, "
+                                                "then these are played one after another with the same models "
+                                                "(local model weights are only loaded once).")
     run_parser.add_argument("-t", "--temperature", type=float, default=0.0,
                             help="Argument to specify sampling temperature for the models. Default: 0.0.")
     run_parser.add_argument("-l", "--max_tokens", type=int, default=100,
@@ -103,6 +226,69 @@ if __name__ == "__main__":
                             help="A relative or absolute path to the results root directory. "
                                  "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
                                  "When not specified, then the results will be located in './results'")
+    run_parser.add_argument("-p", "--parallel", type=int, default=1,
+                            help="The number of episodes to be played at the same time. "
+                                 "This is useful for remote API models which spend most of the time waiting. "
+                                 "Local models should be run with the default. Default: 1.")
+    run_parser.add_argument("--use_async", action="store_true",
+                            help="Play the episodes interleaved within a single event loop instead of worker threads. "
+                                 "Then '-p' gives the number of interleaved episodes.")
+    run_parser.add_argument("--resume", action="store_true",
+                            help="Only play the episodes which have not been recorded yet (or failed) "
+                                 "in the results directory, e.g. after an interrupted run.")
+    run_parser.add_argument("--shards", type=int, default=1,
+                            help="The number of worker processes to split the episodes across. Each worker loads "
+                                 "its own models and logs to clembench.shard_<idx>.log. "
+                                 "This is useful for CPU-bound games or several GPUs. Default: 1.")
+    run_parser.add_argument("--results_store", action="store_true",
+                            help="Store the results in a single results.sqlite file in the results directory "
+                                 "instead of one file per episode and record. Scoring and transcribing read from "
+                                 "it. Use 'export' to write the results files.")
+    add_response_cache_arguments(run_parser)
+    add_recording_arguments(run_parser)
+
+    sweep_parser = sub_parsers.add_parser("sweep", formatter_class=argparse.RawTextHelpFormatter)
+    sweep_parser.add_argument("-f", "--file", type=str, required=True,
+                              help="""A file that lists the game runs, one per line as '<game> <model> [<model>]'.
+
+      For example:
+      taboo gpt-3.5-turbo
+      taboo gpt-4 gpt-3.5-turbo
+      wordle claude-v1.3
+
+      Empty lines and lines starting with '#' are ignored.""")
+    sweep_parser.add_argument("-t", "--temperature", type=float, default=0.0,
+                              help="Argument to specify sampling temperature for the models. Default: 0.0.")
+    sweep_parser.add_argument("-l", "--max_tokens", type=int, default=100,
+                              help="Specify the maximum number of tokens to be generated per turn. Default: 100.")
+    sweep_parser.add_argument("-i", "--instances_name", type=str, default="instances",
+                              help="The instances file name (.json suffix will be added automatically.")
+    sweep_parser.add_argument("-r", "--results_dir", type=str, default="results",
+                              help="A relative or absolute path to the results root directory. "
+                                   "When not specified, then the results will be located in './results'")
+    sweep_parser.add_argument("-p", "--parallel", type=int, default=1,
+                              help="The number of episodes to be played at the same time over all game runs. "
+                                   "Default: 1.")
+    sweep_parser.add_argument("--backend_limits", type=str, nargs="*",
+                              help="The maximal number of episodes played at the same time for a backend "
+                                   "given as <backend>=<limit>, for example: openai=8 anthropic=4.")
+    sweep_parser.add_argument("--resume", action="store_true",
+                              help="Only play the episodes which have not been recorded yet (or failed) "
+                                   "in the results directory, e.g. after an interrupted sweep.")
+    sweep_parser.add_argument("--results_store", action="store_true",
+                              help="Store the results in a single results.sqlite file in the results directory.")
+    add_response_cache_arguments(sweep_parser)
+    add_recording_arguments(sweep_parser)
+
+    serve_parser = sub_parsers.add_parser("serve")
+    serve_parser.add_argument("-m", "--model", type=str, required=True,
+                              help="The (local) model to be loaded once and shared by several runs. These use "
+                                   "the model spec {'model_name':<name>,'backend':'model_server',"
+                                   "'base_url':'http://<host>:<port>'}.")
+    serve_parser.add_argument("--host", type=str, default="localhost",
+                              help="The host name to listen on. Default: localhost.")
+    serve_parser.add_argument("--port", type=int, default=8765,
+                              help="The port to listen on. Default: 8765.")
 
     score_parser = sub_parsers.add_parser("score")
     score_parser.add_argument("-e", "--experiment_name", type=str,
@@ -124,4 +310,16 @@ if __name__ == "__main__":
                                         "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
                                         "When not specified, then the results will be located in './results'")
 
+    export_parser = sub_parsers.add_parser("export")
+    export_parser.add_argument("-r", "--results_dir", type=str, default="results",
+                               help="A relative or absolute path to the results root directory with the "
+                                    "results.sqlite file.")
+    export_parser.add_argument("-o", "--target_dir", type=str,
+                               help="The directory to write the results files to. Default: the results directory.")
+
+    assemble_parser = sub_parsers.add_parser("assemble")
+    assemble_parser.add_argument("-r", "--results_dir", type=str, default="results",
+                                 help="A relative or absolute path to the results root directory with the streamed "
+                                      "records (records.jsonl files).")
+
     main(parser.parse_args())
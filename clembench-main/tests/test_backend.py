@@ -1,7 +1,9 @@
+import threading
 import unittest
 
-from backends import get_model_for, load_model_registry
-from backends.utils import ensure_alternating_roles
+from backends import get_model_for, load_model_registry, ModelSpec, Model, CustomResponseModel
+from backends.ratelimit import rate_limited_stream, get_rate_limiter
+from backends.utils import ensure_alternating_roles, keep_resident, release_resident_models, stream_chat_completion
 
 
 class UtilsTestCase(unittest.TestCase):
@@ -97,6 +99,136 @@ class UtilsTestCase(unittest.TestCase):
         ]
                          )
 
+    def test_keep_resident_loads_once_per_model_spec(self):
+        loaded = []
+
+        @keep_resident
+        def load(model_spec):
+            loaded.append(model_spec.model_name)
+            return object()
+
+        first = load(ModelSpec(model_name="model1", backend="backend1"))
+        self.assertIs(first, load(ModelSpec(backend="backend1", model_name="model1")))
+        self.assertIsNot(first, load(ModelSpec(model_name="model2", backend="backend1")))
+        self.assertEqual(loaded, ["model1", "model2"])
+        release_resident_models()
+        self.assertIsNot(first, load(ModelSpec(model_name="model1", backend="backend1")))
+
+    def test_keep_resident_loads_other_model_specs_concurrently(self):
+        loading = threading.Event()
+        release = threading.Event()
+
+        @keep_resident
+        def load(model_spec):
+            if model_spec.model_name == "slow":
+                loading.set()
+                release.wait(5)
+            return model_spec.model_name
+
+        @keep_resident
+        def load_wrapper(model_spec):  # e.g. a batcher around the resident model
+            return [load(model_spec)]
+
+        slow = threading.Thread(target=load, args=(ModelSpec(model_name="slow"),))
+        slow.start()
+        loading.wait(5)
+        fast = threading.Thread(target=load_wrapper, args=(ModelSpec(model_name="fast"),))
+        fast.start()
+        fast.join(3)
+        self.assertFalse(fast.is_alive())
+        release.set()
+        slow.join(5)
+        self.assertEqual(load_wrapper(ModelSpec(model_name="slow")), ["slow"])
+        release_resident_models()
+
+
+class StreamingModel(Model):
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="streaming"))
+        self.chunks_generated = 0
+
+    def generate_response(self, messages):
+        raise NotImplementedError()
+
+    def stream_response(self, messages):
+        def chunks():
+            for chunk in ["GUESS: ", "apple", "\n", "EXPLANATION: ", "a fruit"]:
+                self.chunks_generated += 1
+                yield chunk
+
+        return messages, chunks()
+
+
+class FakeStream:
+    """ The chunks of a streamed chat completion as returned by the OpenAI client (as dicts). """
+
+    def __init__(self, texts):
+        self.chunks = [{"id": "chatcmpl-1", "model": "gpt-test", "created": 1, "usage": None,
+                        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+                       for text in texts]
+        self.chunks[-1]["choices"][0]["finish_reason"] = "stop"
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class ChatCompletionModel(Model):
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="chat_completion", backend="chat_completion_backend",
+                                   rate_limit={"max_concurrency": 1}))
+        self.stream = None
+
+    def generate_response(self, messages):
+        raise NotImplementedError()
+
+    @rate_limited_stream(tries=1)
+    def stream_response(self, messages):
+        self.stream = FakeStream(["GUESS: ", "apple", "\n", "EXPLANATION: ", "a fruit"])
+        return messages, stream_chat_completion(self.stream)
+
+
+class StreamingTestCase(unittest.TestCase):
+
+    def test_generate_response_with_stop_stops_early(self):
+        model = StreamingModel()
+        _, response, response_text = model.generate_response_with_stop([], lambda text: "\n" in text)
+        self.assertEqual(response_text, "GUESS: apple")
+        self.assertTrue(response["stopped_early"])
+        self.assertEqual(model.chunks_generated, 3)
+
+    def test_streamed_response_keeps_the_response_fields(self):
+        model = ChatCompletionModel()
+        model.set_gen_args(temperature=0.0, max_tokens=10)
+        _, response, response_text = model.generate_response_with_stop([], lambda text: "\n" in text)
+        self.assertEqual(response_text, "GUESS: apple")
+        self.assertEqual(response["model"], "gpt-test")
+        self.assertEqual(response["choices"][0]["message"]["content"], "GUESS: apple\n")
+        self.assertTrue(response["stopped_early"])
+        self.assertTrue(model.stream.closed)
+
+    def test_streamed_response_holds_the_concurrency_slot(self):
+        model = ChatCompletionModel()
+        model.set_gen_args(temperature=0.0, max_tokens=10)
+        concurrency = get_rate_limiter(model.model_spec).concurrency
+        _, chunks = model.stream_response([])
+        self.assertEqual(next(chunks), "GUESS: ")
+        self.assertEqual(concurrency.in_flight, 1)
+        chunks.close()
+        self.assertEqual(concurrency.in_flight, 0)
+        _, chunks = model.stream_response([])
+        chunks.close()  # without being started
+        self.assertEqual(concurrency.in_flight, 0)
+
+    def test_supports_streaming(self):
+        self.assertTrue(StreamingModel().supports_streaming())
+        self.assertFalse(CustomResponseModel().supports_streaming())
+
 
 class ModelTestCase(unittest.TestCase):
     def test_get_backend_for_model1(self):
@@ -0,0 +1,57 @@
+import unittest
+
+from backends import ModelSpec, CustomResponseModel
+from clemgame.history import SlidingWindow, KeepInstructionAndLastTurns, SummarizeOlderTurns, HistoryPolicy
+
+
+class SummaryModel(CustomResponseModel):
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="summarizer"))
+        self.prompts = []
+
+    def generate_response(self, messages):
+        self.prompts.append(messages[-1]["content"])
+        return messages, {}, f"summary {len(self.prompts)}"
+
+
+def history(num_turns: int):
+    messages = [{"role": "system", "content": "system"}, {"role": "user", "content": "instruction"}]
+    for turn in range(num_turns):
+        messages.append({"role": "assistant", "content": f"answer {turn}"})
+        messages.append({"role": "user", "content": f"feedback {turn}"})
+    return messages
+
+
+class HistoryPolicyTestCase(unittest.TestCase):
+
+    def test_sliding_window_starts_with_user_message(self):
+        compacted = SlidingWindow(max_messages=4).compact(history(5), model=None)
+        self.assertEqual([m["content"] for m in compacted], ["system", "feedback 3", "answer 4", "feedback 4"])
+
+    def test_keep_instruction_and_last_turns(self):
+        policy = KeepInstructionAndLastTurns(last_turns=2)
+        compacted = policy.compact(history(5), model=None)
+        self.assertEqual([m["content"] for m in compacted],
+                         ["system", "instruction", "answer 3", "feedback 3", "answer 4", "feedback 4"])
+        self.assertEqual(policy.compact(compacted, model=None), compacted)
+
+    def test_summaries_include_the_previous_summary(self):
+        model = SummaryModel()
+        policy = SummarizeOlderTurns(last_turns=1)
+        compacted = policy.compact(history(3), model)
+        self.assertEqual(compacted[1]["content"], "instruction" + SummarizeOlderTurns.SUMMARY_HEADER + "summary 1")
+        self.assertIn("assistant: answer 0", model.prompts[0])
+        compacted = policy.compact(compacted + history(4)[-2:], model)
+        self.assertEqual(compacted[1]["content"], "instruction" + SummarizeOlderTurns.SUMMARY_HEADER + "summary 2")
+        self.assertIn("summary 1", model.prompts[1])
+        self.assertEqual(len(compacted), 4)
+
+    def test_needs_compaction_without_context_size(self):
+        model = CustomResponseModel()
+        self.assertFalse(HistoryPolicy().needs_compaction(history(3), model))
+        self.assertTrue(HistoryPolicy(context_ratio=None).needs_compaction(history(3), model))
+
+
+if __name__ == '__main__':
+    unittest.main()
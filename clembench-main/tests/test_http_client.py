@@ -0,0 +1,37 @@
+import asyncio
+import unittest
+
+from backends import http_client
+
+
+class HttpClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = dict(http_client._settings)
+
+    def tearDown(self):
+        http_client.configure(**self.settings)
+
+    def test_client_is_shared(self):
+        self.assertIs(http_client.get_client(), http_client.get_client())
+
+    def test_configure_replaces_the_client(self):
+        client = http_client.get_client()
+        http_client.configure(max_connections=4, timeout=5.)
+        self.assertIsNot(http_client.get_client(), client)
+        self.assertEqual(http_client._client_args()["limits"].max_connections, 4)
+        self.assertEqual(http_client.get_client().timeout.read, 5.)
+        with self.assertRaises(AssertionError):
+            http_client.configure(max_pool_size=4)
+
+    def test_async_client_is_shared_per_event_loop(self):
+        async def clients():
+            return http_client.get_async_client(), http_client.get_async_client()
+
+        first, second = asyncio.run(clients())
+        self.assertIs(first, second)
+        self.assertIsNot(asyncio.run(clients())[0], first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
+import threading
+import types
 import unittest
+from unittest import mock
+
+import torch
+from transformers import DynamicCache
 
 import backends
-from backends.huggingface_local_api import check_messages, check_context_limit
+from backends import huggingface_local_api
+from backends.huggingface_local_api import check_messages, check_context_limit, GenerationBatcher, PrefixCache
+from backends.utils import keep_resident, release_resident_models
 
 MODEL_SPEC = backends.ModelSpec(**{
     "model_name": "Mistral-7B-Instruct-v0.1",
@@ -96,5 +104,124 @@ class HuggingfaceLocalTestCase(unittest.TestCase):
         when the full set of clemgames is run by others."""
 
 
+class StubGenerationModel:
+    """ Appends a new token, the eos token and a pad token to each row, as a batch with shorter responses. """
+
+    def __init__(self):
+        self.generation_config = types.SimpleNamespace(pad_token_id=0, eos_token_id=2)
+        self.calls = []
+
+    def generate(self, input_ids, attention_mask=None, **gen_kwargs):
+        self.calls.append((input_ids, attention_mask, gen_kwargs))
+        new_tokens = torch.tensor([[10 + idx, 2, 0] for idx in range(input_ids.shape[0])], dtype=input_ids.dtype)
+        return torch.cat([input_ids, new_tokens], dim=1)
+
+
+class GenerationBatcherTestCase(unittest.TestCase):
+
+    def generate_concurrently(self, batcher, requests):
+        outputs = [None] * len(requests)
+
+        def generate(idx, prompt, gen_kwargs):
+            outputs[idx] = batcher.generate(torch.tensor([prompt]), **gen_kwargs)
+
+        threads = [threading.Thread(target=generate, args=(idx, prompt, gen_kwargs))
+                   for idx, (prompt, gen_kwargs) in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outputs
+
+    def test_prompts_are_left_padded_and_cut_after_eos(self):
+        model = StubGenerationModel()
+        batcher = GenerationBatcher(model, max_batch_size=4, max_wait_ms=500)
+        outputs = self.generate_concurrently(batcher, [([5, 6, 7], dict(do_sample=False)),
+                                                       ([8], dict(do_sample=False))])
+        self.assertEqual(len(model.calls), 1)
+        input_ids, attention_mask, _ = model.calls[0]
+        rows = {tuple(row) for row in input_ids.tolist()}
+        self.assertEqual(rows, {(5, 6, 7), (0, 0, 8)})
+        masks = {tuple(row) for row in attention_mask.tolist()}
+        self.assertEqual(masks, {(1, 1, 1), (0, 0, 1)})
+        self.assertEqual(outputs[0].tolist()[0][:3], [5, 6, 7])
+        self.assertEqual(outputs[1].tolist()[0][0], 8)
+        for output in outputs:  # the eos token ends each response
+            self.assertEqual(output.tolist()[0][-1], 2)
+            self.assertNotIn(0, output.tolist()[0])
+
+    def test_batcher_is_loaded_around_the_resident_model(self):
+        model = StubGenerationModel()
+        model_spec = backends.ModelSpec(model_name="stub", backend="huggingface_local", max_batch_size=4)
+        loaded = []
+        # resident as the model loader, so that the resident batcher loader calls another resident loader
+        load_model = keep_resident(lambda model_spec: model)
+        with mock.patch.object(huggingface_local_api, "load_model", load_model):
+            load_model(model_spec)
+            loading = threading.Thread(
+                target=lambda: loaded.append(huggingface_local_api.load_generation_batcher(model_spec)))
+            loading.start()
+            loading.join(3)
+            self.assertFalse(loading.is_alive())
+            self.assertIs(loaded[0].model, model)
+            self.assertEqual(loaded[0].max_batch_size, 4)
+            self.assertIs(huggingface_local_api.load_generation_batcher(model_spec), loaded[0])
+        release_resident_models()
+
+    def test_only_prompts_with_the_same_gen_kwargs_are_batched(self):
+        model = StubGenerationModel()
+        batcher = GenerationBatcher(model, max_batch_size=4, max_wait_ms=500)
+        self.generate_concurrently(batcher, [([5, 6], dict(do_sample=False)),
+                                             ([7, 8], dict(do_sample=False)),
+                                             ([9], dict(do_sample=True, temperature=.5))])
+        self.assertEqual(sorted(call[0].shape[0] for call in model.calls), [1, 2])
+        for input_ids, _, gen_kwargs in model.calls:
+            self.assertEqual(gen_kwargs["do_sample"], input_ids.shape[0] == 1)
+
+
+class StubCache:
+    """ Stands in for the DynamicCache of a generation with the given number of tokens. """
+
+    def __init__(self, seq_length: int):
+        self.seq_length = seq_length
+
+    def crop(self, max_length: int):
+        self.seq_length = min(self.seq_length, max_length)
+
+    def get_seq_length(self) -> int:
+        return self.seq_length
+
+
+class PrefixCacheTestCase(unittest.TestCase):
+
+    def test_cache_with_longest_common_prefix_is_taken_out(self):
+        prefix_cache = PrefixCache(max_entries=4)
+        shorter, longer = StubCache(3), StubCache(4)
+        prefix_cache.put(torch.tensor([1, 2, 9]), shorter)
+        prefix_cache.put(torch.tensor([1, 2, 3, 4]), longer)
+        self.assertIs(prefix_cache.pop(torch.tensor([[1, 2, 3, 4, 5, 6]])), longer)
+        self.assertEqual(longer.get_seq_length(), 4)
+        self.assertIs(prefix_cache.pop(torch.tensor([[1, 2, 3, 4, 5, 6]])), shorter)  # not shared
+        self.assertIsInstance(prefix_cache.pop(torch.tensor([[1, 2, 3]])), DynamicCache)
+
+    def test_cache_is_cropped_to_the_common_prefix(self):
+        prefix_cache = PrefixCache(max_entries=4)
+        diverged = StubCache(5)
+        prefix_cache.put(torch.tensor([1, 2, 3, 4, 5]), diverged)
+        self.assertIs(prefix_cache.pop(torch.tensor([[1, 2, 3, 7, 8]])), diverged)  # e.g. a reprompt
+        self.assertEqual(diverged.get_seq_length(), 3)
+        same = StubCache(3)
+        prefix_cache.put(torch.tensor([1, 2, 3]), same)
+        prefix_cache.pop(torch.tensor([[1, 2, 3]]))
+        self.assertEqual(same.get_seq_length(), 2)  # generate() has to encode at least the last prompt token
+
+    def test_least_recently_put_caches_are_evicted(self):
+        prefix_cache = PrefixCache(max_entries=1)
+        prefix_cache.put(torch.tensor([1, 2]), StubCache(2))
+        prefix_cache.put(torch.tensor([3, 4]), StubCache(2))
+        self.assertEqual(len(prefix_cache.entries), 1)
+        self.assertIsInstance(prefix_cache.pop(torch.tensor([[1, 2, 5]])), DynamicCache)
+
+
 if __name__ == '__main__':
     unittest.main()
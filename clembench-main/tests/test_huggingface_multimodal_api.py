@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+import torch
+from PIL import Image
+from transformers import BatchFeature
+
+from backends import huggingface_multimodal_api
+from backends.huggingface_multimodal_api import load_image, process_images
+
+
+class StubImageProcessor:
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, images, return_tensors="pt"):
+        self.calls += 1
+        return BatchFeature({"pixel_values": torch.zeros(len(images), 3, 4, 4)})
+
+
+class StubProcessor:
+
+    def __init__(self):
+        self.image_processor = StubImageProcessor()
+
+
+class HuggingfaceMultimodalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        huggingface_multimodal_api.preprocessed_images.clear()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_path = os.path.join(self.temp_dir.name, "image.png")
+        Image.new("RGB", (4, 4)).save(self.image_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_decoded_images_are_cached(self):
+        self.assertIs(load_image(self.image_path), load_image(self.image_path))
+        self.assertEqual(huggingface_multimodal_api.preprocessed_images.total_bytes, 4 * 4 * 3)
+
+    def test_processed_images_are_cached_per_processor(self):
+        processor = StubProcessor()
+        messages = [{"role": "user", "content": "What is this?", "image": [self.image_path]}]
+        features = process_images(processor, "processor1", messages)
+        self.assertIs(process_images(processor, "processor1", messages), features)
+        self.assertEqual(processor.image_processor.calls, 1)
+        process_images(processor, "processor2", messages)
+        self.assertEqual(processor.image_processor.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
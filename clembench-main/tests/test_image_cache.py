@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+from backends.image_cache import ImageCache
+
+
+class ImageCacheTestCase(unittest.TestCase):
+
+    def test_image_is_encoded_again_when_modified(self):
+        cache = ImageCache()
+        loads = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_path = os.path.join(temp_dir, "image.png")
+            with open(image_path, "wb") as f:
+                f.write(b"image")
+            load = lambda: loads.append(image_path) or ("payload", "image/png")
+            cache.get_or_load("openai", image_path, load)
+            cache.get_or_load("openai", image_path, load)
+            self.assertEqual(len(loads), 1)
+            cache.get_or_load("anthropic", image_path, load)
+            self.assertEqual(len(loads), 2)
+            os.utime(image_path, (0, 0))
+            cache.get_or_load("openai", image_path, load)
+            self.assertEqual(len(loads), 3)
+
+    def test_least_recently_used_images_are_evicted(self):
+        cache = ImageCache(max_bytes=10)
+        cache.get_or_load("openai", "http://image1", lambda: "x" * 6)
+        cache.get_or_load("openai", "http://image2", lambda: "y" * 6)
+        self.assertEqual([key[1] for key in cache.entries], ["http://image2"])
+
+    def test_size_of_processed_images(self):
+        cache = ImageCache(max_bytes=100)
+        size_of = lambda pixel_values: len(pixel_values) * 4  # e.g. float32 tensors
+        cache.get_or_load("processed", ("http://image1", "http://image2"), lambda: [0.] * 20, size_of=size_of)
+        self.assertEqual(cache.total_bytes, 80)
+        cache.get_or_load("processed", ("http://image1", "http://image3"), lambda: [0.] * 20, size_of=size_of)
+        self.assertEqual([key[1] for key in cache.entries], [(("http://image1", None), ("http://image3", None))])
+        self.assertEqual(cache.total_bytes, 80)
+
+
+if __name__ == '__main__':
+    unittest.main()
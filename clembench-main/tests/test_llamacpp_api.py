@@ -0,0 +1,58 @@
+import types
+import unittest
+from unittest import mock
+
+import backends
+from backends import llamacpp_api
+
+MODEL_SPEC = dict(model_name="llama-test", backend="llamacpp", huggingface_id="test/llama-test-GGUF",
+                  filename="*Q4_K_M.gguf", premade_chat_template=True, eos_to_cull="</s>")
+
+
+class StubLlama:
+
+    def __init__(self):
+        self.cache = None
+        self.chat_handler = None
+        self._n_ctx = 4096
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+
+class LlamaCPPPromptCacheTestCase(unittest.TestCase):
+
+    def load(self, **model_spec):
+        stub_llama = StubLlama()
+        with mock.patch.object(llamacpp_api, "load_model", return_value=stub_llama), \
+                mock.patch.object(llamacpp_api, "get_chat_formatter", return_value=None), \
+                mock.patch.object(llamacpp_api.llama_cpp, "LlamaRAMCache",
+                                  side_effect=lambda capacity: types.SimpleNamespace(kind="ram", capacity=capacity)), \
+                mock.patch.object(llamacpp_api.llama_cpp, "LlamaDiskCache",
+                                  side_effect=lambda cache_dir, capacity: types.SimpleNamespace(
+                                      kind="disk", cache_dir=cache_dir, capacity=capacity)):
+            llamacpp_api.LlamaCPPLocalModel(backends.ModelSpec(**MODEL_SPEC, **model_spec))
+        return stub_llama
+
+    def test_no_prompt_cache_by_default(self):
+        self.assertIsNone(self.load().cache)
+
+    def test_ram_cache(self):
+        cache = self.load(prompt_cache_bytes=1024).cache
+        self.assertEqual((cache.kind, cache.capacity), ("ram", 1024))
+
+    def test_disk_cache_with_default_size(self):
+        cache = self.load(prompt_cache_dir="/tmp/llama-cache").cache
+        self.assertEqual((cache.kind, cache.cache_dir, cache.capacity), ("disk", "/tmp/llama-cache", 2 << 30))
+
+    def test_cache_of_resident_model_is_kept(self):
+        stub_llama = StubLlama()
+        stub_llama.cache = "cache of a previous run"
+        with mock.patch.object(llamacpp_api, "load_model", return_value=stub_llama), \
+                mock.patch.object(llamacpp_api, "get_chat_formatter", return_value=None):
+            llamacpp_api.LlamaCPPLocalModel(backends.ModelSpec(**MODEL_SPEC, prompt_cache_bytes=1024))
+        self.assertEqual(stub_llama.cache, "cache of a previous run")
+
+
+if __name__ == '__main__':
+    unittest.main()
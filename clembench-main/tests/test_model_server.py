@@ -0,0 +1,70 @@
+import threading
+import time
+import unittest
+
+import httpx
+
+from backends import Model, ModelSpec, ContextExceededError
+from backends.model_server import ModelServer
+from backends.model_server_api import ModelServerModel
+
+
+class EchoModel(Model):
+    """ Records which requests are generated at the same time (as by the batcher of huggingface_local). """
+
+    def __init__(self, max_batch_size: int = 1):
+        super().__init__(ModelSpec(model_name="echo", max_batch_size=max_batch_size))
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def generate_response(self, messages):
+        if messages[-1]["content"] == "too long":
+            raise ContextExceededError(tokens_used=10, tokens_left=-5, context_size=5)
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(.05)
+        with self.lock:
+            self.in_flight -= 1
+        return messages, {"temperature": self.get_temperature()}, messages[-1]["content"]
+
+
+class ModelServerTestCase(unittest.TestCase):
+
+    def test_pending_requests_with_the_same_gen_args_are_batched(self):
+        model = EchoModel(max_batch_size=4)
+        server = ModelServer(model, port=0)
+        futures = [server.submit([{"role": "user", "content": f"request {idx}"}], dict(temperature=0.0))
+                   for idx in range(3)]
+        futures.append(server.submit([{"role": "user", "content": "request 3"}], dict(temperature=1.0)))
+        server.worker.start()
+        self.assertEqual([future.result(timeout=5)[2] for future in futures],
+                         ["request 0", "request 1", "request 2", "request 3"])
+        self.assertEqual([future.result()[1]["temperature"] for future in futures], [0.0, 0.0, 0.0, 1.0])
+        self.assertEqual(model.max_in_flight, 3)
+        server.shutdown()
+
+    def test_round_trip(self):
+        model = EchoModel()
+        server = ModelServer(model, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with httpx.Client(base_url=server.address, timeout=5) as client:
+                remote_model = ModelServerModel(client, ModelSpec(model_name="echo", backend="model_server"))
+                remote_model.set_gen_args(temperature=0.0, max_tokens=10)
+                prompt, response, response_text = remote_model.generate_response(
+                    [{"role": "user", "content": "Hello"}])
+                self.assertEqual(response_text, "Hello")
+                self.assertEqual(prompt, [{"role": "user", "content": "Hello"}])
+                with self.assertRaises(ContextExceededError):
+                    remote_model.generate_response([{"role": "user", "content": "too long"}])
+                self.assertEqual(client.get("/info").json()["model_spec"]["model_name"], "echo")
+        finally:
+            server.http_server.shutdown()
+            thread.join(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
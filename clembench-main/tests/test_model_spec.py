@@ -50,6 +50,33 @@ class ModelSpecTestCase(unittest.TestCase):
         entry = ModelSpec(model_name="model_a", backend="backend_b")
         self.assertEqual(query.unify(entry), ModelSpec(model_name="model_a", backend="backend_b", quantization="8bit"))
 
+    def test_nested_query_unifies_with_entry_to_union(self):
+        query = ModelSpec(model_name="model_a", rate_limit={"rpm": 10})
+        entry = ModelSpec(model_name="model_a", rate_limit={"tpm": 100})
+        self.assertEqual(query.unify(entry), ModelSpec(model_name="model_a", rate_limit={"rpm": 10, "tpm": 100}))
+
+    def test_nested_query_unifies_with_entry_fails(self):
+        query = ModelSpec(model_name="model_a", rate_limit={"rpm": 10})
+        entry = ModelSpec(model_name="model_a", rate_limit={"rpm": 20})
+        with self.assertRaises(ValueError):
+            query.unify(entry)
+
+    def test_different_specs_are_not_equal(self):
+        self.assertNotEqual(ModelSpec(model_name="model_a"), ModelSpec(model_name="model_b"))
+        self.assertNotEqual(ModelSpec(model_name="model_a"), ModelSpec(model_name="model_a", backend="backend_a"))
+
+    def test_equal_specs_have_equal_hashes(self):
+        spec = ModelSpec(model_name="model_a", backend="backend_a", additional_files=["a", "b"], rate_limit={"rpm": 1})
+        other = ModelSpec(rate_limit={"rpm": 1}, additional_files=["a", "b"], backend="backend_a", model_name="model_a")
+        self.assertEqual(hash(spec), hash(other))
+        self.assertEqual(len({spec, other}), 1)
+
+    def test_set_attribute_throws_error(self):
+        spec = ModelSpec(model_name="model_a")
+        with self.assertRaises(AttributeError):
+            spec.model_name = "model_b"
+
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+
+from backends import CustomResponseModel
+from clemgame.clemgame import DialogueGameMaster, Player
+
+
+class EchoPlayer(Player):
+
+    def _custom_response(self, messages, turn_idx) -> str:
+        return messages[-1]["content"]
+
+
+class EchoGameMaster(DialogueGameMaster):
+
+    def __init__(self, num_turns: int = 2):
+        super().__init__("echo", {}, [CustomResponseModel()])
+        self.num_turns = num_turns
+
+    def _on_setup(self, **kwargs):
+        self.add_player(EchoPlayer(self.player_models[0]))
+
+    def _does_game_proceed(self):
+        return self.current_turn < self.num_turns
+
+    def _on_before_turn(self, turn_idx: int):
+        self.add_user_message(self.get_players()[0], f"turn {turn_idx}")
+
+
+class OwnPlayGameMaster(EchoGameMaster):
+
+    def play(self) -> None:
+        self.played = True
+
+
+class PlayAsyncTestCase(unittest.TestCase):
+
+    def test_play_async_plays_the_turns(self):
+        game_master = EchoGameMaster(num_turns=2)
+        game_master.setup()
+        asyncio.run(game_master.play_async())
+        self.assertEqual(game_master.current_turn, 2)
+        self.assertEqual(len(game_master.interactions["turns"]), 2)
+
+    def test_play_async_respects_an_overwritten_play(self):
+        game_master = OwnPlayGameMaster()
+        game_master.setup()
+        asyncio.run(game_master.play_async())
+        self.assertTrue(game_master.played)
+        self.assertEqual(game_master.current_turn, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+
+from backends import Model, ModelSpec
+from backends.ratelimit import TokenBucket, AdaptiveConcurrency, rate_limited, rate_limited_async, retry_after_of, \
+    is_rate_limit_error, without_rate_limit
+
+
+class RateLimitError(Exception):
+
+    def __init__(self, headers):
+        super().__init__("Too many requests")
+        self.status_code = 429
+        self.response = type("Response", (), dict(headers=headers, status_code=429))()
+
+
+class FlakyModel(Model):
+
+    def __init__(self, failures: int):
+        super().__init__(ModelSpec(model_name="flaky", backend="flaky_backend"))
+        self.failures = failures
+        self.calls = 0
+
+    @rate_limited(tries=3)
+    def generate_response(self, messages):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RateLimitError({"retry-after-ms": "1"})
+        return messages, {}, "answer"
+
+
+class SingleSlotModel(Model):
+    """ Without an asynchronous client: generate_response_async() falls back to the blocking call. """
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="single_slot", backend="single_slot_backend",
+                                   rate_limit={"max_concurrency": 1}))
+
+    @rate_limited(tries=1)
+    def generate_response(self, messages):
+        return messages, {}, "answer"
+
+    @rate_limited_async(tries=1)
+    async def generate_response_async(self, messages):
+        return await asyncio.to_thread(without_rate_limit(self.generate_response), messages)
+
+
+class RateLimitTestCase(unittest.TestCase):
+
+    def test_token_bucket_delays_when_empty(self):
+        bucket = TokenBucket(per_minute=60)
+        self.assertEqual(bucket.reserve(60), 0.)
+        self.assertAlmostEqual(bucket.reserve(1), 1., places=1)
+
+    def test_adaptive_concurrency_halves_on_rate_limit(self):
+        concurrency = AdaptiveConcurrency(max_concurrency=8)
+        concurrency.acquire()
+        concurrency.release(rate_limited=True)
+        self.assertEqual(concurrency.limit, 4.)
+        for _ in range(4):
+            concurrency.acquire()
+            concurrency.release()
+        self.assertGreater(concurrency.limit, 4.)
+
+    def test_retry_after_headers(self):
+        self.assertEqual(retry_after_of(RateLimitError({"retry-after": "2"})), 2.)
+        self.assertEqual(retry_after_of(RateLimitError({"retry-after-ms": "500"})), .5)
+        self.assertIsNone(retry_after_of(ValueError()))
+        self.assertTrue(is_rate_limit_error(RateLimitError({})))
+
+    def test_rate_limited_retries(self):
+        model = FlakyModel(failures=2)
+        model.set_gen_args(temperature=0.0, max_tokens=10)
+        self.assertEqual(model.generate_response([])[2], "answer")
+        with self.assertRaises(RateLimitError):
+            FlakyModel(failures=3).generate_response([])
+
+    def test_async_fallback_does_not_acquire_twice(self):
+        model = SingleSlotModel()
+        model.set_gen_args(temperature=0.0, max_tokens=10)
+
+        async def call():
+            return await asyncio.wait_for(model.generate_response_async([]), timeout=5)
+
+        self.assertEqual(asyncio.run(call())[2], "answer")
+
+
+if __name__ == '__main__':
+    unittest.main()
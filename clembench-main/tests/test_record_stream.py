@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+
+from clemgame import file_utils
+from clemgame.clemgame import GameRecorder, is_episode_recorded
+from clemgame.record_stream import RecordStream, assemble_records, is_complete
+
+
+class RecordStreamTestCase(unittest.TestCase):
+
+    def test_prompts_are_stored_as_deltas_and_reassembled(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            stream = RecordStream(os.path.join(results_dir, "records.jsonl"), buffer_size=2)
+            history = [{"role": "user", "content": "instruction"}]
+            prompts = []
+            for turn in range(3):
+                prompts.append(list(history))
+                stream.append_call(str(turn), history, {"response": turn})
+                stream.append_call(str(turn), [{"role": "user", "content": f"other {turn}"}], None)
+                history.append({"role": "assistant", "content": f"response {turn}"})
+                history.append({"role": "user", "content": f"turn {turn}"})
+            stream.close()
+            with open(stream.file_path, encoding="utf-8") as f:
+                records = f.read()
+        self.assertTrue(is_complete(records))
+        calls = [json.loads(line) for line in records.splitlines()[:-1]]
+        self.assertEqual(calls[4]["prompt_delta"], {"base": 2, "keep": 3, "append": prompts[2][3:]})
+        self.assertNotIn("prompt_delta", calls[5])
+        _, requests = assemble_records(records.splitlines())
+        self.assertEqual([request["manipulated_prompt_obj"] for request in requests[::2]], prompts)
+        self.assertEqual(requests[5]["manipulated_prompt_obj"], [{"role": "user", "content": "other 2"}])
+
+    def test_streamed_records_are_loaded_as_interactions_and_requests(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            recorder = GameRecorder("game")
+            recorder.stream_records(results_dir, "pair", "0_exp/episode_0", fsync="never")
+            recorder.log_players({"GM": "Game master", "Player 1": "Player"})
+            recorder.log_next_turn()
+            recorder.log_event("GM", "Player 1", {"type": "send message", "content": "hello"})
+            recorder.log_event("Player 1", "GM", {"type": "get message", "content": "hi"},
+                               call=([{"role": "user", "content": "hello"}], {"text": "hi"}))
+            recorder.log_key("success", True)
+            self.assertEqual(recorder.requests, [])
+            self.assertFalse(is_episode_recorded(results_dir, "pair", "game", "0_exp/episode_0"))
+            recorder.store_records(results_dir, "pair", "0_exp/episode_0")
+            self.assertTrue(is_episode_recorded(results_dir, "pair", "game", "0_exp/episode_0"))
+            interactions = file_utils.load_results_json("0_exp/episode_0/interactions", results_dir, "pair", "game")
+            self.assertEqual(interactions, recorder.interactions)
+            requests = file_utils.load_results_json("0_exp/episode_0/requests", results_dir, "pair", "game")
+            self.assertEqual(requests[0]["manipulated_prompt_obj"], [{"role": "user", "content": "hello"}])
+
+
+if __name__ == '__main__':
+    unittest.main()
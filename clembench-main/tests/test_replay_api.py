@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import unittest
+
+from backends import ModelSpec, replay_api
+from backends.replay_api import Replay, ReplayMissError
+from clemgame import file_utils
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Who won the world series in 2020?"}
+]
+
+
+def call(prompt, response_text, model_name="gpt-4-0613"):
+    return {"timestamp": "2024-01-01T00:00:00",
+            "manipulated_prompt_obj": prompt,
+            "raw_response_obj": {"id": response_text, "clem_player": {"response": response_text,
+                                                                      "model_name": model_name}}}
+
+
+class ReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.results_dir = self.temp_dir.name
+        replay_api.set_requests_loader(file_utils.load_results_requests)
+
+    def tearDown(self):
+        replay_api.set_requests_loader(None)
+        self.temp_dir.cleanup()
+
+    def record(self, episode_dir, calls):
+        episode_path = os.path.join(self.results_dir, "pair", "game", "0_exp", episode_dir)
+        os.makedirs(episode_path)
+        with open(os.path.join(episode_path, "requests.json"), "w") as f:
+            json.dump(calls, f)
+
+    def model(self, model_name="gpt-4-0613"):
+        return Replay().get_model_for(ModelSpec(model_name=model_name, backend="replay", results_dir=self.results_dir))
+
+    def test_recorded_responses_are_replayed_once_in_order(self):
+        self.record("episode_0", [call(MESSAGES, "The Dodgers")])
+        self.record("episode_1", [call(MESSAGES, "The Los Angeles Dodgers")])
+        model = self.model()
+        self.assertEqual(model.generate_response(MESSAGES)[2], "The Dodgers")
+        prompt, response, response_text = model.generate_response(MESSAGES)
+        self.assertEqual(response_text, "The Los Angeles Dodgers")
+        self.assertNotIn("clem_player", response)
+        with self.assertRaises(ReplayMissError):  # instead of returning the first response again
+            model.generate_response(MESSAGES)
+
+    def test_only_the_exact_messages_are_matched(self):
+        self.record("episode_0", [call(MESSAGES, "The Dodgers")])
+        model = self.model()
+        with self.assertRaises(ReplayMissError):
+            model.generate_response([{"role": "user", "content": "Who won the world series"}])
+        with self.assertRaises(ReplayMissError):
+            self.model("claude-3").generate_response(MESSAGES)
+
+    def test_encoded_prompts_are_matched_by_their_text(self):
+        prompt = [{"role": "user", "content": [{"type": "text", "text": "Who won the world series in 2020?"},
+                                               {"type": "image_url", "image_url": {"url": "http://image"}}]}]
+        self.record("episode_0", [call(prompt, "The Dodgers"),
+                                  call({"inputs": "<s>[INST] Who won? [/INST]"}, "Nobody", model_name="mistral")])
+        model = self.model()
+        self.assertEqual(model.generate_response(MESSAGES)[2], "The Dodgers")
+
+    def test_compressed_requests_are_replayed(self):
+        file_utils.set_compression("gzip")
+        try:
+            file_utils.store_game_results_file([call(MESSAGES, "The Dodgers")], "requests.json", "pair", "game",
+                                               sub_dir="0_exp/episode_0", root_dir=self.results_dir)
+        finally:
+            file_utils.set_compression(None)
+        self.assertEqual(self.model().generate_response(MESSAGES)[2], "The Dodgers")
+
+    def test_requests_loader_is_required(self):
+        replay_api.set_requests_loader(None)
+        with self.assertRaises(RuntimeError):
+            self.model()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+
+from backends.requests_codec import encode_requests, decode_requests, is_encoded
+from clemgame import file_utils
+
+IMAGE = "data:image/png;base64," + base64.b64encode(bytes(range(256)) * 8).decode()
+
+
+def chat_requests(turns: int):
+    history = [{"role": "user", "content": [{"type": "text", "text": "instruction"},
+                                            {"type": "image_url", "image_url": {"url": IMAGE}}]}]
+    requests = []
+    for turn in range(turns):
+        requests.append({"timestamp": str(turn), "manipulated_prompt_obj": list(history),
+                         "raw_response_obj": {"response": f"response {turn}"}})
+        requests.append({"timestamp": str(turn), "manipulated_prompt_obj": {"inputs": f"text prompt {turn}"},
+                         "raw_response_obj": None})
+        history += [{"role": "assistant", "content": f"response {turn}"},
+                    {"role": "user", "content": f"turn {turn}"}]
+    return requests
+
+
+class RequestsCodecTestCase(unittest.TestCase):
+
+    def test_requests_are_decoded_as_recorded(self):
+        requests = chat_requests(10)
+        encoded = encode_requests(requests)
+        self.assertTrue(is_encoded(encoded))
+        self.assertEqual(list(encoded["blobs"].values()), [IMAGE])
+        self.assertEqual(encoded["requests"][4]["prompt_delta"], {"base": 2, "keep": 3, "append": [
+            {"role": "assistant", "content": "response 1"}, {"role": "user", "content": "turn 1"}]})
+        self.assertLess(len(json.dumps(encoded)), len(json.dumps(requests)) / 4)
+        self.assertEqual(decode_requests(json.loads(json.dumps(encoded))), requests)
+        self.assertIs(decode_requests(requests), requests)
+
+    def test_compact_requests_are_stored_and_loaded(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            file_utils.set_compact_requests(True)
+            try:
+                file_utils.store_game_results_file(chat_requests(2), "requests.json", "pair", "game",
+                                                   sub_dir="0_exp/episode_0", root_dir=results_dir)
+            finally:
+                file_utils.set_compact_requests(False)
+            with open(os.path.join(results_dir, "pair/game/0_exp/episode_0/requests.json")) as f:
+                self.assertTrue(is_encoded(json.load(f)))
+            self.assertEqual(file_utils.load_results_json("0_exp/episode_0/requests", results_dir, "pair", "game"),
+                             chat_requests(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
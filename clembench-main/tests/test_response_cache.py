@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from backends import Model, ModelSpec
+from backends.response_cache import ResponseCache, ResponseCacheMissError
+
+
+class CountingModel(Model):
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="counting"))
+        self.calls = 0
+
+    def generate_response(self, messages):
+        self.calls += 1
+        return messages, {"response": "answer"}, "answer"
+
+
+class StreamingModel(CountingModel):
+
+    def stream_response(self, messages):
+        self.calls += 1
+        return messages, (chunk for chunk in ["first line\n", "second line"])
+
+    def count_tokens(self, messages):
+        return 42
+
+
+def first_line(text: str) -> bool:
+    return "\n" in text
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "responses.sqlite")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def wrap(self, mode):
+        model = CountingModel()
+        cached_model = ResponseCache(self.path, mode=mode).wrap(model)
+        cached_model.set_gen_args(temperature=0.0, max_tokens=100)
+        return model, cached_model
+
+    def test_read_through_answers_repeated_requests_from_cache(self):
+        model, cached_model = self.wrap("read_through")
+        messages = [{"role": "user", "content": "Hello"}]
+        self.assertEqual(cached_model.generate_response(messages)[2], "answer")
+        self.assertEqual(cached_model.generate_response(messages)[2], "answer")
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(cached_model.cache.hit_rate(), .5)
+
+    def test_cache_key_includes_gen_args(self):
+        model, cached_model = self.wrap("read_through")
+        messages = [{"role": "user", "content": "Hello"}]
+        cached_model.generate_response(messages)
+        cached_model.set_gen_arg("temperature", 1.0)
+        cached_model.generate_response(messages)
+        self.assertEqual(model.calls, 2)
+
+    def test_replay_fails_on_cache_miss(self):
+        self.wrap("record")[1].generate_response([{"role": "user", "content": "Hello"}])
+        model, cached_model = self.wrap("replay")
+        self.assertEqual(cached_model.generate_response([{"role": "user", "content": "Hello"}])[2], "answer")
+        with self.assertRaises(ResponseCacheMissError):
+            cached_model.generate_response([{"role": "user", "content": "Bye"}])
+        self.assertEqual(model.calls, 0)
+
+    def test_cache_is_shared_by_concurrent_connections(self):
+        # e.g. the shard processes of a run
+        first_model, first_cached_model = self.wrap("read_through")
+        second_model, second_cached_model = self.wrap("read_through")
+        self.assertEqual(first_cached_model.cache.connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        blocking = sqlite3.connect(self.path)
+        blocking.execute("BEGIN IMMEDIATE")  # another shard is writing
+        writing = threading.Thread(target=first_cached_model.generate_response,
+                                   args=([{"role": "user", "content": "Hello"}],))
+        writing.start()
+        writing.join(0.1)
+        self.assertTrue(writing.is_alive())  # waits instead of failing with 'database is locked'
+        blocking.rollback()
+        blocking.close()
+        writing.join(5)
+        self.assertEqual(second_cached_model.generate_response([{"role": "user", "content": "Hello"}])[2], "answer")
+        self.assertEqual((first_model.calls, second_model.calls), (1, 0))
+
+    def test_record_counts_misses(self):
+        model, cached_model = self.wrap("record")
+        cached_model.generate_response([{"role": "user", "content": "Hello"}])
+        self.assertEqual(cached_model.cache.misses, 1)
+        self.assertEqual(cached_model.cache.hit_rate(), 0.)
+
+    def test_streaming_and_token_counts_are_delegated(self):
+        model = StreamingModel()
+        cached_model = ResponseCache(self.path).wrap(model)
+        cached_model.set_gen_args(temperature=0.0, max_tokens=100)
+        messages = [{"role": "user", "content": "Hello"}]
+        self.assertTrue(cached_model.supports_streaming())
+        self.assertEqual(cached_model.count_tokens(messages), 42)
+        self.assertEqual(cached_model.generate_response_with_stop(messages, first_line)[2], "first line")
+        self.assertEqual(cached_model.generate_response_with_stop(messages, first_line)[2], "first line")
+        self.assertEqual(model.calls, 1)
+        self.assertEqual(cached_model.generate_response(messages)[2], "answer")  # not the early stopped response
+        self.assertEqual(model.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import math
+import os
+import tempfile
+import unittest
+
+from clemgame import results_io
+from clemgame import file_utils
+
+INTERACTIONS = {"players": {"GM": "Game master"}, "turns": [[{"from": "GM", "to": "Player 1", "action": "ü"}]]}
+
+
+class ResultsIoTestCase(unittest.TestCase):
+
+    def test_compressed_files_are_read_by_their_plain_name(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            file_path = os.path.join(results_dir, "interactions.json")
+            written_path = results_io.write_file(file_path, results_io.dumps(INTERACTIONS), compression="gzip")
+            self.assertEqual(written_path, file_path + ".gz")
+            self.assertEqual(results_io.find_file(file_path), written_path)
+            self.assertEqual(results_io.load_json(file_path), INTERACTIONS)
+            self.assertEqual(results_io.load_json(written_path), INTERACTIONS)
+            with self.assertRaises(FileNotFoundError):
+                results_io.read_file(os.path.join(results_dir, "requests.json"))
+
+    @unittest.skipIf(results_io.zstandard is None, "requires the zstandard package")
+    def test_zstd_compression(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            file_path = os.path.join(results_dir, "interactions.json")
+            results_io.write_file(file_path, results_io.dumps(INTERACTIONS), compression="zstd")
+            self.assertEqual(results_io.load_json(file_path), INTERACTIONS)
+
+    def test_results_files_are_stored_compressed(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            file_utils.store_game_results_file(INTERACTIONS, "interactions.json", "pair", "game",
+                                               sub_dir="0_exp/episode_0", root_dir=results_dir)
+            file_utils.set_compression("gzip")
+            try:
+                file_utils.store_game_results_file(INTERACTIONS, "interactions.json", "pair", "game",
+                                                   sub_dir="0_exp/episode_0", root_dir=results_dir)
+                file_utils.store_game_results_file("<html/>", "transcript.html", "pair", "game",
+                                                   sub_dir="0_exp/episode_0", root_dir=results_dir)
+            finally:
+                file_utils.set_compression(None)
+            self.assertEqual(sorted(os.listdir(os.path.join(results_dir, "pair/game/0_exp/episode_0"))),
+                             ["interactions.json.gz", "transcript.html"])  # the plain file of before is removed
+            self.assertTrue(file_utils.results_file_exists("0_exp/episode_0/interactions.json", results_dir,
+                                                           "pair", "game"))
+            self.assertEqual(file_utils.load_results_json("0_exp/episode_0/interactions", results_dir, "pair", "game"),
+                             INTERACTIONS)
+
+    def test_plain_files_are_serialized_as_before(self):
+        scores = {"episode scores": {"Main Score": float("nan"), "Aborted": 1}}
+        self.assertEqual(results_io.dumps(scores), json.dumps(scores, ensure_ascii=False).encode("utf-8"))
+        for fast in [False, True]:  # orjson would write NaN as null
+            loaded = results_io.loads(results_io.dumps(scores, fast=fast))
+            self.assertTrue(math.isnan(loaded["episode scores"]["Main Score"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
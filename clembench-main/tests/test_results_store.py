@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import unittest
+
+from clemgame import file_utils
+from clemgame.results_store import ResultsStore
+
+
+class ResultsStoreTestCase(unittest.TestCase):
+
+    def test_key_for_results_paths(self):
+        self.assertEqual(ResultsStore.key_for("pair/game/0_exp/episode_0/scores.json"),
+                         ("pair", "game", "0_exp", "episode_0", "scores.json"))
+        self.assertEqual(ResultsStore.key_for("pair/game/0_exp/experiment_exp.json"),
+                         ("pair", "game", "0_exp", "", "experiment_exp.json"))
+
+    def test_store_lists_and_exports_results(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            store = ResultsStore(os.path.join(results_dir, "results.sqlite"))
+            store.put("pair/game/0_exp/episode_0/interactions.json", {"turns": []})
+            store.put("pair/game/0_exp/episode_1/transcript.html", "<html/>")
+            store.put("pair/game/0_exp/experiment_exp.json", {"name": "exp"})
+            self.assertEqual(store.list_dirs(), ["pair"])
+            self.assertEqual(store.list_dirs("pair", "game"), ["0_exp"])
+            self.assertEqual(store.list_dirs("pair", "game", "0_exp"), ["episode_0", "episode_1"])
+            self.assertEqual(store.get("pair/game/0_exp/episode_0/interactions.json"), {"turns": []})
+            with self.assertRaises(FileNotFoundError):
+                store.get("pair/game/0_exp/episode_1/interactions.json")
+            with tempfile.TemporaryDirectory() as target_dir:
+                self.assertEqual(store.export(target_dir), 3)
+                with open(os.path.join(target_dir, "pair/game/0_exp/episode_0/interactions.json")) as f:
+                    self.assertEqual(json.load(f), {"turns": []})
+            store.close()
+
+    def test_results_files_are_stored_in_the_results_store(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            file_utils.create_results_store(results_dir)
+            file_utils.store_game_results_file({"game_id": 1}, "instance.json", "pair", "game",
+                                               sub_dir="0_exp/episode_0", root_dir=results_dir)
+            self.assertEqual(os.listdir(results_dir), ["results.sqlite"])
+            self.assertEqual(file_utils.load_results_json("0_exp/episode_0/instance", results_dir, "pair", "game"),
+                             {"game_id": 1})
+            self.assertTrue(file_utils.results_file_exists("0_exp/episode_0/instance.json", results_dir,
+                                                           "pair", "game"))
+            self.assertEqual(file_utils.list_results_dirs(results_dir, "pair", "game", "0_exp"), ["episode_0"])
+            file_utils.results_store_for(results_dir).close()
+
+
+if __name__ == '__main__':
+    unittest.main()
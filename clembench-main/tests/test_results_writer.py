@@ -0,0 +1,72 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from clemgame import file_utils
+from clemgame.results_writer import ResultsWriter
+
+
+class ResultsWriterTestCase(unittest.TestCase):
+
+    def test_files_are_written_in_the_background_and_errors_are_kept(self):
+        written = []
+        release = threading.Event()
+
+        def fail():
+            raise OSError("disk full")
+
+        writer = ResultsWriter(max_pending=4)
+        writer.submit("first", lambda: release.wait(5) and written.append("first"))
+        writer.submit("second", fail)
+        writer.submit("third", lambda: written.append("third"))
+        self.assertEqual(written, [])
+        release.set()
+        writer.flush()
+        self.assertEqual(written, ["first", "third"])
+        errors = writer.pop_errors()
+        self.assertEqual([location for location, _ in errors], ["second"])
+        self.assertEqual(writer.pop_errors(), [])
+        writer.close()
+        with self.assertRaises(RuntimeError):
+            writer.submit("fourth", lambda: None)
+
+    def test_only_the_requested_files_are_waited_for(self):
+        release = threading.Event()
+        writer = ResultsWriter(max_pending=4)
+        writer.submit("/results/pair/game/0_exp/episode_0/instance.json", lambda: None)
+        writer.submit("/results/pair/game/0_exp/episode_1/interactions.json.gz", lambda: release.wait(5))
+        writer.wait_for("/results/pair/game/0_exp/episode_0/instance.json")
+        self.assertFalse(release.is_set())
+        waiting = threading.Thread(target=writer.wait_for, args=("/results/pair/game/0_exp/episode_1/",))
+        waiting.start()
+        waiting.join(0.1)
+        self.assertTrue(waiting.is_alive())
+        release.set()
+        waiting.join(5)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(writer.pending, {})
+        writer.close()
+
+    def test_results_files_are_serialized_when_stored(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            file_utils.set_results_writer(8)
+            try:
+                interactions = {"players": {}, "turns": []}
+                file_utils.store_game_results_file(interactions, "interactions.json", "pair", "game",
+                                                   sub_dir="0_exp/episode_0", root_dir=results_dir)
+                interactions["turns"].append([])
+                self.assertEqual(file_utils.load_results_json("0_exp/episode_0/interactions", results_dir,
+                                                              "pair", "game"), {"players": {}, "turns": []})
+                # a file cannot be written below a file
+                file_utils.store_game_results_file({}, "scores.json", "pair", "game",
+                                                   sub_dir="0_exp/episode_0/interactions.json", root_dir=results_dir)
+                errors = file_utils.flush_results_writer()
+                self.assertEqual(len(errors), 1)
+                self.assertTrue(errors[0][0].endswith(os.path.join("interactions.json", "scores.json")))
+            finally:
+                file_utils.set_results_writer(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from backends import ModelSpec
+from clemgame import benchmark, file_utils
+from clemgame.clemgame import ExperimentRun, parse_duration
+
+PROGRAMMATIC = ModelSpec(model_name="programmatic")
+GEN_ARGS = dict(temperature=0.0, max_tokens=100)
+
+
+class ResumeTestCase(unittest.TestCase):
+
+    def test_resumed_run_keeps_the_timestamp_and_adds_the_duration(self):
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                mock.patch.object(ExperimentRun, "play_episode", return_value=True):  # no episode is recorded
+            results_dir = os.path.join(temp_dir, "results")
+            benchmark.run("hellogame", [PROGRAMMATIC], GEN_ARGS, experiment_name="greet_en", results_dir=results_dir)
+            dialogue_pair = file_utils.list_results_dirs(results_dir)[0]
+            first_config = file_utils.load_results_json("0_greet_en/experiment_greet_en", results_dir,
+                                                        dialogue_pair, "hellogame")
+            file_utils.store_game_results_file(dict(first_config, duration="1:00:00"), "experiment_greet_en.json",
+                                               dialogue_pair, "hellogame", sub_dir="0_greet_en", root_dir=results_dir)
+            benchmark.run("hellogame", [PROGRAMMATIC], GEN_ARGS, experiment_name="greet_en", results_dir=results_dir,
+                          resume=True)
+            resumed_config = file_utils.load_results_json("0_greet_en/experiment_greet_en", results_dir,
+                                                          dialogue_pair, "hellogame")
+        self.assertNotIn("resumed", first_config)
+        self.assertEqual(resumed_config["timestamp"], first_config["timestamp"])
+        self.assertGreater(resumed_config["resumed"], first_config["timestamp"])
+        self.assertTrue(timedelta(hours=1) < parse_duration(resumed_config["duration"]) < timedelta(hours=1, minutes=1))
+
+    def test_merged_shards_of_a_resumed_run_keep_the_timestamp(self):
+        time_start = datetime(2024, 1, 2)
+        summaries = [dict(game_name="hellogame", results_root="results", dialogue_pair_desc="pair",
+                          experiment_record_dir="0_greet_en", experiment_config=dict(timestamp="2024-01-01T00:00:00"),
+                          time_start=time_start, time_end=time_start + timedelta(minutes=shard_idx + 1),
+                          previous_duration=timedelta(hours=1), error_count=0)
+                     for shard_idx in range(2)]
+        experiment_config = benchmark._merge_shard_summaries(summaries)[0]["experiment_config"]
+        self.assertEqual(experiment_config["timestamp"], "2024-01-01T00:00:00")
+        self.assertEqual(experiment_config["resumed"], time_start.isoformat())
+        self.assertEqual(experiment_config["duration"], "1:02:00")
+
+    def test_parse_duration(self):
+        for duration in [timedelta(seconds=62.5), timedelta(days=1, hours=2), timedelta(days=3, microseconds=7)]:
+            self.assertEqual(parse_duration(str(duration)), duration)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from backends import ModelSpec
+from clemgame import benchmark
+from clemgame.clemgame import ExperimentRun
+
+PROGRAMMATIC = ModelSpec(model_name="programmatic")
+
+
+class SweepTestCase(unittest.TestCase):
+
+    def test_limits_must_allow_an_episode(self):
+        with self.assertRaises(ValueError):
+            benchmark.sweep([("hellogame", [PROGRAMMATIC])], gen_args={}, parallel=0)
+        with self.assertRaises(ValueError):
+            benchmark.sweep([("hellogame", [PROGRAMMATIC])], gen_args={}, backend_limits={"openai": 0})
+
+    def test_failed_episode_does_not_abort_the_sweep(self):
+        play_episode = ExperimentRun.play_episode
+        played = []
+
+        def fail_first_episode(experiment_run, episode_id, game_instance):
+            if episode_id == 0:
+                raise OSError("Cannot store the instance")
+            played.append(episode_id)
+            return play_episode(experiment_run, episode_id, game_instance)
+
+        with tempfile.TemporaryDirectory() as results_dir, \
+                mock.patch.object(ExperimentRun, "play_episode", fail_first_episode), \
+                mock.patch.object(ExperimentRun, "finish", autospec=True) as finish:
+            benchmark.sweep([("hellogame", [PROGRAMMATIC])], gen_args=dict(temperature=0.0, max_tokens=100),
+                            results_dir=os.path.join(results_dir, "results"), parallel=2)
+        self.assertTrue(played)
+        episodes_played = [call.args[1] for call in finish.call_args_list]
+        self.assertTrue(all(episodes_played))
+        self.assertTrue(any(False in episodes for episodes in episodes_played))
+
+
+if __name__ == '__main__':
+    unittest.main()
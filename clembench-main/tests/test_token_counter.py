@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+from backends import ModelSpec, ContextExceededError
+from backends import token_counter
+from backends.ratelimit import estimate_tokens
+from backends.token_counter import TokenCounter, ensure_context_limit
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Who won the world series in 2020?"}
+]
+
+
+class TokenCounterTestCase(unittest.TestCase):
+
+    def test_tokenizers_are_cached_and_evicted(self):
+        counter = TokenCounter(max_tokenizers=2)
+        spec1 = ModelSpec(model_name="model1", backend="openai")
+        tokenizer = counter.get_tokenizer(spec1)
+        self.assertIs(counter.get_tokenizer(ModelSpec(model_name="model1", backend="openai")), tokenizer)
+        counter.get_tokenizer(ModelSpec(model_name="model2", backend="openai"))
+        counter.get_tokenizer(ModelSpec(model_name="model3", backend="openai"))
+        self.assertEqual(len(counter.tokenizers), 2)
+        self.assertIsNot(counter.get_tokenizer(spec1), tokenizer)
+
+    def test_context_limit_is_only_checked_for_known_context_size(self):
+        counter = TokenCounter()
+        fits, tokens_used, tokens_left, context_size = counter.check_context_limit(
+            ModelSpec(model_name="model", backend="openai"), MESSAGES, max_new_tokens=100)
+        self.assertTrue(fits)
+        self.assertGreater(tokens_used, 100)
+        self.assertIsNone(context_size)
+        fits, _, tokens_left, context_size = counter.check_context_limit(
+            ModelSpec(model_name="model", backend="openai", context_size=110), MESSAGES, max_new_tokens=100)
+        self.assertFalse(fits)
+        self.assertLess(tokens_left, 0)
+        self.assertEqual(context_size, 110)
+
+    def test_ensure_context_limit_raises(self):
+        spec = ModelSpec(model_name="small_model", backend="openai", context_size=50)
+        self.assertGreater(ensure_context_limit(spec, MESSAGES, max_new_tokens=10), 10)
+        with self.assertRaises(ContextExceededError):
+            ensure_context_limit(spec, MESSAGES, max_new_tokens=100)
+
+    def test_tokens_are_approximated_if_tiktoken_cannot_be_loaded(self):
+        with mock.patch.object(token_counter.importlib.util, "find_spec", return_value=object()), \
+                mock.patch.object(token_counter, "TiktokenTokenizer", side_effect=OSError("offline")):
+            tokenizer = token_counter.load_tokenizer(ModelSpec(model_name="model", backend="openai", context_size=10))
+        self.assertIs(type(tokenizer), token_counter.Tokenizer)
+        self.assertEqual(tokenizer.context_size, 10)
+
+    def test_tokens_are_only_estimated_for_limited_models(self):
+        model = mock.Mock(model_spec=ModelSpec(model_name="model", backend="openai"))
+        with mock.patch.object(token_counter, "load_tokenizer") as load_tokenizer:
+            self.assertEqual(estimate_tokens(model, MESSAGES), 0)
+        load_tokenizer.assert_not_called()
+        model = mock.Mock(model_spec=ModelSpec(model_name="model", backend="openai", rate_limit={"tpm": 1000}))
+        model.get_max_tokens.return_value = 10
+        self.assertGreater(estimate_tokens(model, MESSAGES), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()